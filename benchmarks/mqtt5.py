@@ -0,0 +1,231 @@
+"""Benchmark the MQTT 5 features: subscription identifiers and topic aliases.
+
+Dispatch compares the CPU time to find the subscriptions of received
+messages by topic matching, with and without the match cache, against
+looking up the subscription identifiers the broker sent along. It runs
+without a broker.
+
+Bandwidth compares the bytes sent for QoS 0 publishes on long topics with
+and without topic aliases. It needs a MQTT 5 broker that allows topic
+aliases, for example mosquitto 2.
+
+Usage:
+    python benchmarks/mqtt5.py [host] [port] [messages]
+"""
+import importlib.util
+import os
+import random
+import sys
+import time
+import uuid
+
+import paho.mqtt.client as mqtt
+from paho.mqtt.packettypes import PacketTypes
+from paho.mqtt.properties import Properties
+
+
+def _load(name):
+    """Load a standalone module from the mqtt component without Home Assistant."""
+    path = os.path.join(os.path.dirname(__file__), "..", "mqtt", name + ".py")
+    spec = importlib.util.spec_from_file_location("mqtt_" + name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+matcher = _load("matcher")
+mqtt5 = _load("mqtt5")
+
+DEVICES = 2000
+TOPICS_PER_DEVICE = 5
+CACHE_SIZE = 4096
+
+
+def build_subscriptions():
+    """Subscribe like a setup with many devices and a few wildcards."""
+    topic_matcher = matcher.TopicMatcher()
+    subscription_ids = mqtt5.SubscriptionIds()
+    ids = {}
+    filters = ["homeassistant/#", "+/status"]
+    for device in range(DEVICES):
+        filters.append("zigbee2mqtt/device{}".format(device))
+        filters.append("tele/device{}/+".format(device))
+    for topic_filter in filters:
+        topic_matcher.add(topic_filter, topic_filter)
+        properties = subscription_ids.properties(topic_filter)
+        ids[topic_filter] = properties.SubscriptionIdentifier[0]
+    return topic_matcher, subscription_ids, ids
+
+
+def build_messages(topic_matcher, ids, count):
+    """Return messages tagged with identifiers the way the broker would."""
+    topics = []
+    for device in range(DEVICES):
+        topics.append("zigbee2mqtt/device{}".format(device))
+        for index in range(TOPICS_PER_DEVICE - 1):
+            topics.append("tele/device{}/sensor{}".format(device, index))
+
+    messages = []
+    for _ in range(count):
+        topic = random.choice(topics)
+        msg = mqtt.MQTTMessage(topic=topic.encode())
+        msg.properties = Properties(PacketTypes.PUBLISH)
+        msg.properties.SubscriptionIdentifier = [
+            ids[topic_filter] for topic_filter in topic_matcher.match(topic)
+        ]
+        messages.append(msg)
+    return messages
+
+
+def bench_dispatch(count):
+    """Time finding the subscriptions of received messages."""
+    topic_matcher, subscription_ids, ids = build_subscriptions()
+    messages = build_messages(topic_matcher, ids, count)
+    cache = matcher.MatchCache(CACHE_SIZE)
+
+    def match(msg):
+        return tuple(topic_matcher.match(msg.topic))
+
+    def match_cached(msg):
+        topic = msg.topic
+        subscriptions = cache.get(topic)
+        if subscriptions is None:
+            subscriptions = tuple(topic_matcher.match(topic))
+            cache.put(topic, subscriptions)
+        return subscriptions
+
+    def by_id(msg):
+        topic_filters = subscription_ids.filters(msg)
+        if len(topic_filters) == 1:
+            return tuple(topic_matcher.get(topic_filters[0]))
+        return tuple(
+            subscription
+            for topic_filter in topic_filters
+            for subscription in topic_matcher.get(topic_filter)
+        )
+
+    def by_checked_id(msg):
+        # Resuming a session without its saved identifiers, they may be stale
+        topic = msg.topic
+        for topic_filter in subscription_ids.filters(msg):
+            if not matcher.match_topic(topic_filter, topic):
+                return match(msg)
+        return by_id(msg)
+
+    print(
+        "dispatch of {} messages on {} topics, {} filters".format(
+            count, DEVICES * TOPICS_PER_DEVICE, len(ids)
+        )
+    )
+    for name, func in (
+        ("topic matching", match),
+        ("matching with cache", match_cached),
+        ("subscription ids", by_id),
+        ("checked ids", by_checked_id),
+    ):
+        start = time.perf_counter()
+        for msg in messages:
+            func(msg)
+        elapsed = time.perf_counter() - start
+        print(
+            "  {:22} {:7.3f} s  {:6.2f} us/msg".format(
+                name, elapsed, elapsed / count * 1e6
+            )
+        )
+
+
+class CountingSocket:
+    """Socket wrapper counting the bytes paho sends."""
+
+    def __init__(self, sock):
+        """Wrap a connected socket."""
+        self._sock = sock
+        self.sent = 0
+
+    def send(self, data):
+        """Send data and count what was written."""
+        sent = self._sock.send(data)
+        self.sent += sent
+        return sent
+
+    def __getattr__(self, name):
+        """Delegate everything else to the socket."""
+        return getattr(self._sock, name)
+
+
+def publish_bytes(host, port, topics, count, use_aliases):
+    """Publish count QoS 0 messages and return the bytes sent and alias maximum."""
+    connack = {}
+
+    def on_connect(_client, _userdata, _flags, _reason, properties):
+        connack["alias_maximum"] = getattr(properties, "TopicAliasMaximum", 0)
+
+    client = mqtt.Client(protocol=mqtt.MQTTv5)
+    client.on_connect = on_connect
+    client.connect(host, port, 60)
+    deadline = time.monotonic() + 5
+    while "alias_maximum" not in connack:
+        if time.monotonic() > deadline:
+            raise OSError("no MQTT 5 CONNACK")
+        try:
+            client.loop(0.1)
+        except AssertionError:
+            # Paho can't parse the CONNACK of a MQTT 3.1.1 broker
+            raise OSError("broker doesn't support MQTT 5")
+
+    aliases = mqtt5.TopicAliases()
+    aliases.reset(connack["alias_maximum"] if use_aliases else 0)
+    sock = client._sock = CountingSocket(client.socket())
+    for index in range(count):
+        topic, properties = aliases.get(topics[index % len(topics)])
+        client.publish(
+            topic, '{"state": "ON", "brightness": 254}', 0, False, properties
+        )
+        if index % 100 == 0:
+            client.loop(0)
+    while client.want_write():
+        client.loop_write()
+
+    client.disconnect()
+    return sock.sent, connack["alias_maximum"]
+
+
+def bench_bandwidth(host, port, count):
+    """Compare the bytes sent with and without topic aliases."""
+    prefix = "bench/{}".format(uuid.uuid4().hex[:8])
+    topics = [
+        "{}/homeassistant/light/living_room_ceiling_{}/set".format(prefix, index)
+        for index in range(10)
+    ]
+    try:
+        plain, _ = publish_bytes(host, port, topics, count, False)
+        aliased, maximum = publish_bytes(host, port, topics, count, True)
+    except OSError as err:
+        print("bandwidth: can't connect to {}:{} ({})".format(host, port, err))
+        return
+
+    print("bandwidth of {} publishes on {} topics".format(count, len(topics)))
+    if not maximum:
+        print("  broker doesn't allow topic aliases")
+        return
+    print("  without topic aliases {:9d} bytes".format(plain))
+    print(
+        "  with topic aliases    {:9d} bytes ({:.0f}% less)".format(
+            aliased, (1 - aliased / plain) * 100
+        )
+    )
+
+
+def main():
+    """Run the benchmarks."""
+    host = sys.argv[1] if len(sys.argv) > 1 else "localhost"
+    port = int(sys.argv[2]) if len(sys.argv) > 2 else 1883
+    count = int(sys.argv[3]) if len(sys.argv) > 3 else 100000
+
+    random.seed(0)
+    bench_dispatch(count)
+    bench_bandwidth(host, port, count)
+
+
+if __name__ == "__main__":
+    main()
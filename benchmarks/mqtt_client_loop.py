@@ -0,0 +1,163 @@
+"""Benchmark the threaded paho loop against the asyncio client loop.
+
+Measures publish round-trip latency (publish on one topic, receive it back
+through a subscription on the same client) and inbound throughput (messages
+published by a second client and handed to the event loop).
+
+Needs a running broker. Usage:
+    python benchmarks/mqtt_client_loop.py [host] [port] [messages]
+"""
+import asyncio
+import importlib.util
+import os
+import statistics
+import sys
+import time
+import uuid
+
+import paho.mqtt.client as mqtt
+
+
+def _load(name):
+    """Load a standalone module from the mqtt component without Home Assistant."""
+    path = os.path.join(os.path.dirname(__file__), "..", "mqtt", name + ".py")
+    spec = importlib.util.spec_from_file_location("mqtt_" + name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+client_loop = _load("client_loop")
+
+
+class Client:
+    """Minimal stand-in for the MQTT class using either client loop."""
+
+    def __init__(self, loop, mode, host, port):
+        """Create the paho client."""
+        self.loop = loop
+        self.mode = mode
+        self.host = host
+        self.port = port
+        self.lock = asyncio.Lock()
+        self.received = asyncio.Queue()
+        self.connected = loop.create_future()
+        self.mqttc = mqtt.Client()
+        self.mqttc.on_connect = self._on_connect
+        self.mqttc.on_message = self._on_message
+        self.asyncio_loop = None
+        if mode == client_loop.CLIENT_LOOP_ASYNCIO:
+            self.asyncio_loop = client_loop.AsyncioClientLoop(loop, self.mqttc)
+
+    def _on_connect(self, *_):
+        self.loop.call_soon_threadsafe(self.connected.set_result, True)
+
+    def _on_message(self, _mqttc, _userdata, msg):
+        now = time.perf_counter()
+        if self.asyncio_loop is not None:
+            self.received.put_nowait((now, msg))
+        else:
+            self.loop.call_soon_threadsafe(self.received.put_nowait, (now, msg))
+
+    async def connect(self):
+        """Connect and start network processing."""
+        await self.loop.run_in_executor(
+            None, self.mqttc.connect, self.host, self.port, 60
+        )
+        if self.asyncio_loop is None:
+            self.mqttc.loop_start()
+        await self.connected
+
+    async def call(self, func, *args):
+        """Call paho the way the MQTT class does for the selected mode."""
+        if self.asyncio_loop is not None:
+            return func(*args)
+        async with self.lock:
+            return await self.loop.run_in_executor(None, func, *args)
+
+    async def disconnect(self):
+        """Disconnect and stop network processing."""
+        await self.call(self.mqttc.disconnect)
+        if self.asyncio_loop is None:
+            self.mqttc.loop_stop()
+        else:
+            self.asyncio_loop.stop()
+
+
+async def bench_latency(client, topic, count):
+    """Measure publish to receive round trip latency."""
+    await client.call(client.mqttc.subscribe, topic, 0)
+    await asyncio.sleep(0.5)
+    latencies = []
+    for index in range(count):
+        start = time.perf_counter()
+        await client.call(client.mqttc.publish, topic, str(index), 0, False)
+        await client.received.get()
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    return (
+        statistics.median(latencies) * 1000,
+        latencies[int(len(latencies) * 0.99) - 1] * 1000,
+    )
+
+
+async def bench_throughput(loop, client, host, port, topic, count):
+    """Measure inbound messages per second handed to the event loop."""
+    await client.call(client.mqttc.subscribe, topic, 0)
+    await asyncio.sleep(0.5)
+
+    blaster = mqtt.Client()
+    blaster.connect(host, port, 60)
+    blaster.loop_start()
+
+    received = 0
+    start = time.perf_counter()
+    await loop.run_in_executor(
+        None, lambda: [blaster.publish(topic, "x" * 64) for _ in range(count)]
+    )
+    try:
+        while received < count:
+            await asyncio.wait_for(client.received.get(), 5)
+            received += 1
+    except asyncio.TimeoutError:
+        pass
+    elapsed = time.perf_counter() - start
+
+    blaster.disconnect()
+    blaster.loop_stop()
+    return received / elapsed, received
+
+
+async def run(mode, host, port, count):
+    """Run both benchmarks for a client loop mode."""
+    loop = asyncio.get_running_loop()
+    client = Client(loop, mode, host, port)
+    await client.connect()
+    prefix = "bench/{}".format(uuid.uuid4().hex[:8])
+
+    p50, p99 = await bench_latency(client, prefix + "/latency", min(count, 1000))
+    rate, received = await bench_throughput(
+        loop, client, host, port, prefix + "/throughput", count
+    )
+    await client.disconnect()
+
+    print(
+        "{:8} publish latency p50 {:6.2f} ms  p99 {:6.2f} ms  "
+        "inbound {:8.0f} msg/s ({} of {} received)".format(
+            mode, p50, p99, rate, received, count
+        )
+    )
+
+
+def main():
+    """Run the benchmark for both client loop modes."""
+    host = sys.argv[1] if len(sys.argv) > 1 else "localhost"
+    port = int(sys.argv[2]) if len(sys.argv) > 2 else 1883
+    count = int(sys.argv[3]) if len(sys.argv) > 3 else 10000
+
+    for mode in (client_loop.CLIENT_LOOP_THREAD, client_loop.CLIENT_LOOP_ASYNCIO):
+        asyncio.run(run(mode, host, port, count))
+
+
+if __name__ == "__main__":
+    main()
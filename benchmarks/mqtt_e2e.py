@@ -0,0 +1,383 @@
+"""End-to-end benchmark of MQTT entities in Home Assistant.
+
+Starts the hbmqtt broker used by the embedded MQTT server in its own
+process, sets up Home Assistant with the mqtt component from this
+repository and a number of sensor, binary sensor, JSON light and climate
+entities, then publishes synthetic state updates to them at increasing
+rates from a publisher process.
+
+Every payload carries the time it was published, which the entities pick
+up as a state attribute. For each rate it reports:
+- the sustained rate of messages that reached a state write
+- p50 and p99 latency from publishing to the first state write
+- the share of time the event loop was busy instead of waiting in select
+It also reports the memory allocated per entity during their setup.
+
+Needs Home Assistant, hbmqtt and paho-mqtt installed.
+
+Usage:
+    python benchmarks/mqtt_e2e.py [--sensors N] [--binary-sensors N]
+        [--lights N] [--climates N] [--rates R,R,...] [--duration S]
+"""
+import argparse
+import asyncio
+import importlib
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import socket
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import paho.mqtt.client as mqtt
+
+from homeassistant import auth, config_entries, core
+from homeassistant.const import EVENT_STATE_CHANGED
+from homeassistant.setup import async_setup_component
+
+COMPONENT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "mqtt")
+
+# Wait this long for messages still on their way after a rate step
+DRAIN_TIMEOUT = 10  # seconds
+
+
+def free_port():
+    """Return a free local TCP port."""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def run_broker(config_dir, port, ready):
+    """Run the hbmqtt broker of the embedded MQTT server on a port."""
+    sys.path.insert(0, config_dir)
+    from hbmqtt.broker import Broker
+    from custom_components.mqtt import server
+
+    # hbmqtt logs an error for every client that disconnects
+    logging.getLogger("hbmqtt").setLevel(logging.CRITICAL)
+    config, _ = server.generate_config(None, None, None)
+    config["listeners"] = {
+        "default": {"bind": "127.0.0.1:{}".format(port), "type": "tcp"}
+    }
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    loop.run_until_complete(Broker(config, loop).start())
+    ready.set()
+    loop.run_forever()
+
+
+def make_config_dir():
+    """Return a temporary config dir with the mqtt component of the repository."""
+    config_dir = tempfile.mkdtemp()
+    os.mkdir(os.path.join(config_dir, "custom_components"))
+    os.symlink(
+        os.path.abspath(COMPONENT),
+        os.path.join(config_dir, "custom_components", "mqtt"),
+    )
+    sys.path.insert(0, config_dir)
+    return config_dir
+
+
+def start_broker(config_dir, port):
+    """Start the broker process and wait until it accepts connections."""
+    ready = multiprocessing.Event()
+    broker = multiprocessing.Process(
+        target=run_broker, args=(config_dir, port, ready), daemon=True
+    )
+    broker.start()
+    ready.wait()
+    return broker
+
+
+def entity_configs(counts):
+    """Return the platform configs and topics with payload kinds."""
+    platforms = {"sensor": [], "binary_sensor": [], "light": [], "climate": []}
+    topics = []
+    for index in range(counts["sensor"]):
+        topic = "bench/sensor/{}".format(index)
+        platforms["sensor"].append(
+            {
+                "platform": "mqtt",
+                "name": "bench sensor {}".format(index),
+                "state_topic": topic,
+                "value_template": "{{ value_json.value }}",
+                "json_attributes_topic": topic,
+            }
+        )
+        topics.append((topic, "sensor"))
+    for index in range(counts["binary_sensor"]):
+        topic = "bench/binary_sensor/{}".format(index)
+        platforms["binary_sensor"].append(
+            {
+                "platform": "mqtt",
+                "name": "bench binary sensor {}".format(index),
+                "state_topic": topic,
+                "value_template": "{{ value_json.state }}",
+                "json_attributes_topic": topic,
+            }
+        )
+        topics.append((topic, "binary_sensor"))
+    for index in range(counts["light"]):
+        topic = "bench/light/{}".format(index)
+        platforms["light"].append(
+            {
+                "platform": "mqtt",
+                "schema": "json",
+                "name": "bench light {}".format(index),
+                "state_topic": topic,
+                "command_topic": topic + "/set",
+                "brightness": True,
+                "json_attributes_topic": topic,
+            }
+        )
+        topics.append((topic, "light"))
+    for index in range(counts["climate"]):
+        topic = "bench/climate/{}".format(index)
+        platforms["climate"].append(
+            {
+                "platform": "mqtt",
+                "name": "bench climate {}".format(index),
+                "current_temperature_topic": topic,
+                "current_temperature_template": "{{ value_json.temperature }}",
+                "json_attributes_topic": topic,
+            }
+        )
+        topics.append((topic, "climate"))
+    return platforms, topics
+
+
+def payload(kind, sequence):
+    """Return a payload for an entity kind, stamped with the current time."""
+    if kind == "sensor":
+        data = {"value": sequence}
+    elif kind == "binary_sensor":
+        data = {"state": "ON" if sequence % 2 else "OFF"}
+    elif kind == "light":
+        data = {"state": "ON", "brightness": sequence % 255}
+    else:
+        data = {"temperature": 18 + sequence % 100 / 10}
+    data["ts"] = time.time()
+    return json.dumps(data)
+
+
+def publish(port, topics, rate, duration, start):
+    """Publish to the topics round robin at a rate for a duration."""
+    client = mqtt.Client()
+    client.connect("127.0.0.1", port, 60)
+    client.loop_start()
+    start.wait()
+    began = time.monotonic()
+    sent = 0
+    while True:
+        elapsed = time.monotonic() - began
+        if elapsed >= duration:
+            break
+        # Catch up with the schedule in small bursts
+        due = int(elapsed * rate)
+        while sent < due:
+            topic, kind = topics[sent % len(topics)]
+            client.publish(topic, payload(kind, sent), 0)
+            sent += 1
+        time.sleep(0.005)
+    while client.want_write():
+        time.sleep(0.01)
+    client.disconnect()
+    client.loop_stop()
+
+
+class LoopMonitor:
+    """Measure the time the event loop spends waiting in select."""
+
+    def __init__(self, loop):
+        """Wrap the select of the loop."""
+        self.idle = 0.0
+        selector = loop._selector  # pylint: disable=protected-access
+        select = selector.select
+
+        def timed_select(timeout=None):
+            start = time.perf_counter()
+            try:
+                return select(timeout)
+            finally:
+                self.idle += time.perf_counter() - start
+
+        selector.select = timed_select
+
+
+class StateRecorder:
+    """Record the latency of the first state write of each message."""
+
+    def __init__(self, hass):
+        """Listen to state changes."""
+        self.latencies = []
+        self.last_write = 0.0
+        self._stamps = {}
+        hass.bus.async_listen(EVENT_STATE_CHANGED, self._state_changed)
+
+    @core.callback
+    def _state_changed(self, event):
+        """Record a state write carrying a new publish time."""
+        new_state = event.data["new_state"]
+        if new_state is None:
+            return
+        stamp = new_state.attributes.get("ts")
+        if stamp is None or self._stamps.get(new_state.entity_id) == stamp:
+            return
+        self._stamps[new_state.entity_id] = stamp
+        now = time.time()
+        self.latencies.append(now - stamp)
+        self.last_write = now
+
+    def reset(self):
+        """Forget the recorded latencies."""
+        self.latencies = []
+
+
+async def async_setup(config_dir, port, platforms):
+    """Set up Home Assistant with the mqtt component and the entities."""
+    hass = core.HomeAssistant()
+    hass.config.config_dir = config_dir
+    hass.config.skip_pip = True
+    hass.auth = await auth.auth_manager_from_config(
+        hass, [{"type": "homeassistant"}], []
+    )
+    hass.config_entries = config_entries.ConfigEntries(hass, {})
+    await hass.config_entries.async_initialize()
+    assert await async_setup_component(hass, "persistent_notification", {})
+
+    assert await async_setup_component(
+        hass, "mqtt", {"mqtt": {"broker": "127.0.0.1", "port": port}}
+    )
+    await hass.async_block_till_done()
+    while not hass.data["mqtt"].connected:
+        await asyncio.sleep(0.1)
+
+    memory = {}
+    for domain, configs in platforms.items():
+        if not configs:
+            continue
+        # Keep the one time imports out of the memory per entity
+        importlib.import_module("homeassistant.components." + domain)
+        importlib.import_module("custom_components.mqtt." + domain)
+        tracemalloc.start()
+        assert await async_setup_component(hass, domain, {domain: configs})
+        await hass.async_block_till_done()
+        memory[domain] = tracemalloc.get_traced_memory()[0] / len(configs)
+        tracemalloc.stop()
+    return hass, memory
+
+
+async def async_run_rate(hass, recorder, monitor, port, topics, rate, duration):
+    """Publish at a rate and return the results of the step."""
+    start = multiprocessing.Event()
+    publisher = multiprocessing.Process(
+        target=publish, args=(port, topics, rate, duration, start)
+    )
+    publisher.start()
+    await asyncio.sleep(1)
+
+    recorder.reset()
+    expected = int(rate * duration)
+    idle = monitor.idle
+    began = time.time()
+    busy_began = time.perf_counter()
+    start.set()
+    await asyncio.sleep(duration)
+    busy_elapsed = time.perf_counter() - busy_began
+    busy = 1 - (monitor.idle - idle) / busy_elapsed
+
+    deadline = time.monotonic() + DRAIN_TIMEOUT
+    while len(recorder.latencies) < expected and time.monotonic() < deadline:
+        await asyncio.sleep(0.1)
+    await hass.async_add_executor_job(publisher.join)
+
+    latencies = sorted(recorder.latencies)
+    received = len(latencies)
+    elapsed = max(recorder.last_write - began, duration)
+    return {
+        "rate": rate,
+        "sent": expected,
+        "received": received,
+        "sustained": received / elapsed,
+        "p50": latencies[received // 2] if latencies else 0,
+        "p99": latencies[int(received * 0.99)] if latencies else 0,
+        "mean": statistics.mean(latencies) if latencies else 0,
+        "busy": busy,
+    }
+
+
+async def async_main(args):
+    """Run the benchmark."""
+    counts = {
+        "sensor": args.sensors,
+        "binary_sensor": args.binary_sensors,
+        "light": args.lights,
+        "climate": args.climates,
+    }
+    platforms, topics = entity_configs(counts)
+    config_dir = make_config_dir()
+    port = free_port()
+    broker = start_broker(config_dir, port)
+
+    try:
+        hass, memory = await async_setup(config_dir, port, platforms)
+        recorder = StateRecorder(hass)
+        monitor = LoopMonitor(hass.loop)
+
+        print("{} entities".format(len(topics)))
+        for domain, per_entity in memory.items():
+            print("  {:14} {:8.1f} KiB per entity".format(domain, per_entity / 1024))
+
+        print(
+            "  {:>7} {:>7} {:>8} {:>9} {:>9} {:>9} {:>6}".format(
+                "rate", "sent", "received", "sustained", "p50 ms", "p99 ms", "busy"
+            )
+        )
+        for rate in args.rates:
+            result = await async_run_rate(
+                hass, recorder, monitor, port, topics, rate, args.duration
+            )
+            print(
+                "  {rate:7d} {sent:7d} {received:8d} {sustained:9.0f} {p50:9.1f} "
+                "{p99:9.1f} {busy:6.0%}".format(
+                    rate=result["rate"],
+                    sent=result["sent"],
+                    received=result["received"],
+                    sustained=result["sustained"],
+                    p50=result["p50"] * 1000,
+                    p99=result["p99"] * 1000,
+                    busy=result["busy"],
+                )
+            )
+
+        await hass.async_stop()
+    finally:
+        broker.terminate()
+        shutil.rmtree(config_dir)
+
+
+def main():
+    """Parse the arguments and run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--sensors", type=int, default=200)
+    parser.add_argument("--binary-sensors", type=int, default=100)
+    parser.add_argument("--lights", type=int, default=50)
+    parser.add_argument("--climates", type=int, default=50)
+    parser.add_argument(
+        "--rates",
+        type=lambda value: [int(rate) for rate in value.split(",")],
+        default=[100, 500, 1000, 2000],
+    )
+    parser.add_argument("--duration", type=float, default=10)
+    asyncio.get_event_loop().run_until_complete(async_main(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
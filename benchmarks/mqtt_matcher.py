@@ -0,0 +1,115 @@
+"""Benchmark MQTT topic dispatch: trie and match cache vs. linear scan.
+
+Usage: python benchmarks/mqtt_matcher.py [subscriptions] [messages]
+"""
+import importlib.util
+import os
+import random
+import sys
+import timeit
+
+from paho.mqtt.matcher import MQTTMatcher
+
+
+def _load(name):
+    """Load a standalone module from the mqtt component without Home Assistant."""
+    path = os.path.join(os.path.dirname(__file__), "..", "mqtt", name + ".py")
+    spec = importlib.util.spec_from_file_location("mqtt_" + name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def _match_topic(subscription, topic):
+    """Previous implementation: build a matcher per subscription and message."""
+    matcher = MQTTMatcher()
+    matcher[subscription] = True
+    try:
+        next(matcher.iter_match(topic))
+        return True
+    except StopIteration:
+        return False
+
+
+def build_filters(count):
+    """Build a Tasmota/Zigbee2MQTT-like set of subscription filters."""
+    filters = []
+    devices = count // 4
+    for dev in range(devices):
+        filters.append("tele/dev{}/SENSOR".format(dev))
+        filters.append("tele/dev{}/LWT".format(dev))
+        filters.append("stat/dev{}/RESULT".format(dev))
+        filters.append("zigbee2mqtt/dev{}".format(dev))
+    filters.append("homeassistant/+/+/config")
+    filters.append("homeassistant/+/+/+/config")
+    return filters
+
+
+def build_topics(count, devices):
+    """Build a stream of concrete topics to dispatch."""
+    rnd = random.Random(42)
+    kinds = ("tele/dev{}/SENSOR", "stat/dev{}/RESULT", "zigbee2mqtt/dev{}")
+    return [rnd.choice(kinds).format(rnd.randrange(devices)) for _ in range(count)]
+
+
+def main():
+    """Run the benchmark."""
+    subscriptions = int(sys.argv[1]) if len(sys.argv) > 1 else 3000
+    messages = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+
+    matcher_module = _load("matcher")
+    filters = build_filters(subscriptions)
+    topics = build_topics(messages, subscriptions // 4)
+
+    trie = matcher_module.TopicMatcher()
+    for topic_filter in filters:
+        trie.add(topic_filter, topic_filter)
+
+    def linear():
+        for topic in topics:
+            for topic_filter in filters:
+                if _match_topic(topic_filter, topic):
+                    pass
+
+    def persistent():
+        for topic in topics:
+            trie.match(topic)
+
+    cache = matcher_module.MatchCache(4096)
+
+    def cached():
+        for topic in topics:
+            values = cache.get(topic)
+            if values is None:
+                cache.put(topic, tuple(trie.match(topic)))
+
+    for topic in topics[:200]:
+        expected = sorted(f for f in filters if _match_topic(f, topic))
+        assert sorted(trie.match(topic)) == expected, topic
+
+    linear_time = min(timeit.repeat(linear, number=1, repeat=3))
+    trie_time = min(timeit.repeat(persistent, number=1, repeat=3))
+    cached_time = min(timeit.repeat(cached, number=1, repeat=3))
+
+    print("{} subscriptions, {} messages".format(len(filters), messages))
+    print(
+        "linear scan:  {:9.1f} msg/s  {:9.2f} us/msg".format(
+            messages / linear_time, linear_time / messages * 1e6
+        )
+    )
+    print(
+        "topic trie:   {:9.1f} msg/s  {:9.2f} us/msg".format(
+            messages / trie_time, trie_time / messages * 1e6
+        )
+    )
+    print(
+        "trie + cache: {:9.1f} msg/s  {:9.2f} us/msg".format(
+            messages / cached_time, cached_time / messages * 1e6
+        )
+    )
+    print("trie speedup: {:.0f}x".format(linear_time / trie_time))
+    print("cache stats: {}".format(cache.stats()))
+
+
+if __name__ == "__main__":
+    main()
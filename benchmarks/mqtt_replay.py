@@ -0,0 +1,148 @@
+"""Replay an MQTT capture file against Home Assistant entities.
+
+Sets up Home Assistant with the mqtt component from this repository and
+feeds the messages of a capture file, recorded with the mqtt.capture
+service, through the dispatch of the component. Entities are configured
+from a YAML file with a list of configs per platform, or by default one
+sensor per captured topic.
+
+The local hbmqtt broker is only started so the component can connect,
+replayed messages don't go through it. Reports the replayed messages per
+second, the share of time the event loop was busy, the dispatch time and
+the callbacks with the most time spent.
+
+Needs Home Assistant, hbmqtt and paho-mqtt installed.
+
+Usage:
+    python benchmarks/mqtt_replay.py CAPTURE [--speed N] [--entities FILE]
+        [--max-sensors N]
+"""
+import argparse
+import asyncio
+import importlib.util
+import os
+import shutil
+import time
+
+from homeassistant.util.yaml import load_yaml
+
+from mqtt_e2e import LoopMonitor, async_setup, free_port, make_config_dir, start_broker
+
+
+def _load(name):
+    """Load a standalone module from the mqtt component without Home Assistant."""
+    path = os.path.join(os.path.dirname(__file__), "..", "mqtt", name + ".py")
+    spec = importlib.util.spec_from_file_location("mqtt_" + name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+capture = _load("capture")
+
+# Number of callbacks reported
+TOP_CALLBACKS = 10
+
+
+def captured_topics(path):
+    """Return the topics of a capture file in the order they first appear."""
+    reader = capture.CaptureReader(path)
+    topics = {}
+    try:
+        while True:
+            messages = reader.read(10000)
+            if not messages:
+                break
+            for message in messages:
+                topics.setdefault(message.topic, None)
+    finally:
+        reader.close()
+    return list(topics)
+
+
+def sensor_configs(topics, limit):
+    """Return one sensor config per topic, for at most limit topics."""
+    return {
+        "sensor": [
+            {
+                "platform": "mqtt",
+                "name": "replay {}".format(index),
+                "state_topic": topic,
+            }
+            for index, topic in enumerate(topics[:limit])
+        ]
+    }
+
+
+async def async_main(args):
+    """Run the replay."""
+    if args.entities:
+        platforms = load_yaml(args.entities)
+    else:
+        platforms = sensor_configs(captured_topics(args.capture), args.max_sensors)
+
+    config_dir = make_config_dir()
+    port = free_port()
+    broker = start_broker(config_dir, port)
+
+    try:
+        hass, _ = await async_setup(config_dir, port, platforms)
+        monitor = LoopMonitor(hass.loop)
+        print("{} entities".format(sum(len(configs) for configs in platforms.values())))
+
+        mqtt = hass.data["mqtt"]
+        idle = monitor.idle
+        busy_began = time.perf_counter()
+        count, elapsed = await mqtt.async_replay(
+            os.path.abspath(args.capture), args.speed
+        )
+        await hass.async_block_till_done()
+        busy_elapsed = time.perf_counter() - busy_began
+        busy = 1 - (monitor.idle - idle) / busy_elapsed
+
+        metrics = mqtt.metrics
+        dispatch = metrics["dispatch_time"]
+        print(
+            "{} messages in {:.2f} s, {:.0f} msg/s, event loop {:.0%} busy".format(
+                count, elapsed, count / elapsed if elapsed else 0, busy
+            )
+        )
+        print(
+            "dispatch p50 {:.3f} ms  p99 {:.3f} ms  max {:.3f} ms".format(
+                dispatch["p50"] * 1000, dispatch["p99"] * 1000, dispatch["max"] * 1000
+            )
+        )
+        print("  {:>7} {:>10} {:>10}  callback".format("calls", "total ms", "p99 ms"))
+        for entry in mqtt.callback_metrics(TOP_CALLBACKS):
+            print(
+                "  {:7d} {:10.1f} {:10.3f}  {}".format(
+                    entry["count"],
+                    entry["sum"] * 1000,
+                    entry["p99"] * 1000,
+                    entry["callback"],
+                )
+            )
+
+        await hass.async_stop()
+    finally:
+        broker.terminate()
+        shutil.rmtree(config_dir)
+
+
+def main():
+    """Parse the arguments and run the replay."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("capture")
+    parser.add_argument(
+        "--speed",
+        type=float,
+        default=0,
+        help="multiple of the captured rate, 0 replays as fast as possible",
+    )
+    parser.add_argument("--entities", help="YAML file with the configs per platform")
+    parser.add_argument("--max-sensors", type=int, default=1000)
+    asyncio.get_event_loop().run_until_complete(async_main(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""Benchmark resubscribing many topics: one SUBSCRIBE per topic vs. chunked.
+
+Measures the time from connecting until the broker acknowledged every
+subscription. The per-topic mode mirrors the previous reconnect path, which
+sent each topic with its own executor hop while holding the paho lock.
+
+Needs a running broker. Usage:
+    python benchmarks/mqtt_resubscribe.py [host] [port] [topics]
+"""
+import asyncio
+import sys
+import time
+import uuid
+
+import paho.mqtt.client as mqtt
+
+MAX_TOPICS_PER_SUBSCRIBE = 500
+
+
+async def resubscribe(host, port, topics, chunked):
+    """Connect and subscribe to all topics, return seconds until all acked."""
+    loop = asyncio.get_running_loop()
+    lock = asyncio.Lock()
+    connected = loop.create_future()
+    pending = set()
+    acked = set()
+    done = loop.create_future()
+
+    def on_connect(*_):
+        loop.call_soon_threadsafe(connected.set_result, True)
+
+    def handle_suback(mid):
+        acked.add(mid)
+        if not done.done() and pending and pending <= acked:
+            done.set_result(True)
+
+    def on_subscribe(_client, _userdata, mid, _granted_qos):
+        loop.call_soon_threadsafe(handle_suback, mid)
+
+    client = mqtt.Client()
+    client.on_connect = on_connect
+    client.on_subscribe = on_subscribe
+
+    async def call(func, *args):
+        async with lock:
+            return await loop.run_in_executor(None, func, *args)
+
+    start = time.perf_counter()
+    await loop.run_in_executor(None, client.connect, host, port, 60)
+    client.loop_start()
+    await connected
+
+    if chunked:
+        requests = [
+            [(topic, 0) for topic in topics[index : index + MAX_TOPICS_PER_SUBSCRIBE]]
+            for index in range(0, len(topics), MAX_TOPICS_PER_SUBSCRIBE)
+        ]
+        results = await asyncio.gather(
+            *(call(client.subscribe, request) for request in requests)
+        )
+    else:
+        results = await asyncio.gather(
+            *(call(client.subscribe, topic, 0) for topic in topics)
+        )
+    pending.update(mid for _, mid in results)
+    handle_suback(None)
+    await done
+    elapsed = time.perf_counter() - start
+
+    client.disconnect()
+    client.loop_stop()
+    return elapsed
+
+
+def main():
+    """Run the benchmark."""
+    host = sys.argv[1] if len(sys.argv) > 1 else "localhost"
+    port = int(sys.argv[2]) if len(sys.argv) > 2 else 1883
+    count = int(sys.argv[3]) if len(sys.argv) > 3 else 4000
+
+    prefix = "bench/{}".format(uuid.uuid4().hex[:8])
+    topics = ["{}/dev{}/state".format(prefix, index) for index in range(count)]
+
+    per_topic = asyncio.run(resubscribe(host, port, topics, False))
+    chunked = asyncio.run(resubscribe(host, port, topics, True))
+
+    print("{} topics".format(count))
+    print("one SUBSCRIBE per topic: {:7.3f} s".format(per_topic))
+    print("chunked SUBSCRIBE:       {:7.3f} s".format(chunked))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+"""Load test receiving over several sharded broker connections.
+
+Subscribes to one filter per prefix, spread over 1, 2, 4 and 8 connections
+the way the component shards them, while publisher processes flood the
+broker. Every connection runs its own paho network thread and hands the
+messages to one asyncio event loop in batches, like the component does.
+Reports the messages per second that reached the event loop.
+
+Paho parses packets in Python, so the threads share the GIL. Sharding
+mostly helps when a single connection is limited by the broker or the
+network, for example per-connection rate limits or a slow TCP window.
+
+Usage:
+    python benchmarks/mqtt_shards.py [host] [port] [messages] [publishers]
+"""
+import asyncio
+from collections import deque
+import importlib.util
+import multiprocessing
+import os
+import sys
+import time
+import uuid
+
+import paho.mqtt.client as mqtt
+
+
+def _load(name):
+    """Load a standalone module from the mqtt component without Home Assistant."""
+    path = os.path.join(os.path.dirname(__file__), "..", "mqtt", name + ".py")
+    spec = importlib.util.spec_from_file_location("mqtt_" + name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+sharding = _load("sharding")
+
+PREFIXES = 32
+TOPICS_PER_PREFIX = 8
+CONNECTIONS = (1, 2, 4, 8)
+TIMEOUT = 60  # seconds
+
+
+def topics(run_id):
+    """Return the filters and published topics of a run."""
+    filters = ["{}{}/#".format(run_id, prefix) for prefix in range(PREFIXES)]
+    published = [
+        "{}{}/device{}/state".format(run_id, prefix, index)
+        for prefix in range(PREFIXES)
+        for index in range(TOPICS_PER_PREFIX)
+    ]
+    return filters, published
+
+
+def publish(host, port, published, count, start):
+    """Publish count QoS 0 messages once the receivers are subscribed."""
+    client = mqtt.Client()
+    client.connect(host, port, 60)
+    client.loop_start()
+    start.wait()
+    for index in range(count):
+        client.publish(published[index % len(published)], '{"state": "ON"}', 0)
+        # Keep paho's outgoing buffer from growing without bounds
+        if index % 1000 == 0:
+            while client.want_write():
+                time.sleep(0.001)
+    while client.want_write():
+        time.sleep(0.01)
+    client.disconnect()
+    client.loop_stop()
+
+
+class Receiver:
+    """Sharded connections delivering into one asyncio event loop."""
+
+    def __init__(self, loop, host, port, filters, shards):
+        """Connect the clients and subscribe each filter on its shard."""
+        self.loop = loop
+        self.received = 0
+        self.done = asyncio.Event()
+        self.expected = None
+        self._pending = deque()
+        self._drain_scheduled = False
+        self._clients = []
+        for index in range(shards):
+            client = mqtt.Client(userdata=index)
+            client.on_message = self._on_message
+            client.connect(host, port, 60)
+            for topic_filter in filters:
+                if sharding.shard_index(topic_filter, shards, "prefix") == index:
+                    client.subscribe(topic_filter, 0)
+            self._clients.append(client)
+
+    def start(self):
+        """Start the network threads."""
+        for client in self._clients:
+            client.loop_start()
+
+    def stop(self):
+        """Disconnect all clients."""
+        for client in self._clients:
+            client.disconnect()
+            client.loop_stop()
+
+    def _on_message(self, _client, _shard, msg):
+        """Buffer a message in the paho thread and wake up the event loop."""
+        self._pending.append(msg)
+        if not self._drain_scheduled:
+            self._drain_scheduled = True
+            self.loop.call_soon_threadsafe(self._drain)
+
+    def _drain(self):
+        """Count the buffered messages in the event loop."""
+        self._drain_scheduled = False
+        pending = self._pending
+        for _ in range(len(pending)):
+            pending.popleft()
+            self.received += 1
+        if self.expected is not None and self.received >= self.expected:
+            self.done.set()
+
+
+async def run(host, port, shards, count, publishers):
+    """Return the messages per second received over a number of shards."""
+    filters, published = topics("shards/{}/".format(uuid.uuid4().hex[:8]))
+    receiver = Receiver(asyncio.get_event_loop(), host, port, filters, shards)
+    receiver.start()
+    # Give the broker time to process the subscriptions
+    await asyncio.sleep(1)
+
+    start = multiprocessing.Event()
+    processes = [
+        multiprocessing.Process(
+            target=publish,
+            args=(host, port, published[index::publishers], count, start),
+        )
+        for index in range(publishers)
+    ]
+    for process in processes:
+        process.start()
+    # Let the publishers connect
+    await asyncio.sleep(1)
+
+    receiver.expected = count * publishers
+    began = time.perf_counter()
+    start.set()
+    try:
+        await asyncio.wait_for(receiver.done.wait(), TIMEOUT)
+    except asyncio.TimeoutError:
+        pass
+    elapsed = time.perf_counter() - began
+
+    for process in processes:
+        process.join()
+    receiver.stop()
+    return receiver.received, elapsed
+
+
+def main():
+    """Run the load test for each number of connections."""
+    host = sys.argv[1] if len(sys.argv) > 1 else "localhost"
+    port = int(sys.argv[2]) if len(sys.argv) > 2 else 1883
+    count = int(sys.argv[3]) if len(sys.argv) > 3 else 20000
+    publishers = int(sys.argv[4]) if len(sys.argv) > 4 else 4
+
+    print(
+        "{} publishers x {} messages on {} prefixes".format(publishers, count, PREFIXES)
+    )
+    baseline = None
+    for shards in CONNECTIONS:
+        try:
+            received, elapsed = asyncio.run(run(host, port, shards, count, publishers))
+        except OSError as err:
+            print("can't connect to {}:{} ({})".format(host, port, err))
+            return
+        rate = received / elapsed
+        if baseline is None:
+            baseline = rate
+        print(
+            "  {} connections {:8d} received {:9.0f} msg/s  x{:.2f}".format(
+                shards, received, rate, rate / baseline
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+"""Benchmark rendering value templates with and without the Jinja bypass.
+
+Renders a set of value templates seen in Tasmota and Zigbee2MQTT configs
+and for plain payloads like ESPHome's, with Jinja as before and with
+the mqtt component, which looks up simple templates directly. Checks that
+both render the same and reports the microseconds per render including
+parsing the payload, and marked with * for rendering a payload already
+parsed for another subscriber.
+
+Needs Home Assistant installed.
+
+Usage: python benchmarks/mqtt_templates.py [renders]
+"""
+import os
+import sys
+import timeit
+
+from homeassistant.core import HomeAssistant
+from homeassistant.helpers.template import Template
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+# pylint: disable=wrong-import-position
+from mqtt.models import Message  # noqa: E402
+from mqtt.templates import async_render_message, simple_template  # noqa: E402
+
+TASMOTA_SENSOR = (
+    '{"Time":"2019-10-12T10:15:30","ENERGY":{"TotalStartTime":"2019-01-01T00:00:00",'
+    '"Total":123.456,"Yesterday":1.234,"Today":0.567,"Period":2,"Power":42,'
+    '"ApparentPower":50,"ReactivePower":27,"Factor":0.84,"Voltage":231,'
+    '"Current":0.218},"AM2301":{"Temperature":21.7,"Humidity":48.3},'
+    '"TempUnit":"C"}'
+)
+TASMOTA_STATE = (
+    '{"Time":"2019-10-12T10:15:30","Uptime":"3T01:02:03","Vcc":3.176,'
+    '"POWER":"ON","Wifi":{"AP":1,"SSId":"home","RSSI":76,"LinkCount":1}}'
+)
+ZIGBEE2MQTT = (
+    '{"temperature":21.53,"humidity":48.21,"pressure":1012.4,"battery":91,'
+    '"voltage":2985,"linkquality":70,"occupancy":false,"contact":true,'
+    '"action":"single","brightness":254,"color":{"x":0.4573,"y":0.41},'
+    '"update":{"state":"idle"},"readings":[1.5,2.5,3.5]}'
+)
+
+# Template sources and the payloads they are rendered with
+TEMPLATES = [
+    ("{{ value_json.ENERGY.Power }}", TASMOTA_SENSOR),
+    ("{{ value_json.ENERGY.Total | float }}", TASMOTA_SENSOR),
+    ("{{ value_json.ENERGY.Voltage | int }}", TASMOTA_SENSOR),
+    ("{{ value_json.ENERGY.Current | round(2) }}", TASMOTA_SENSOR),
+    ("{{ value_json['AM2301']['Temperature'] }}", TASMOTA_SENSOR),
+    ("{{ value_json.AM2301.Humidity | float | round(1) }}", TASMOTA_SENSOR),
+    ("{{ value_json.POWER }}", TASMOTA_STATE),
+    ("{{ value_json.Wifi.RSSI }}", TASMOTA_STATE),
+    ("{{ value_json.temperature }}", ZIGBEE2MQTT),
+    ("{{ value_json['humidity'] | round(1) }}", ZIGBEE2MQTT),
+    ("{{ value_json.battery }}", ZIGBEE2MQTT),
+    ("{{ value_json.linkquality | int }}", ZIGBEE2MQTT),
+    ("{{ value_json.occupancy }}", ZIGBEE2MQTT),
+    ("{{ value_json.contact }}", ZIGBEE2MQTT),
+    ("{{ value_json.color.x }}", ZIGBEE2MQTT),
+    ("{{ value_json.readings[1] }}", ZIGBEE2MQTT),
+    ("{{ value_json['update'].state }}", ZIGBEE2MQTT),
+    ("{{ value_json.missing }}", ZIGBEE2MQTT),
+    ("{{ value }}", "23.5"),
+    ("{{ value | float }}", "23.5"),
+    ("{{ value | round(1) }}", "23.46"),
+    ("{{ value | int }}", "not a number"),
+    ("{{ value_json }}", "not json"),
+    ("{{ value_json.temperature | float * 1.8 + 32 }}", ZIGBEE2MQTT),
+    ("{{ 'ON' if value_json.occupancy else 'OFF' }}", ZIGBEE2MQTT),
+    ("{% if value_json.contact %}closed{% else %}open{% endif %}", ZIGBEE2MQTT),
+]
+
+
+def _render_jinja(template, payload):
+    """Render a template as before the bypass."""
+    return template.async_render_with_possible_json_value(payload)
+
+
+def _render_component(template, payload):
+    """Render a template with a new message, as the component does."""
+    return async_render_message(template, Message("topic", payload, 0, False))
+
+
+def _message(payload):
+    """Return a message with its payload parsed, as for later subscribers."""
+    msg = Message("topic", payload, 0, False)
+    try:
+        msg.payload_json()
+    except ValueError:
+        pass
+    return msg
+
+
+def _render_jinja_parsed(template, msg):
+    """Render a template with Jinja and the parsed payload of a message."""
+    variables = {"value": msg.payload}
+    try:
+        variables["value_json"] = msg.payload_json()
+    except ValueError:
+        pass
+    return template.async_render(variables)
+
+
+def _time(func, *args, number):
+    """Return the microseconds per call of a function."""
+    return timeit.timeit(lambda: func(*args), number=number) / number * 1e6
+
+
+def main():
+    """Run the benchmark."""
+    renders = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    hass = HomeAssistant()
+
+    print(
+        "{:>9} {:>9} {:>9} {:>9}  {:6}  {}".format(
+            "jinja", "bypass", "jinja*", "bypass*", "simple", "template"
+        )
+    )
+    totals = [0.0, 0.0, 0.0, 0.0]
+    for source, payload in TEMPLATES:
+        template = Template(source, hass)
+        msg = _message(payload)
+        expected = _render_jinja(template, payload)
+        for rendered in (
+            _render_component(template, payload),
+            _render_jinja_parsed(template, msg),
+            async_render_message(template, msg),
+        ):
+            if rendered != expected:
+                raise AssertionError(
+                    "{} renders {!r} instead of {!r}".format(source, rendered, expected)
+                )
+
+        times = [
+            _time(_render_jinja, template, payload, number=renders),
+            _time(_render_component, template, payload, number=renders),
+            _time(_render_jinja_parsed, template, msg, number=renders),
+            _time(async_render_message, template, msg, number=renders),
+        ]
+        totals = [total + time for total, time in zip(totals, times)]
+        print(
+            "{:9.2f} {:9.2f} {:9.2f} {:9.2f}  {:6}  {}".format(
+                *times, "yes" if simple_template(source) else "no", source
+            )
+        )
+
+    print(
+        "{:9.2f} {:9.2f} {:9.2f} {:9.2f}  mean of {} templates".format(
+            *(total / len(TEMPLATES) for total in totals), len(TEMPLATES)
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
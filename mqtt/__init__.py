@@ -1,26 +1,26 @@
 """Support for MQTT message handling."""
 import asyncio
-import sys
-from functools import partial, wraps
+from collections import deque
+import cProfile
+from functools import lru_cache, partial, wraps
 import inspect
-from itertools import groupby
 import json
 import logging
-from operator import attrgetter
 import os
-import socket
 import ssl
+import sys
 import time
-from typing import Any, Callable, List, Optional, Union
+from typing import Any, Callable, Deque, Dict, List, Optional, Sequence, Tuple, Union
 
+from aiohttp import web
 import attr
 import requests.certs
 import voluptuous as vol
 import paho.mqtt.client as mqtt
-from paho.mqtt.matcher import MQTTMatcher
 
 from homeassistant import config_entries
 from homeassistant.components import websocket_api
+from homeassistant.components.http import HomeAssistantView
 from homeassistant.const import (
     CONF_DEVICE,
     CONF_NAME,
@@ -30,15 +30,20 @@ from homeassistant.const import (
     CONF_PROTOCOL,
     CONF_USERNAME,
     CONF_VALUE_TEMPLATE,
+    CONTENT_TYPE_TEXT_PLAIN,
+    EVENT_HOMEASSISTANT_START,
     EVENT_HOMEASSISTANT_STOP,
+    HTTP_NOT_FOUND,
 )
-from homeassistant.core import Event, ServiceCall, callback
+from homeassistant.core import CoreState, Event, ServiceCall, callback
 from homeassistant.exceptions import (
     HomeAssistantError,
+    TemplateError,
     Unauthorized,
     ConfigEntryNotReady,
 )
 from homeassistant.helpers import config_validation as cv, template
+from homeassistant.helpers.discovery import async_load_platform
 from homeassistant.helpers.dispatcher import async_dispatcher_connect
 from homeassistant.helpers.entity import Entity
 from homeassistant.helpers.typing import ConfigType, HomeAssistantType, ServiceDataType
@@ -54,12 +59,54 @@ from .const import (
     DEFAULT_DISCOVERY,
     CONF_STATE_TOPIC,
     ATTR_DISCOVERY_HASH,
+    CONNECTION_FAILED,
+    CONNECTION_FAILED_RECOVERABLE,
+    CONNECTION_SUCCESS,
     PROTOCOL_311,
+    PROTOCOL_5,
     DEFAULT_QOS,
 )
+from .capture import CaptureReader, CaptureWriter
+from .client_loop import CLIENT_LOOP_ASYNCIO, CLIENT_LOOP_THREAD
+from .connection import Connection
 from .discovery import MQTT_DISCOVERY_UPDATED, clear_discovery_hash
+from .forwarding import BINARY_MODES, BINARY_SKIP, MessageForwarder
+from .ingest import (
+    DEFAULT_HIGH_PRIORITY_TOPICS,
+    DEFAULT_LOW_PRIORITY_TOPICS,
+    DROPPED_COALESCED,
+    PRIORITIES,
+    PRIORITY_LOW,
+    InboundPriorities,
+    IngestPolicies,
+    IngestPolicy,
+    coalesce,
+)
+from .matcher import FilterRegistry, MatchCache, TopicMatcher, match_topic
+from .metrics import RATE_INTERVAL, Metrics, prometheus_text
 from .models import PublishPayloadType, Message, MessageCallbackType
+from .mqtt5 import SubscriptionIds
+from .publish_queue import (
+    OVERFLOW_BLOCK,
+    OVERFLOW_POLICIES,
+    PRIORITY_BULK,
+    PRIORITY_COMMAND,
+    PublishQueue,
+    PublishRequest,
+)
+from .retained import RetainedCache
+from .session import SessionStore, decode_messages, encode_messages
+from .sharding import SHARD_BY_PREFIX, SHARD_MODES, shard_index
+from .spool import MIN_SIZE as MIN_SPOOL_SIZE, PublishSpool, encode_payload
+from .tracer import (
+    DIRECTION_IN,
+    DIRECTION_OUT,
+    MessageTracer,
+    payload_size,
+    write_entries,
+)
 from .subscription import async_subscribe_topics, async_unsubscribe_topics
+from .templates import async_render_message
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -70,6 +117,14 @@ DATA_MQTT_CONFIG = "mqtt_config"
 DATA_MQTT_HASS_CONFIG = "mqtt_hass_config"
 
 SERVICE_PUBLISH = "publish"
+SERVICE_PUBLISH_MANY = "publish_many"
+SERVICE_RECONNECT = "reconnect"
+SERVICE_PROFILE = "profile"
+SERVICE_DUMP_TRACE = "dump_trace"
+SERVICE_CAPTURE = "capture"
+SERVICE_REPLAY = "replay"
+
+EVENT_MQTT_SLOW_CALLBACK = "mqtt_slow_callback"
 
 CONF_EMBEDDED = "embedded"
 
@@ -81,6 +136,32 @@ CONF_CLIENT_KEY = "client_key"
 CONF_CLIENT_CERT = "client_cert"
 CONF_TLS_INSECURE = "tls_insecure"
 CONF_TLS_VERSION = "tls_version"
+CONF_CLEAN_SESSION = "clean_session"
+CONF_MATCH_CACHE_SIZE = "match_cache_size"
+CONF_CLIENT_LOOP = "client_loop"
+CONF_RECONNECT_FIRST_DELAY = "reconnect_first_delay"
+CONF_PUBLISH_QUEUE_SIZE = "publish_queue_size"
+CONF_PUBLISH_OVERFLOW = "publish_overflow"
+CONF_SPOOL_FILE = "spool_file"
+CONF_SPOOL_SIZE = "spool_size"
+CONF_SPOOL_DRAIN_RATE = "spool_drain_rate"
+CONF_RECEIVE_MAXIMUM = "receive_maximum"
+CONF_BROKER_CONNECTIONS = "broker_connections"
+CONF_SHARD_BY = "shard_by"
+CONF_METRICS_SAMPLE_INTERVAL = "metrics_sample_interval"
+CONF_METRICS_SENSORS = "metrics_sensors"
+CONF_SLOW_CALLBACK_THRESHOLD = "slow_callback_threshold"
+CONF_TRACE_SIZE = "trace_size"
+CONF_TRACE_TOPICS = "trace_topics"
+CONF_INGEST_POLICIES = "ingest_policies"
+CONF_DROP_DUPLICATES = "drop_duplicates"
+CONF_MIN_INTERVAL = "min_interval"
+CONF_EVERY_NTH = "every_nth"
+CONF_HIGH_PRIORITY_TOPICS = "high_priority_topics"
+CONF_LOW_PRIORITY_TOPICS = "low_priority_topics"
+CONF_COALESCE_BACKLOG = "coalesce_backlog"
+CONF_RETAINED_CACHE_SIZE = "retained_cache_size"
+CONF_RETAINED_MAX_PAYLOAD = "retained_max_payload_size"
 
 CONF_BIRTH_MESSAGE = "birth_message"
 CONF_WILL_MESSAGE = "will_message"
@@ -111,6 +192,20 @@ DEFAULT_RETAIN = False
 DEFAULT_PROTOCOL = PROTOCOL_311
 DEFAULT_DISCOVERY_PREFIX = "homeassistant"
 DEFAULT_TLS_PROTOCOL = "auto"
+DEFAULT_CLEAN_SESSION = True
+DEFAULT_MATCH_CACHE_SIZE = 4096
+DEFAULT_CLIENT_LOOP = CLIENT_LOOP_THREAD
+DEFAULT_RECONNECT_FIRST_DELAY = 0
+DEFAULT_PUBLISH_QUEUE_SIZE = 10000
+DEFAULT_PUBLISH_OVERFLOW = OVERFLOW_BLOCK
+DEFAULT_SPOOL_SIZE = 1048576
+DEFAULT_SPOOL_DRAIN_RATE = 20
+DEFAULT_CONNECTIONS = 1
+DEFAULT_SHARD_BY = SHARD_BY_PREFIX
+DEFAULT_METRICS_SAMPLE_INTERVAL = 16
+DEFAULT_TRACE_SIZE = 1000
+DEFAULT_COALESCE_BACKLOG = 1000
+DEFAULT_RETAINED_CACHE_SIZE = 4194304
 DEFAULT_PAYLOAD_AVAILABLE = "online"
 DEFAULT_PAYLOAD_NOT_AVAILABLE = "offline"
 
@@ -119,12 +214,21 @@ ATTR_PAYLOAD = "payload"
 ATTR_PAYLOAD_TEMPLATE = "payload_template"
 ATTR_QOS = CONF_QOS
 ATTR_RETAIN = CONF_RETAIN
+ATTR_DURATION = "duration"
+ATTR_FILENAME = "filename"
+ATTR_SPEED = "speed"
+ATTR_MESSAGES = "messages"
 
-MAX_RECONNECT_WAIT = 300  # seconds
+MAX_CONNECTIONS = 16
 
-CONNECTION_SUCCESS = "connection_success"
-CONNECTION_FAILED = "connection_failed"
-CONNECTION_FAILED_RECOVERABLE = "connection_failed_recoverable"
+# Compiled payload templates of the publish services to keep
+TEMPLATE_CACHE_SIZE = 256
+
+# Messages read from a capture file at a time when replaying
+REPLAY_CHUNK = 1000
+
+# Report each slow callback at most this often
+SLOW_CALLBACK_REPORT = 60  # seconds
 
 
 def valid_topic(value: Any) -> str:
@@ -207,6 +311,27 @@ MQTT_WILL_BIRTH_SCHEMA = vol.Schema(
     required=True,
 )
 
+MQTT_INGEST_POLICY_SCHEMA = vol.All(
+    vol.Schema(
+        {
+            vol.Required(ATTR_TOPIC): valid_subscribe_topic,
+            vol.Optional(CONF_DROP_DUPLICATES, default=False): cv.boolean,
+            vol.Optional(CONF_MIN_INTERVAL, default=0): vol.All(
+                vol.Coerce(float), vol.Range(min=0)
+            ),
+            vol.Optional(CONF_EVERY_NTH, default=1): vol.All(
+                vol.Coerce(int), vol.Range(min=1)
+            ),
+        }
+    ),
+    lambda value: IngestPolicy(
+        value[ATTR_TOPIC],
+        value[CONF_DROP_DUPLICATES],
+        value[CONF_MIN_INTERVAL],
+        value[CONF_EVERY_NTH],
+    ),
+)
+
 
 def embedded_broker_deprecated(value):
     """Warn user that embedded MQTT broker is deprecated."""
@@ -218,44 +343,121 @@ def embedded_broker_deprecated(value):
     return value
 
 
+def validate_persistent_session(value: ConfigType) -> ConfigType:
+    """Validate that a persistent session has a stable client ID."""
+    if not value[CONF_CLEAN_SESSION] and not value.get(CONF_CLIENT_ID):
+        raise vol.Invalid("A client_id is required when clean_session is false")
+    return value
+
+
 CONFIG_SCHEMA = vol.Schema(
     {
-        DOMAIN: vol.Schema(
-            {
-                vol.Optional(CONF_CLIENT_ID): cv.string,
-                vol.Optional(CONF_KEEPALIVE, default=DEFAULT_KEEPALIVE): vol.All(
-                    vol.Coerce(int), vol.Range(min=15)
-                ),
-                vol.Optional(CONF_BROKER): cv.string,
-                vol.Optional(CONF_PORT, default=DEFAULT_PORT): cv.port,
-                vol.Optional(CONF_USERNAME): cv.string,
-                vol.Optional(CONF_PASSWORD): cv.string,
-                vol.Optional(CONF_CERTIFICATE): vol.Any("auto", cv.isfile),
-                vol.Inclusive(
-                    CONF_CLIENT_KEY, "client_key_auth", msg=CLIENT_KEY_AUTH_MSG
-                ): cv.isfile,
-                vol.Inclusive(
-                    CONF_CLIENT_CERT, "client_key_auth", msg=CLIENT_KEY_AUTH_MSG
-                ): cv.isfile,
-                vol.Optional(CONF_TLS_INSECURE): cv.boolean,
-                vol.Optional(CONF_TLS_VERSION, default=DEFAULT_TLS_PROTOCOL): vol.Any(
-                    "auto", "1.0", "1.1", "1.2"
-                ),
-                vol.Optional(CONF_PROTOCOL, default=DEFAULT_PROTOCOL): vol.All(
-                    cv.string, vol.In([PROTOCOL_31, PROTOCOL_311])
-                ),
-                vol.Optional(CONF_EMBEDDED): vol.All(
-                    server.HBMQTT_CONFIG_SCHEMA, embedded_broker_deprecated
-                ),
-                vol.Optional(CONF_WILL_MESSAGE): MQTT_WILL_BIRTH_SCHEMA,
-                vol.Optional(CONF_BIRTH_MESSAGE): MQTT_WILL_BIRTH_SCHEMA,
-                vol.Optional(CONF_DISCOVERY, default=DEFAULT_DISCOVERY): cv.boolean,
-                # discovery_prefix must be a valid publish topic because if no
-                # state topic is specified, it will be created with the given prefix.
-                vol.Optional(
-                    CONF_DISCOVERY_PREFIX, default=DEFAULT_DISCOVERY_PREFIX
-                ): valid_publish_topic,
-            }
+        DOMAIN: vol.All(
+            vol.Schema(
+                {
+                    vol.Optional(CONF_CLIENT_ID): cv.string,
+                    vol.Optional(CONF_KEEPALIVE, default=DEFAULT_KEEPALIVE): vol.All(
+                        vol.Coerce(int), vol.Range(min=15)
+                    ),
+                    vol.Optional(CONF_BROKER): cv.string,
+                    vol.Optional(CONF_PORT, default=DEFAULT_PORT): cv.port,
+                    vol.Optional(CONF_USERNAME): cv.string,
+                    vol.Optional(CONF_PASSWORD): cv.string,
+                    vol.Optional(CONF_CERTIFICATE): vol.Any("auto", cv.isfile),
+                    vol.Inclusive(
+                        CONF_CLIENT_KEY, "client_key_auth", msg=CLIENT_KEY_AUTH_MSG
+                    ): cv.isfile,
+                    vol.Inclusive(
+                        CONF_CLIENT_CERT, "client_key_auth", msg=CLIENT_KEY_AUTH_MSG
+                    ): cv.isfile,
+                    vol.Optional(CONF_TLS_INSECURE): cv.boolean,
+                    vol.Optional(
+                        CONF_TLS_VERSION, default=DEFAULT_TLS_PROTOCOL
+                    ): vol.Any("auto", "1.0", "1.1", "1.2"),
+                    vol.Optional(CONF_PROTOCOL, default=DEFAULT_PROTOCOL): vol.All(
+                        cv.string, vol.In([PROTOCOL_31, PROTOCOL_311, PROTOCOL_5])
+                    ),
+                    vol.Optional(
+                        CONF_CLEAN_SESSION, default=DEFAULT_CLEAN_SESSION
+                    ): cv.boolean,
+                    vol.Optional(CONF_EMBEDDED): vol.All(
+                        server.HBMQTT_CONFIG_SCHEMA, embedded_broker_deprecated
+                    ),
+                    vol.Optional(CONF_WILL_MESSAGE): MQTT_WILL_BIRTH_SCHEMA,
+                    vol.Optional(CONF_BIRTH_MESSAGE): MQTT_WILL_BIRTH_SCHEMA,
+                    vol.Optional(CONF_DISCOVERY, default=DEFAULT_DISCOVERY): cv.boolean,
+                    # discovery_prefix must be a valid publish topic because if no
+                    # state topic is specified, it will be created with the given prefix.
+                    vol.Optional(
+                        CONF_DISCOVERY_PREFIX, default=DEFAULT_DISCOVERY_PREFIX
+                    ): valid_publish_topic,
+                    vol.Optional(
+                        CONF_MATCH_CACHE_SIZE, default=DEFAULT_MATCH_CACHE_SIZE
+                    ): vol.All(vol.Coerce(int), vol.Range(min=0)),
+                    vol.Optional(CONF_CLIENT_LOOP, default=DEFAULT_CLIENT_LOOP): vol.In(
+                        [CLIENT_LOOP_THREAD, CLIENT_LOOP_ASYNCIO]
+                    ),
+                    vol.Optional(
+                        CONF_RECONNECT_FIRST_DELAY,
+                        default=DEFAULT_RECONNECT_FIRST_DELAY,
+                    ): vol.All(vol.Coerce(float), vol.Range(min=0)),
+                    vol.Optional(
+                        CONF_PUBLISH_QUEUE_SIZE, default=DEFAULT_PUBLISH_QUEUE_SIZE
+                    ): vol.All(vol.Coerce(int), vol.Range(min=1)),
+                    vol.Optional(
+                        CONF_PUBLISH_OVERFLOW, default=DEFAULT_PUBLISH_OVERFLOW
+                    ): vol.In(OVERFLOW_POLICIES),
+                    vol.Optional(CONF_SPOOL_FILE): cv.string,
+                    vol.Optional(CONF_SPOOL_SIZE, default=DEFAULT_SPOOL_SIZE): vol.All(
+                        vol.Coerce(int), vol.Range(min=MIN_SPOOL_SIZE)
+                    ),
+                    vol.Optional(
+                        CONF_SPOOL_DRAIN_RATE, default=DEFAULT_SPOOL_DRAIN_RATE
+                    ): vol.All(vol.Coerce(float), vol.Range(min=0.1)),
+                    vol.Optional(CONF_RECEIVE_MAXIMUM): vol.All(
+                        vol.Coerce(int), vol.Range(min=1, max=65535)
+                    ),
+                    vol.Optional(
+                        CONF_BROKER_CONNECTIONS, default=DEFAULT_CONNECTIONS
+                    ): vol.All(vol.Coerce(int), vol.Range(min=1, max=MAX_CONNECTIONS)),
+                    vol.Optional(CONF_SHARD_BY, default=DEFAULT_SHARD_BY): vol.In(
+                        SHARD_MODES
+                    ),
+                    vol.Optional(
+                        CONF_METRICS_SAMPLE_INTERVAL,
+                        default=DEFAULT_METRICS_SAMPLE_INTERVAL,
+                    ): vol.All(vol.Coerce(int), vol.Range(min=0)),
+                    vol.Optional(CONF_METRICS_SENSORS, default=False): cv.boolean,
+                    vol.Optional(CONF_SLOW_CALLBACK_THRESHOLD): vol.All(
+                        vol.Coerce(float), vol.Range(min=0)
+                    ),
+                    vol.Optional(CONF_TRACE_SIZE, default=DEFAULT_TRACE_SIZE): vol.All(
+                        vol.Coerce(int), vol.Range(min=0)
+                    ),
+                    vol.Optional(CONF_TRACE_TOPICS, default=[]): vol.All(
+                        cv.ensure_list, [valid_subscribe_topic]
+                    ),
+                    vol.Optional(CONF_INGEST_POLICIES, default=[]): vol.All(
+                        cv.ensure_list, [MQTT_INGEST_POLICY_SCHEMA]
+                    ),
+                    vol.Optional(
+                        CONF_HIGH_PRIORITY_TOPICS, default=DEFAULT_HIGH_PRIORITY_TOPICS
+                    ): vol.All(cv.ensure_list, [valid_subscribe_topic]),
+                    vol.Optional(
+                        CONF_LOW_PRIORITY_TOPICS, default=DEFAULT_LOW_PRIORITY_TOPICS
+                    ): vol.All(cv.ensure_list, [valid_subscribe_topic]),
+                    vol.Optional(
+                        CONF_COALESCE_BACKLOG, default=DEFAULT_COALESCE_BACKLOG
+                    ): vol.All(vol.Coerce(int), vol.Range(min=0)),
+                    vol.Optional(
+                        CONF_RETAINED_CACHE_SIZE, default=DEFAULT_RETAINED_CACHE_SIZE
+                    ): vol.All(vol.Coerce(int), vol.Range(min=0)),
+                    vol.Optional(CONF_RETAINED_MAX_PAYLOAD): vol.All(
+                        vol.Coerce(int), vol.Range(min=0)
+                    ),
+                }
+            ),
+            validate_persistent_session,
         )
     },
     extra=vol.ALLOW_EXTRA,
@@ -334,6 +536,39 @@ MQTT_PUBLISH_SCHEMA = vol.Schema(
     required=True,
 )
 
+MQTT_PUBLISH_MANY_SCHEMA = vol.Schema(
+    {vol.Required(ATTR_MESSAGES): vol.All(cv.ensure_list, [MQTT_PUBLISH_SCHEMA])}
+)
+
+MQTT_DUMP_TRACE_SCHEMA = vol.Schema({vol.Optional(ATTR_FILENAME): cv.string})
+
+MQTT_CAPTURE_SCHEMA = vol.Schema(
+    {
+        vol.Optional(ATTR_DURATION, default=60): vol.All(
+            vol.Coerce(float), vol.Range(min=1, max=86400)
+        ),
+        vol.Optional(ATTR_FILENAME): cv.string,
+    }
+)
+
+MQTT_REPLAY_SCHEMA = vol.Schema(
+    {
+        vol.Required(ATTR_FILENAME): cv.string,
+        vol.Optional(ATTR_SPEED, default=1): vol.All(
+            vol.Coerce(float), vol.Range(min=0)
+        ),
+    }
+)
+
+MQTT_PROFILE_SCHEMA = vol.Schema(
+    {
+        vol.Optional(ATTR_DURATION, default=60): vol.All(
+            vol.Coerce(float), vol.Range(min=1, max=3600)
+        ),
+        vol.Optional(ATTR_FILENAME): cv.string,
+    }
+)
+
 
 # pylint: disable=invalid-name
 SubscribePayloadType = Union[str, bytes]  # Only bytes if encoding is None
@@ -512,6 +747,10 @@ async def async_setup(hass: HomeAssistantType, config: ConfigType) -> bool:
     hass.data[DATA_MQTT_HASS_CONFIG] = config
 
     websocket_api.async_register_command(hass, websocket_subscribe)
+    websocket_api.async_register_command(hass, websocket_metrics)
+    websocket_api.async_register_command(hass, websocket_trace)
+    websocket_api.async_register_command(hass, websocket_retained)
+    hass.http.register_view(MqttMetricsView)
 
     if conf is None:
         # If we have a config entry, setup is done by that config entry.
@@ -628,6 +867,12 @@ async def async_setup_entry(hass, entry):
         else:
             tls_version = ssl.PROTOCOL_TLSv1
 
+    spool = None
+    if CONF_SPOOL_FILE in conf:
+        spool = await hass.async_add_executor_job(
+            PublishSpool, hass.config.path(conf[CONF_SPOOL_FILE]), conf[CONF_SPOOL_SIZE]
+        )
+
     hass.data[DATA_MQTT] = MQTT(
         hass,
         broker=broker,
@@ -644,6 +889,27 @@ async def async_setup_entry(hass, entry):
         will_message=will_message,
         birth_message=birth_message,
         tls_version=tls_version,
+        match_cache_size=conf[CONF_MATCH_CACHE_SIZE],
+        clean_session=conf[CONF_CLEAN_SESSION],
+        client_loop=conf[CONF_CLIENT_LOOP],
+        reconnect_first_delay=conf[CONF_RECONNECT_FIRST_DELAY],
+        publish_queue_size=conf[CONF_PUBLISH_QUEUE_SIZE],
+        publish_overflow=conf[CONF_PUBLISH_OVERFLOW],
+        spool=spool,
+        spool_drain_rate=conf[CONF_SPOOL_DRAIN_RATE],
+        receive_maximum=conf.get(CONF_RECEIVE_MAXIMUM),
+        connections=conf[CONF_BROKER_CONNECTIONS],
+        shard_by=conf[CONF_SHARD_BY],
+        metrics_sample_interval=conf[CONF_METRICS_SAMPLE_INTERVAL],
+        slow_callback_threshold=conf.get(CONF_SLOW_CALLBACK_THRESHOLD),
+        trace_size=conf[CONF_TRACE_SIZE],
+        trace_topics=conf[CONF_TRACE_TOPICS],
+        ingest_policies=conf[CONF_INGEST_POLICIES],
+        high_priority_topics=conf[CONF_HIGH_PRIORITY_TOPICS],
+        low_priority_topics=conf[CONF_LOW_PRIORITY_TOPICS],
+        coalesce_backlog=conf[CONF_COALESCE_BACKLOG],
+        retained_cache_size=conf[CONF_RETAINED_CACHE_SIZE],
+        retained_max_payload_size=conf.get(CONF_RETAINED_MAX_PAYLOAD),
     )
 
     result: str = await hass.data[DATA_MQTT].async_connect()
@@ -660,32 +926,149 @@ async def async_setup_entry(hass, entry):
 
     hass.bus.async_listen_once(EVENT_HOMEASSISTANT_STOP, async_stop_mqtt)
 
+    @lru_cache(maxsize=TEMPLATE_CACHE_SIZE)
+    def compiled_template(source: str) -> template.Template:
+        """Return the template of a source, which keeps it compiled."""
+        return template.Template(source, hass)
+
+    @callback
+    def render_payload(data: ConfigType) -> Tuple[bool, PublishPayloadType]:
+        """Return if the payload of a publish call rendered, and the payload."""
+        payload_template = data.get(ATTR_PAYLOAD_TEMPLATE)
+        if payload_template is None:
+            return True, data.get(ATTR_PAYLOAD)
+        try:
+            return True, compiled_template(payload_template).async_render()
+        except (template.jinja2.TemplateError, TemplateError) as exc:
+            _LOGGER.error(
+                "Unable to publish to %s: rendering payload template of "
+                "%s failed because %s",
+                data[ATTR_TOPIC],
+                payload_template,
+                exc,
+            )
+            return False, None
+
     async def async_publish_service(call: ServiceCall):
         """Handle MQTT publish service calls."""
-        msg_topic: str = call.data[ATTR_TOPIC]
-        payload = call.data.get(ATTR_PAYLOAD)
-        payload_template = call.data.get(ATTR_PAYLOAD_TEMPLATE)
-        qos: int = call.data[ATTR_QOS]
-        retain: bool = call.data[ATTR_RETAIN]
-        if payload_template is not None:
-            try:
-                payload = template.Template(payload_template, hass).async_render()
-            except template.jinja2.TemplateError as exc:
-                _LOGGER.error(
-                    "Unable to publish to %s: rendering payload template of "
-                    "%s failed because %s",
-                    msg_topic,
-                    payload_template,
-                    exc,
-                )
-                return
+        rendered, payload = render_payload(call.data)
+        if not rendered:
+            return
 
-        await hass.data[DATA_MQTT].async_publish(msg_topic, payload, qos, retain)
+        await hass.data[DATA_MQTT].async_publish(
+            call.data[ATTR_TOPIC], payload, call.data[ATTR_QOS], call.data[ATTR_RETAIN]
+        )
 
     hass.services.async_register(
         DOMAIN, SERVICE_PUBLISH, async_publish_service, schema=MQTT_PUBLISH_SCHEMA
     )
 
+    async def async_publish_many_service(call: ServiceCall):
+        """Handle MQTT publish_many service calls."""
+        messages = []
+        for data in call.data[ATTR_MESSAGES]:
+            rendered, payload = render_payload(data)
+            if rendered:
+                messages.append(
+                    (data[ATTR_TOPIC], payload, data[ATTR_QOS], data[ATTR_RETAIN])
+                )
+
+        await hass.data[DATA_MQTT].async_publish_many(messages)
+
+    hass.services.async_register(
+        DOMAIN,
+        SERVICE_PUBLISH_MANY,
+        async_publish_many_service,
+        schema=MQTT_PUBLISH_MANY_SCHEMA,
+    )
+
+    async def async_reconnect_service(call: ServiceCall):
+        """Handle MQTT reconnect service calls."""
+        hass.data[DATA_MQTT].async_retry_now()
+
+    hass.services.async_register(
+        DOMAIN, SERVICE_RECONNECT, async_reconnect_service, schema=vol.Schema({})
+    )
+
+    async def async_profile_service(call: ServiceCall):
+        """Handle MQTT profile service calls."""
+        path = hass.config.path(
+            call.data.get(ATTR_FILENAME)
+            or "mqtt_profile.{}.pstats".format(int(time.time()))
+        )
+        await hass.data[DATA_MQTT].async_profile(call.data[ATTR_DURATION], path)
+        hass.components.persistent_notification.async_create(
+            "Wrote the profile of the MQTT message dispatch to {}".format(path),
+            title="MQTT profile",
+        )
+
+    hass.services.async_register(
+        DOMAIN, SERVICE_PROFILE, async_profile_service, schema=MQTT_PROFILE_SCHEMA
+    )
+
+    async def async_dump_trace_service(call: ServiceCall):
+        """Handle MQTT dump trace service calls."""
+        path = hass.config.path(
+            call.data.get(ATTR_FILENAME)
+            or "mqtt_trace.{}.jsonl".format(int(time.time()))
+        )
+        count = await hass.data[DATA_MQTT].async_dump_trace(path)
+        hass.components.persistent_notification.async_create(
+            "Wrote the last {} MQTT messages to {}".format(count, path),
+            title="MQTT trace",
+        )
+
+    hass.services.async_register(
+        DOMAIN,
+        SERVICE_DUMP_TRACE,
+        async_dump_trace_service,
+        schema=MQTT_DUMP_TRACE_SCHEMA,
+    )
+
+    async def async_capture_service(call: ServiceCall):
+        """Handle MQTT capture service calls."""
+        path = hass.config.path(
+            call.data.get(ATTR_FILENAME)
+            or "mqtt_capture.{}.bin".format(int(time.time()))
+        )
+        count = await hass.data[DATA_MQTT].async_capture(call.data[ATTR_DURATION], path)
+        hass.components.persistent_notification.async_create(
+            "Captured {} MQTT messages to {}".format(count, path),
+            title="MQTT capture",
+        )
+
+    hass.services.async_register(
+        DOMAIN, SERVICE_CAPTURE, async_capture_service, schema=MQTT_CAPTURE_SCHEMA
+    )
+
+    async def async_replay_service(call: ServiceCall):
+        """Handle MQTT replay service calls."""
+        path = hass.config.path(call.data[ATTR_FILENAME])
+        count, elapsed = await hass.data[DATA_MQTT].async_replay(
+            path, call.data[ATTR_SPEED]
+        )
+        hass.components.persistent_notification.async_create(
+            "Replayed {} MQTT messages from {} in {:.1f} seconds ({:.0f}/s)".format(
+                count, path, elapsed, count / elapsed if elapsed else 0
+            ),
+            title="MQTT replay",
+        )
+
+    hass.services.async_register(
+        DOMAIN, SERVICE_REPLAY, async_replay_service, schema=MQTT_REPLAY_SCHEMA
+    )
+
+    if conf[CONF_METRICS_SENSORS]:
+        hass.async_create_task(
+            async_load_platform(
+                hass,
+                "sensor",
+                DOMAIN,
+                {CONF_METRICS_SENSORS: True},
+                hass.data[DATA_MQTT_HASS_CONFIG],
+            )
+        )
+
     if conf.get(CONF_DISCOVERY):
         await _async_setup_discovery(
             hass, conf, hass.data[DATA_MQTT_HASS_CONFIG], entry
@@ -702,6 +1085,42 @@ class Subscription:
     callback = attr.ib(type=MessageCallbackType)
     qos = attr.ib(type=int, default=0)
     encoding = attr.ib(type=str, default="utf-8")
+    name = attr.ib(type=str, default="")
+
+
+def _decode_message(msg, encoding: Optional[str]) -> Optional[Message]:
+    """Return a received message decoded with an encoding, None if it can't be.
+
+    Without an encoding the payload stays the bytes received.
+    """
+    payload: SubscribePayloadType = msg.payload
+    if encoding is not None:
+        try:
+            payload = msg.payload.decode(encoding)
+        except (AttributeError, LookupError, UnicodeDecodeError):
+            return None
+    return Message(msg.topic, payload, msg.qos, msg.retain)
+
+
+def _callback_name(topic: str, msg_callback: MessageCallbackType) -> str:
+    """Return a name for a subscription callback in metrics.
+
+    Uses the entity the callback belongs to if it is the instance of a
+    bound method or referenced from the closure of the callback.
+    """
+    func = inspect.unwrap(msg_callback)
+    candidates = [getattr(func, "__self__", None)]
+    for cell in getattr(func, "__closure__", None) or ():
+        try:
+            candidates.append(cell.cell_contents)
+        except ValueError:
+            # Cell of a variable that isn't assigned yet
+            continue
+
+    for candidate in candidates:
+        if isinstance(candidate, Entity) and candidate.entity_id is not None:
+            return "{} {}".format(candidate.entity_id, topic)
+    return "{} {}".format(topic, getattr(func, "__qualname__", None) or repr(func))
 
 
 class MQTT:
@@ -724,98 +1143,371 @@ class MQTT:
         will_message: Optional[Message],
         birth_message: Optional[Message],
         tls_version: Optional[int],
+        match_cache_size: int = DEFAULT_MATCH_CACHE_SIZE,
+        clean_session: bool = DEFAULT_CLEAN_SESSION,
+        client_loop: str = DEFAULT_CLIENT_LOOP,
+        reconnect_first_delay: float = DEFAULT_RECONNECT_FIRST_DELAY,
+        publish_queue_size: int = DEFAULT_PUBLISH_QUEUE_SIZE,
+        publish_overflow: str = DEFAULT_PUBLISH_OVERFLOW,
+        spool: Optional[PublishSpool] = None,
+        spool_drain_rate: float = DEFAULT_SPOOL_DRAIN_RATE,
+        receive_maximum: Optional[int] = None,
+        connections: int = DEFAULT_CONNECTIONS,
+        shard_by: str = DEFAULT_SHARD_BY,
+        metrics_sample_interval: int = DEFAULT_METRICS_SAMPLE_INTERVAL,
+        slow_callback_threshold: Optional[float] = None,
+        trace_size: int = DEFAULT_TRACE_SIZE,
+        trace_topics: Sequence[str] = (),
+        ingest_policies: Sequence[IngestPolicy] = (),
+        high_priority_topics: Sequence[str] = DEFAULT_HIGH_PRIORITY_TOPICS,
+        low_priority_topics: Sequence[str] = DEFAULT_LOW_PRIORITY_TOPICS,
+        coalesce_backlog: int = DEFAULT_COALESCE_BACKLOG,
+        retained_cache_size: int = DEFAULT_RETAINED_CACHE_SIZE,
+        retained_max_payload_size: Optional[int] = None,
     ) -> None:
-        """Initialize Home Assistant MQTT client."""
+        """Initialize Home Assistant MQTT client.
+
+        With more than one connection, topic filters and published topics are
+        spread over the connections by shard_by. A message is dispatched to
+        the subscriptions whose filter belongs to the connection it came in
+        on, so overlapping filters on different connections don't deliver it
+        twice.
+        """
         self.hass = hass
         self.broker = broker
         self.port = port
         self.keepalive = keepalive
-        self.subscriptions: List[Subscription] = []
+        self._matcher = TopicMatcher()
+        self._filters = FilterRegistry()
+        self._retained = RetainedCache(retained_cache_size, retained_max_payload_size)
+        self._match_caches = [MatchCache(match_cache_size) for _ in range(connections)]
+        # Received messages waiting for the event loop, by priority
+        self._pending_messages: List[Deque[Tuple[int, mqtt.MQTTMessage]]] = [
+            deque() for _ in PRIORITIES
+        ]
+        self._priorities = InboundPriorities(high_priority_topics, low_priority_topics)
+        self._coalesce_backlog = coalesce_backlog
+        self._coalesced = 0
+        self._drain_scheduled = False
+        self._drain_scheduled_at = 0.0
+        self._metrics = Metrics(metrics_sample_interval)
+        self._metrics_timer: Optional[asyncio.TimerHandle] = None
+        # Time every callback to find slow ones
+        self._slow_callback_threshold = slow_callback_threshold
+        self._time_callbacks = slow_callback_threshold is not None
+        # Time of the last report and slow calls since, by callback name
+        self._slow_callbacks: Dict[str, Tuple[float, int]] = {}
+        self._profiler: Optional[cProfile.Profile] = None
+        self._capture: Optional[CaptureWriter] = None
+        self._tracer: Optional[MessageTracer] = None
+        if trace_size:
+            self._tracer = MessageTracer(trace_size, trace_topics)
+        # Per connection, as overlapping filters on different connections
+        # make the broker send a message on each of them
+        self._ingest_policies: Optional[List[IngestPolicies]] = None
+        if ingest_policies:
+            self._ingest_policies = [
+                IngestPolicies(ingest_policies) for _ in range(connections)
+            ]
+        self._ingest_batches = 0
+        self._ingest_messages = 0
+        self._ingest_max_batch = 0
         self.birth_message = birth_message
-        self.connected = False
-        self._mqttc: mqtt.Client = None
-        self._paho_lock = asyncio.Lock()
+        self._client_loop = client_loop
+        self._publish_queue = PublishQueue(
+            hass.loop, self._async_publish_batch, publish_queue_size, publish_overflow
+        )
+        self._spool = spool
+        self._spool_drain_rate = spool_drain_rate
+        self._spool_lock = asyncio.Lock()
+        self._spool_drain: Optional[asyncio.Task] = None
+        self._subscription_ids = SubscriptionIds()
+        self._shard_by = shard_by
+        self._session_store: Optional[SessionStore] = None
+        if not clean_session:
+            self._session_store = SessionStore(
+                hass, "{}:{}/{}/{}".format(broker, port, client_id, connections)
+            )
+        # Keep the filters of a restored session until all subscriptions
+        # are made, which is when Home Assistant has started.
+        self._keep_session_filters = False
+        # A persistent session of unknown state may hold subscriptions with
+        # identifiers now given to other filters.
+        self._check_subscription_ids = not clean_session
 
         if protocol == PROTOCOL_31:
             proto: int = mqtt.MQTTv31
+        elif protocol == PROTOCOL_5:
+            proto = mqtt.MQTTv5
         else:
             proto = mqtt.MQTTv311
 
-        if client_id is None:
-            self._mqttc = mqtt.Client(protocol=proto)
-        else:
-            self._mqttc = mqtt.Client(client_id, protocol=proto)
-
-        if username is not None:
-            self._mqttc.username_pw_set(username, password)
-
-        if certificate is not None:
-            self._mqttc.tls_set(
+        self._connections = [
+            Connection(
+                hass,
+                index,
+                broker,
+                port,
+                keepalive,
+                (
+                    client_id
+                    if client_id is None or index == 0
+                    else "{}_{}".format(client_id, index)
+                ),
+                clean_session,
+                username,
+                password,
                 certificate,
-                certfile=client_cert,
-                keyfile=client_key,
-                tls_version=tls_version,
+                client_key,
+                client_cert,
+                tls_insecure,
+                tls_version,
+                proto,
+                # The first connection carries the will, like the birth message
+                will_message if index == 0 else None,
+                client_loop,
+                reconnect_first_delay,
+                receive_maximum,
+                self._subscription_ids,
+                self._mqtt_on_message,
+                self._async_handle_connect,
             )
+            for index in range(connections)
+        ]
 
-            if tls_insecure is not None:
-                self._mqttc.tls_insecure_set(tls_insecure)
-
-        self._mqttc.on_connect = self._mqtt_on_connect
-        self._mqttc.on_disconnect = self._mqtt_on_disconnect
-        self._mqttc.on_message = self._mqtt_on_message
+    @property
+    def connected(self) -> bool:
+        """Return True if all connections are connected."""
+        return all(connection.connected for connection in self._connections)
 
-        if will_message is not None:
-            self._mqttc.will_set(  # pylint: disable=no-value-for-parameter
-                *attr.astuple(will_message)
-            )
+    @callback
+    def _shard(self, topic: str) -> int:
+        """Return the index of the connection of a topic or topic filter."""
+        return shard_index(topic, len(self._connections), self._shard_by)
 
     async def async_publish(
-        self, topic: str, payload: PublishPayloadType, qos: int, retain: bool
+        self,
+        topic: str,
+        payload: PublishPayloadType,
+        qos: int,
+        retain: bool,
+        priority: Optional[int] = None,
     ) -> None:
         """Publish a MQTT message.
 
+        The message is queued and sent by the publish queue writer. Retained
+        messages default to bulk priority, everything else is a command.
+
+        This method must be run in the event loop and returns a coroutine.
+        """
+        if await self._async_spool(topic, payload, qos, retain):
+            return
+
+        if priority is None:
+            priority = PRIORITY_BULK if retain else PRIORITY_COMMAND
+        await self._publish_queue.async_put(
+            PublishRequest(topic, payload, qos, retain, priority)
+        )
+
+    async def async_publish_many(
+        self, messages: Sequence[Tuple[str, PublishPayloadType, int, bool]]
+    ) -> None:
+        """Publish MQTT messages given as topic, payload, qos and retain.
+
+        The messages are queued without yielding in between unless the queue
+        is full, so the publish queue writer sends them in the same batches.
+
         This method must be run in the event loop and returns a coroutine.
         """
-        async with self._paho_lock:
-            _LOGGER.debug("Transmitting message on %s: %s", topic, payload)
-            await self.hass.async_add_job(
-                self._mqttc.publish, topic, payload, qos, retain
+        requests = []
+        for topic, payload, qos, retain in messages:
+            if not await self._async_spool(topic, payload, qos, retain):
+                requests.append(
+                    PublishRequest(
+                        topic,
+                        payload,
+                        qos,
+                        retain,
+                        PRIORITY_BULK if retain else PRIORITY_COMMAND,
+                    )
+                )
+
+        for request in requests:
+            await self._publish_queue.async_put(request)
+
+    async def _async_spool(
+        self, topic: str, payload: PublishPayloadType, qos: int, retain: bool
+    ) -> bool:
+        """Spool a message to publish later, return False to publish it now.
+
+        This method is a coroutine.
+        """
+        # Keep QoS 1 and 2 messages on disk while offline, and behind the
+        # ones already spooled until those are sent.
+        if (
+            self._spool is None
+            or qos == 0
+            or (self.connected and not len(self._spool) and self._spool_drain is None)
+        ):
+            return False
+
+        async with self._spool_lock:
+            return await self.hass.async_add_executor_job(
+                self._spool.append, topic, encode_payload(payload), qos, retain
             )
 
-    async def async_connect(self) -> str:
-        """Connect to the host. Does process messages yet.
+    async def _async_drain_spool(self) -> None:
+        """Publish spooled messages at the configured rate while connected.
 
         This method is a coroutine.
         """
-        result: int = None
+        interval = 1 / self._spool_drain_rate
+        _LOGGER.info("Publishing %d spooled MQTT messages", len(self._spool))
         try:
-            result = await self.hass.async_add_job(
-                self._mqttc.connect, self.broker, self.port, self.keepalive
+            while self.connected:
+                async with self._spool_lock:
+                    message = await self.hass.async_add_executor_job(self._spool.pop)
+                if message is None:
+                    break
+                await self._publish_queue.async_put(
+                    PublishRequest(
+                        message.topic,
+                        message.payload,
+                        message.qos,
+                        message.retain,
+                        PRIORITY_BULK if message.retain else PRIORITY_COMMAND,
+                    )
+                )
+                await asyncio.sleep(interval)
+        finally:
+            self._spool_drain = None
+
+    async def _async_publish_batch(self, batch: List[PublishRequest]) -> None:
+        """Hand a batch of queued messages to the connections of their topics.
+
+        All messages on a topic use the same connection, which keeps them in
+        order.
+        """
+        count_out = self._metrics.count_out
+        tracer = self._tracer
+        for request in batch:
+            count_out(request.topic)
+            if tracer is not None:
+                tracer.record(
+                    DIRECTION_OUT,
+                    request.topic,
+                    payload_size(request.payload),
+                    request.qos,
+                    request.retain,
+                )
+
+        if len(self._connections) == 1:
+            await self._connections[0].async_publish_batch(batch)
+            return
+
+        shards: Dict[int, List[PublishRequest]] = {}
+        for request in batch:
+            shards.setdefault(self._shard(request.topic), []).append(request)
+        await asyncio.gather(
+            *(
+                self._connections[shard].async_publish_batch(requests)
+                for shard, requests in shards.items()
             )
-        except OSError as err:
-            _LOGGER.error("Failed to connect due to exception: %s", err)
-            return CONNECTION_FAILED_RECOVERABLE
+        )
 
-        if result != 0:
-            _LOGGER.error("Failed to connect: %s", mqtt.error_string(result))
-            return CONNECTION_FAILED
+    @property
+    def publish_queue_stats(self) -> Dict[str, Union[int, float]]:
+        """Return depth, drop and latency counters of the publish queue."""
+        return self._publish_queue.stats()
+
+    async def async_connect(self) -> str:
+        """Connect to the host. Does process messages yet.
 
-        self._mqttc.loop_start()
+        This method is a coroutine.
+        """
+        self._async_sample_metrics()
+
+        if self._session_store is not None:
+            await self._async_restore_session(self._session_store)
+
+        for index, connection in enumerate(self._connections):
+            result = await connection.async_connect()
+            if result != CONNECTION_SUCCESS:
+                for connected in self._connections[:index]:
+                    await connected.async_disconnect()
+                self._metrics_timer.cancel()
+                return result
+
+        # Messages published while connecting wait in the queue until now
+        self._publish_queue.start()
         return CONNECTION_SUCCESS
 
-    @callback
-    def async_disconnect(self):
+    async def _async_restore_session(self, store: SessionStore) -> None:
+        """Restore the broker session and retained messages saved when stopping.
+
+        This method is a coroutine.
+        """
+        data = await store.async_load()
+        if data is None:
+            return
+        for connection, filters in zip(self._connections, data["filters"]):
+            connection.async_restore_session(filters)
+        for msg in decode_messages(data["retained"]):
+            self._retained.put(msg.topic, msg)
+        self._subscription_ids.restore(
+            data.get("subscription_ids", {}), data.get("next_subscription_id", 1)
+        )
+        self._check_subscription_ids = False
+        _LOGGER.info(
+            "Restored %d subscribed filters and %d retained messages of the "
+            "MQTT session",
+            sum(len(filters) for filters in data["filters"]),
+            len(self._retained),
+        )
+
+        @callback
+        def async_started(_event: Optional[Event] = None) -> None:
+            """Unsubscribe from the restored filters no longer subscribed."""
+            self._keep_session_filters = False
+            for connection in self._connections:
+                connection.async_unsubscribe_unknown(
+                    self._shard_filters(connection.index)
+                )
+
+        if self.hass.state == CoreState.not_running:
+            self._keep_session_filters = True
+            self.hass.bus.async_listen_once(EVENT_HOMEASSISTANT_START, async_started)
+
+    async def async_disconnect(self):
         """Stop the MQTT client.
 
-        This method must be run in the event loop and returns a coroutine.
+        This method is a coroutine.
         """
+        await self._publish_queue.async_stop()
+        self._metrics_timer.cancel()
 
-        def stop():
-            """Stop the MQTT client."""
-            self._mqttc.disconnect()
-            self._mqttc.loop_stop()
+        if self._spool is not None:
+            if self._spool_drain is not None:
+                self._spool_drain.cancel()
+            async with self._spool_lock:
+                await self.hass.async_add_executor_job(self._spool.close)
 
-        return self.hass.async_add_job(stop)
+        await asyncio.gather(
+            *(connection.async_disconnect() for connection in self._connections)
+        )
+
+        if self._session_store is not None:
+            filters = [connection.broker_filters for connection in self._connections]
+            await self._session_store.async_save(
+                {
+                    "filters": filters,
+                    "retained": encode_messages(self._retained.items()),
+                    "subscription_ids": self._subscription_ids.saved(
+                        topic for shard_filters in filters for topic in shard_filters
+                    ),
+                    "next_subscription_id": self._subscription_ids.next_id,
+                }
+            )
 
     async def async_subscribe(
         self,
@@ -831,159 +1523,585 @@ class MQTT:
         if not isinstance(topic, str):
             raise HomeAssistantError("Topic needs to be a string!")
 
-        subscription = Subscription(topic, msg_callback, qos, encoding)
-        self.subscriptions.append(subscription)
+        shard = self._shard(topic)
+        subscription = Subscription(
+            topic, msg_callback, qos, encoding, _callback_name(topic, msg_callback)
+        )
+        self._matcher.add(topic, subscription)
+        self._match_caches[shard].invalidate(topic)
 
-        await self._async_perform_subscription(topic, qos)
+        subscribe_qos = self._filters.add(topic, qos)
+        # Queue the first subscriber of the filter or a QoS upgrade
+        if subscribe_qos is None or not self._connections[
+            shard
+        ].async_queue_subscription(topic, subscribe_qos):
+            # The broker won't resend retained messages, serve them locally.
+            self._async_replay_retained(subscription)
+
+        removed = False
 
         @callback
         def async_remove() -> None:
             """Remove subscription."""
-            if subscription not in self.subscriptions:
+            nonlocal removed
+            if removed:
                 raise HomeAssistantError("Can't remove subscription twice")
-            self.subscriptions.remove(subscription)
+            removed = True
+            self._matcher.remove(topic, subscription)
+            self._match_caches[shard].invalidate(topic)
 
-            if any(other.topic == topic for other in self.subscriptions):
+            if not self._filters.remove(topic, qos):
                 # Other subscriptions on topic remaining - don't unsubscribe.
                 return
 
-            # Only unsubscribe if currently connected.
-            if self.connected:
-                self.hass.async_create_task(self._async_unsubscribe(topic))
+            self._async_forget_retained(topic)
 
-        return async_remove
+            self._connections[shard].async_queue_unsubscribe(topic)
 
-    async def _async_unsubscribe(self, topic: str) -> None:
-        """Unsubscribe from a topic.
+        return async_remove
 
-        This method is a coroutine.
-        """
-        async with self._paho_lock:
-            result: int = None
-            result, _ = await self.hass.async_add_job(self._mqttc.unsubscribe, topic)
-            _raise_on_error(result)
+    @property
+    def subscription_count(self) -> int:
+        """Return the number of local subscriptions."""
+        return len(self._matcher)
 
-    async def _async_perform_subscription(self, topic: str, qos: int) -> None:
-        """Perform a paho-mqtt subscription."""
-        _LOGGER.debug("Subscribing to %s", topic)
+    @callback
+    def _async_replay_retained(self, subscription: Subscription) -> None:
+        """Deliver the known retained messages of a filter to a new subscriber."""
+        for _, msg in self._retained.match(subscription.topic):
+            self.hass.loop.call_soon(self._async_deliver, subscription, msg)
 
-        async with self._paho_lock:
-            result: int = None
-            result, _ = await self.hass.async_add_job(self._mqttc.subscribe, topic, qos)
-            _raise_on_error(result)
+    @callback
+    def _async_forget_retained(self, topic_filter: str) -> None:
+        """Drop retained messages no remaining subscription receives updates for."""
+        for topic, _ in self._retained.match(topic_filter):
+            if not self._matcher.match(topic):
+                self._retained.pop(topic)
 
-    def _mqtt_on_connect(self, _mqttc, _userdata, _flags, result_code: int) -> None:
-        """On connect callback.
+    @callback
+    def retained(self, prefix: str, limit: int) -> Dict[str, Any]:
+        """Return the cached retained messages on topics starting with a prefix.
 
-        Resubscribe to all topics we were subscribed to and publish birth
-        message.
+        At most limit messages are returned, sorted by topic, and the number
+        of matching topics.
         """
-        if result_code != mqtt.CONNACK_ACCEPTED:
-            _LOGGER.error(
-                "Unable to connect to the MQTT broker: %s",
-                mqtt.connack_string(result_code),
+        count, messages = self._retained.browse(prefix, limit)
+        entries = []
+        for topic, msg in messages:
+            try:
+                payload: Optional[str] = msg.payload.decode("utf-8")
+            except UnicodeDecodeError:
+                payload = None
+            entries.append(
+                {
+                    "topic": topic,
+                    "payload": payload,
+                    "size": len(msg.payload),
+                    "qos": msg.qos,
+                }
             )
-            self._mqttc.disconnect()
-            return
+        return {"count": count, "messages": entries}
 
-        self.connected = True
+    @callback
+    def _async_handle_connect(
+        self, connection: Connection, session_present: bool
+    ) -> None:
+        """Resubscribe and publish the birth message after connecting."""
+        # Re-subscribe once for each topic with the highest requested qos
+        connection.async_resubscribe(
+            self._shard_filters(connection.index),
+            session_present,
+            not self._keep_session_filters,
+        )
 
-        # Group subscriptions to only re-subscribe once for each topic.
-        keyfunc = attrgetter("topic")
-        for topic, subs in groupby(sorted(self.subscriptions, key=keyfunc), keyfunc):
-            # Re-subscribe with the highest requested qos
-            max_qos = max(subscription.qos for subscription in subs)
-            self.hass.add_job(self._async_perform_subscription, topic, max_qos)
+        if (
+            self._spool is not None
+            and self.connected
+            and len(self._spool)
+            and self._spool_drain is None
+        ):
+            self._spool_drain = self.hass.async_create_task(self._async_drain_spool())
 
-        if self.birth_message:
-            self.hass.add_job(
+        if self.birth_message and connection.index == 0:
+            self.hass.async_create_task(
                 self.async_publish(  # pylint: disable=no-value-for-parameter
                     *attr.astuple(self.birth_message)
                 )
             )
 
-    def _mqtt_on_message(self, _mqttc, _userdata, msg) -> None:
-        """Message received callback."""
-        self.hass.add_job(self._mqtt_handle_message, msg)
+    @callback
+    def _shard_filters(self, shard: int) -> Dict[str, int]:
+        """Return the filters of a connection with their highest requested QoS."""
+        return {
+            topic: qos
+            for topic, qos in self._filters.items()
+            if self._shard(topic) == shard
+        }
+
+    @property
+    def last_resubscribe_duration(self) -> Optional[float]:
+        """Return the seconds until all connections were subscribed again."""
+        durations = [
+            connection.last_resubscribe_duration
+            for connection in self._connections
+            if connection.last_resubscribe_duration is not None
+        ]
+        return max(durations) if durations else None
+
+    def _mqtt_on_message(self, _mqttc, shard: int, msg) -> None:
+        """Message received callback.
+
+        Runs in the paho thread, or the event loop with the asyncio client
+        loop. Messages of all connections are buffered and handed to the
+        event loop in batches, with at most one pending wakeup at a time.
+        """
+        capture = self._capture
+        if capture is not None:
+            capture.write(msg.topic, msg.qos, msg.retain, msg.payload)
+
+        priority = self._priorities.priority(msg.topic)
+        self._pending_messages[priority].append((shard, msg))
+        if not self._drain_scheduled:
+            self._drain_scheduled = True
+            self._drain_scheduled_at = time.perf_counter()
+            if self._client_loop == CLIENT_LOOP_ASYNCIO:
+                # Already in the event loop, no need to wake it up.
+                self.hass.loop.call_soon(self._async_drain_messages)
+            else:
+                self.hass.loop.call_soon_threadsafe(self._async_drain_messages)
 
     @callback
-    def _mqtt_handle_message(self, msg) -> None:
-        _LOGGER.debug(
-            "Received message on %s%s: %s",
-            msg.topic,
-            " (retained)" if msg.retain else "",
-            msg.payload,
+    def _async_drain_messages(self) -> None:
+        """Handle all messages buffered by the paho thread."""
+        # Clear the flag first so messages appended while draining schedule
+        # a new wakeup instead of being left behind.
+        self._drain_scheduled = False
+        self._metrics.handoff_latency.observe(
+            time.perf_counter() - self._drain_scheduled_at
         )
+        counts = [len(pending) for pending in self._pending_messages]
+        batch_size = sum(counts)
+
+        self._ingest_batches += 1
+        self._ingest_messages += batch_size
+        if batch_size > self._ingest_max_batch:
+            self._ingest_max_batch = batch_size
 
-        for subscription in self.subscriptions:
-            if not _match_topic(subscription.topic, msg.topic):
+        if self._profiler is not None:
+            self._profiler.runcall(self._async_handle_batch, counts)
+        else:
+            self._async_handle_batch(counts)
+
+    @callback
+    def _async_handle_batch(self, counts: List[int]) -> None:
+        """Handle a number of buffered messages of each priority, highest first.
+
+        When more messages than coalesce_backlog are buffered, only the
+        latest low priority message on each topic is handled.
+        """
+        # Only handle what was queued on wakeup so a continuous stream of
+        # messages can't starve the event loop.
+        overloaded = sum(counts) > self._coalesce_backlog
+        for priority, count in enumerate(counts):
+            pending = self._pending_messages[priority]
+            if priority == PRIORITY_LOW and overloaded:
+                messages = coalesce([pending.popleft() for _ in range(count)])
+                self._coalesced += count - len(messages)
+                for shard, msg in messages:
+                    self._mqtt_handle_message(shard, msg)
                 continue
+            for _ in range(count):
+                self._mqtt_handle_message(*pending.popleft())
+
+    @callback
+    def trace(
+        self, topic_filter: Optional[str] = None, limit: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        """Return the last messages recorded by the tracer, oldest first."""
+        if self._tracer is None:
+            raise HomeAssistantError("MQTT message tracing is turned off")
+        return self._tracer.entries(topic_filter, limit)
+
+    async def async_dump_trace(self, path: str) -> int:
+        """Write the last messages recorded by the tracer to a file.
+
+        This method is a coroutine.
+        """
+        if self._tracer is None:
+            raise HomeAssistantError("MQTT message tracing is turned off")
+        # Copy the entries in the event loop, where messages are recorded
+        entries = self._tracer.entries()
+        await self.hass.async_add_executor_job(write_entries, path, entries)
+        return len(entries)
+
+    async def async_capture(self, duration: float, path: str) -> int:
+        """Write all received messages to a capture file for a while.
 
-            payload: SubscribePayloadType = msg.payload
-            if subscription.encoding is not None:
+        Returns the number of captured messages.
+
+        This method is a coroutine.
+        """
+        if self._capture is not None:
+            raise HomeAssistantError("MQTT messages are already being captured")
+
+        capture = await self.hass.async_add_executor_job(CaptureWriter, path)
+        self._capture = capture
+        try:
+            await asyncio.sleep(duration)
+        finally:
+            self._capture = None
+            await self.hass.async_add_executor_job(capture.close)
+        return capture.messages
+
+    async def async_replay(self, path: str, speed: float) -> Tuple[int, float]:
+        """Dispatch the messages of a capture file as if they were received.
+
+        Messages are replayed speed times as fast as they were captured, or
+        as fast as possible with speed 0. Returns the number of messages and
+        the seconds it took.
+
+        This method is a coroutine.
+        """
+        try:
+            reader = await self.hass.async_add_executor_job(CaptureReader, path)
+        except (OSError, ValueError) as err:
+            raise HomeAssistantError("Can't replay {}: {}".format(path, err))
+        shards = range(len(self._connections))
+        count = 0
+        start = time.monotonic()
+        first: Optional[float] = None
+        try:
+            while True:
                 try:
-                    payload = msg.payload.decode(subscription.encoding)
-                except (AttributeError, UnicodeDecodeError):
-                    _LOGGER.warning(
-                        "Can't decode payload %s on %s with encoding %s (for %s)",
-                        msg.payload,
-                        msg.topic,
-                        subscription.encoding,
-                        subscription.callback,
+                    chunk = await self.hass.async_add_executor_job(
+                        reader.read, REPLAY_CHUNK
                     )
-                    continue
+                except (OSError, ValueError) as err:
+                    raise HomeAssistantError(
+                        "Can't replay {} after {} messages: {}".format(
+                            path, count, err
+                        )
+                    )
+                if not chunk:
+                    if reader.truncated:
+                        _LOGGER.warning(
+                            "Capture %s ends with a truncated record", path
+                        )
+                    break
+                if first is None:
+                    first = chunk[0].time
+
+                for captured in chunk:
+                    if speed:
+                        delay = (captured.time - first) / speed - (
+                            time.monotonic() - start
+                        )
+                        if delay > 0:
+                            await asyncio.sleep(delay)
+
+                    msg = mqtt.MQTTMessage(topic=captured.topic.encode("utf-8"))
+                    msg.payload = captured.payload
+                    msg.qos = captured.qos
+                    msg.retain = captured.retain
+                    # Each connection gets the messages of its own filters
+                    for shard in shards:
+                        self._mqtt_handle_message(shard, msg)
+                    count += 1
+
+                # Let the callbacks' state writes run between chunks
+                await asyncio.sleep(0)
+        finally:
+            await self.hass.async_add_executor_job(reader.close)
+        return count, time.monotonic() - start
+
+    async def async_profile(self, duration: float, path: str) -> None:
+        """Profile the handling of received messages for a while.
+
+        Only the dispatch in the event loop is profiled, which includes the
+        callbacks but not coroutines they start. The stats are written to
+        path in the pstats format.
+
+        This method is a coroutine.
+        """
+        if self._profiler is not None:
+            raise HomeAssistantError("MQTT dispatch is already being profiled")
+
+        profiler = self._profiler = cProfile.Profile()
+        try:
+            await asyncio.sleep(duration)
+        finally:
+            self._profiler = None
+        await self.hass.async_add_executor_job(profiler.dump_stats, path)
+
+    @property
+    def ingest_stats(self) -> Dict[str, Union[int, float]]:
+        """Return batch size and queue depth counters of the ingest buffer."""
+        return {
+            "queue_depth": sum(len(pending) for pending in self._pending_messages),
+            "batches": self._ingest_batches,
+            "messages": self._ingest_messages,
+            "max_batch_size": self._ingest_max_batch,
+            "mean_batch_size": (
+                self._ingest_messages / self._ingest_batches
+                if self._ingest_batches
+                else 0
+            ),
+        }
+
+    @callback
+    def _mqtt_handle_message(self, shard: int, msg) -> None:
+        """Dispatch a received message, timing every few messages.
+
+        The ingest policies can drop a message, or hold it back to dispatch
+        the latest message on its topic later.
+        """
+        metrics = self._metrics
+        timed = metrics.count_in(msg.topic)
 
-            self.hass.async_run_job(
-                subscription.callback, Message(msg.topic, payload, msg.qos, msg.retain)
+        if self._ingest_policies is not None:
+            policies = self._ingest_policies[shard]
+            delay = policies.check(
+                msg.topic, msg.payload, msg.retain, (shard, msg), time.monotonic()
             )
+            if delay is None:
+                return
+            if delay:
+                self.hass.loop.call_later(
+                    delay, self._async_dispatch_held_back, policies, msg.topic
+                )
+                return
 
-    def _mqtt_on_disconnect(self, _mqttc, _userdata, result_code: int) -> None:
-        """Disconnected callback."""
-        self.connected = False
+        if not timed:
+            self._async_dispatch(shard, msg, self._time_callbacks)
+            return
+
+        start = time.perf_counter()
+        self._async_dispatch(shard, msg, True)
+        metrics.dispatch_time.observe(time.perf_counter() - start)
+
+    @callback
+    def _async_dispatch_held_back(self, policies: IngestPolicies, topic: str) -> None:
+        """Dispatch the latest message held back by a minimum interval."""
+        shard, msg = policies.pop_pending(topic, time.monotonic())
+        self._async_dispatch(shard, msg, self._time_callbacks)
+
+    @callback
+    def _async_dispatch(self, shard: int, msg, timed: bool) -> None:
+        """Run the callbacks of the subscriptions matching a message.
 
-        # When disconnected because of calling disconnect()
-        if result_code == 0:
+        Coroutine callbacks are only scheduled, so the time of timed
+        callbacks doesn't include them.
+        """
+        subscriptions = self._subscriptions_by_id(msg)
+        if subscriptions is None:
+            subscriptions = self._match_subscriptions(msg.topic, shard)
+
+        if self._tracer is not None:
+            self._tracer.record(
+                DIRECTION_IN,
+                msg.topic,
+                len(msg.payload),
+                msg.qos,
+                msg.retain,
+                len(subscriptions),
+            )
+
+        # Remember retained messages for subscribers joining later. The broker
+        # only sets the retain flag when replaying, so keep following topics
+        # that had a retained message. An empty retained message clears it.
+        if msg.retain or msg.topic in self._retained:
+            if msg.retain and not msg.payload:
+                self._retained.pop(msg.topic)
+            elif subscriptions or msg.topic in self._retained:
+                # Also keep restored messages current for late subscribers
+                self._retained.put(msg.topic, msg)
+
+        # Share the decoded messages between the subscriptions
+        messages: Optional[Dict[Optional[str], Optional[Message]]] = (
+            {} if len(subscriptions) > 1 else None
+        )
+
+        if not timed:
+            for subscription in subscriptions:
+                self._async_deliver(subscription, msg, messages)
             return
 
-        tries = 0
+        threshold = self._slow_callback_threshold
+        for subscription in subscriptions:
+            start = time.perf_counter()
+            self._async_deliver(subscription, msg, messages)
+            duration = time.perf_counter() - start
+            self._metrics.observe_callback(subscription.name, duration)
+            if threshold is not None and duration > threshold:
+                self._async_report_slow_callback(subscription, msg.topic, duration)
 
-        while True:
-            try:
-                if self._mqttc.reconnect() == 0:
-                    self.connected = True
-                    _LOGGER.info("Successfully reconnected to the MQTT server")
-                    break
-            except socket.error:
-                pass
+    @callback
+    def _async_report_slow_callback(
+        self, subscription: Subscription, topic: str, duration: float
+    ) -> None:
+        """Log and fire an event for a slow callback, once a minute at most."""
+        name = subscription.name
+        now = time.monotonic()
+        last_report = self._slow_callbacks.get(name)
+        if last_report is not None and now - last_report[0] < SLOW_CALLBACK_REPORT:
+            self._slow_callbacks[name] = (last_report[0], last_report[1] + 1)
+            return
 
-            wait_time = min(2 ** tries, MAX_RECONNECT_WAIT)
+        count = last_report[1] + 1 if last_report is not None else 1
+        self._slow_callbacks[name] = (now, 0)
+        _LOGGER.warning(
+            "Handling a message on %s took %.1f ms in %s (%d slow calls)",
+            topic,
+            duration * 1000,
+            name,
+            count,
+        )
+        self.hass.bus.async_fire(
+            EVENT_MQTT_SLOW_CALLBACK,
+            {"callback": name, "topic": topic, "duration": duration, "count": count},
+        )
+
+    @callback
+    def _async_deliver(
+        self,
+        subscription: Subscription,
+        msg,
+        messages: Optional[Dict[Optional[str], Optional[Message]]] = None,
+    ) -> None:
+        """Decode a message for a subscription and run its callback.
+
+        The message is decoded once per encoding and shared through
+        messages, with None for payloads that can't be decoded.
+        """
+        encoding = subscription.encoding
+        if messages is not None and encoding in messages:
+            message = messages[encoding]
+        else:
+            message = _decode_message(msg, encoding)
+            if messages is not None:
+                messages[encoding] = message
+
+        if message is None:
             _LOGGER.warning(
-                "Disconnected from MQTT (%s). Trying to reconnect in %s s",
-                result_code,
-                wait_time,
+                "Can't decode payload %s on %s with encoding %s (for %s)",
+                msg.payload,
+                msg.topic,
+                encoding,
+                subscription.callback,
             )
-            # It is ok to sleep here as we are in the MQTT thread.
-            time.sleep(wait_time)
-            tries += 1
+            return
 
+        self.hass.async_run_job(subscription.callback, message)
 
-def _raise_on_error(result_code: int) -> None:
-    """Raise error if error result."""
-    if result_code != 0:
-        raise HomeAssistantError(
-            "Error talking to MQTT: {}".format(mqtt.error_string(result_code))
+    @callback
+    def _async_sample_metrics(self) -> None:
+        """Sample the message counters for rates, and again in RATE_INTERVAL."""
+        self._metrics.sample(time.monotonic())
+        self._metrics_timer = self.hass.loop.call_later(
+            RATE_INTERVAL, self._async_sample_metrics
         )
 
+    @property
+    def metrics(self) -> Dict[str, Any]:
+        """Return message rates, timings, queue depths and other counters."""
+        metrics = self._metrics.snapshot(time.monotonic())
+        publish_queue = self.publish_queue_stats
+        ingest = self.ingest_stats
+        metrics.update(
+            {
+                "connected": self.connected,
+                "subscriptions": self.subscription_count,
+                "publish_queue_depth": publish_queue["depth"],
+                "ingest_queue_depth": ingest["queue_depth"],
+                "publish_queue": publish_queue,
+                "ingest": ingest,
+                "match_cache": self.match_cache_stats,
+                "retained_cache": self._retained.stats(),
+                "dropped": self.dropped_stats,
+                "last_reconnect_duration": self.last_reconnect_duration,
+                "last_resubscribe_duration": self.last_resubscribe_duration,
+            }
+        )
+        return metrics
 
-def _match_topic(subscription: str, topic: str) -> bool:
-    """Test if topic matches subscription."""
-    matcher = MQTTMatcher()
-    matcher[subscription] = True
-    try:
-        next(matcher.iter_match(topic))
-        return True
-    except StopIteration:
-        return False
+    @callback
+    def callback_metrics(self, limit: int) -> List[Dict[str, Any]]:
+        """Return the timings of the callbacks with the most time spent."""
+        return self._metrics.callback_stats(limit)
+
+    @property
+    def dropped_stats(self) -> Dict[str, int]:
+        """Return the number of messages dropped by the ingest policies.
+
+        Also counts low priority messages skipped by coalescing.
+        """
+        dropped = {DROPPED_COALESCED: self._coalesced}
+        for policies in self._ingest_policies or ():
+            for reason, count in policies.dropped.items():
+                dropped[reason] = dropped.get(reason, 0) + count
+        return dropped
+
+    @property
+    def match_cache_stats(self) -> Dict[str, int]:
+        """Return the hit, miss and eviction counters of the match caches."""
+        stats: Dict[str, int] = {}
+        for cache in self._match_caches:
+            for key, value in cache.stats().items():
+                stats[key] = stats.get(key, 0) + value
+        return stats
+
+    @callback
+    def _match_subscriptions(self, topic: str, shard: int) -> Tuple[Subscription, ...]:
+        """Return the subscriptions of a connection matching a concrete topic."""
+        cache = self._match_caches[shard]
+        subscriptions = cache.get(topic)
+        if subscriptions is None:
+            subscriptions = tuple(
+                subscription
+                for subscription in self._matcher.match(topic)
+                if self._shard(subscription.topic) == shard
+            )
+            cache.put(topic, subscriptions)
+        return subscriptions
+
+    @callback
+    def _subscriptions_by_id(self, msg) -> Optional[Tuple[Subscription, ...]]:
+        """Return the subscriptions of the subscription identifiers of a message.
+
+        Return None to match the topic instead if the identifiers are unknown
+        or, as left over from a session before a restart, don't match it.
+        """
+        topic_filters = self._subscription_ids.filters(msg)
+        if topic_filters is None:
+            return None
+        if self._check_subscription_ids:
+            topic = msg.topic
+            for topic_filter in topic_filters:
+                if not match_topic(topic_filter, topic):
+                    return None
+        if len(topic_filters) == 1:
+            return tuple(self._matcher.get(topic_filters[0]))
+        return tuple(
+            subscription
+            for topic_filter in topic_filters
+            for subscription in self._matcher.get(topic_filter)
+        )
+
+    @callback
+    def async_retry_now(self) -> None:
+        """Retry connecting right away, for example when the network is back."""
+        for connection in self._connections:
+            connection.async_retry_now()
+
+    @property
+    def last_reconnect_duration(self) -> Optional[float]:
+        """Return the seconds it took to reconnect after the last disconnect."""
+        durations = [
+            connection.last_reconnect_duration
+            for connection in self._connections
+            if connection.last_reconnect_duration is not None
+        ]
+        return max(durations) if durations else None
 
 
 class MqttAttributes(Entity):
@@ -1019,8 +2137,10 @@ class MqttAttributes(Entity):
             try:
                 payload = msg.payload
                 if attr_tpl is not None:
-                    payload = attr_tpl.async_render_with_possible_json_value(payload)
-                json_dict = json.loads(payload)
+                    payload = async_render_message(attr_tpl, msg)
+                    json_dict = json.loads(payload)
+                else:
+                    json_dict = msg.payload_json()
                 if isinstance(json_dict, dict):
                     self._attributes = json_dict
                     self.async_write_ha_state()
@@ -1212,29 +2332,163 @@ class MqttEntityDeviceInfo(Entity):
     {
         vol.Required("type"): "mqtt/subscribe",
         vol.Required("topic"): valid_subscribe_topic,
+        vol.Optional("batch_interval"): vol.All(
+            vol.Coerce(float), vol.Range(min=0.01, max=60)
+        ),
+        vol.Optional("latest", default=False): bool,
+        vol.Optional("max_rate"): vol.All(vol.Coerce(float), vol.Range(min=0.1)),
+        vol.Optional("max_payload_size"): vol.All(vol.Coerce(int), vol.Range(min=0)),
+        vol.Optional("binary", default=BINARY_SKIP): vol.In(BINARY_MODES),
     }
 )
 async def websocket_subscribe(hass, connection, msg):
-    """Subscribe to a MQTT topic."""
+    """Subscribe to a MQTT topic.
+
+    With batch_interval the messages are sent as one event with a list of
+    them every batch_interval seconds, with latest only the last message on
+    each topic.
+    """
     if not connection.user.is_admin:
         raise Unauthorized
 
-    async def forward_messages(mqttmsg: Message):
+    forwarder = MessageForwarder(
+        hass.loop,
+        lambda data: connection.send_message(
+            websocket_api.event_message(msg["id"], data)
+        ),
+        msg.get("batch_interval"),
+        msg["latest"],
+        msg.get("max_rate"),
+        msg.get("max_payload_size"),
+        msg["binary"],
+    )
+
+    @callback
+    def forward_message(mqttmsg: Message):
         """Forward events to websocket."""
+        forwarder.async_forward(mqttmsg)
+
+    async_remove = await async_subscribe(
+        hass, msg["topic"], forward_message, encoding=None
+    )
+
+    @callback
+    def async_unsubscribe():
+        """Unsubscribe and stop forwarding."""
+        async_remove()
+        forwarder.async_cancel()
+
+    connection.subscriptions[msg["id"]] = async_unsubscribe
+
+    connection.send_message(websocket_api.result_message(msg["id"]))
+
+
+@websocket_api.websocket_command(
+    {
+        vol.Required("type"): "mqtt/metrics",
+        vol.Optional("callbacks"): vol.All(vol.Coerce(int), vol.Range(min=1)),
+    }
+)
+@callback
+def websocket_metrics(hass, connection, msg):
+    """Return the runtime metrics of the MQTT client.
+
+    The callbacks with the most time spent are included, as many as asked
+    for in callbacks.
+    """
+    if not connection.user.is_admin:
+        raise Unauthorized
+
+    if DATA_MQTT not in hass.data:
         connection.send_message(
-            websocket_api.event_message(
-                msg["id"],
-                {
-                    "topic": mqttmsg.topic,
-                    "payload": mqttmsg.payload,
-                    "qos": mqttmsg.qos,
-                    "retain": mqttmsg.retain,
-                },
+            websocket_api.error_message(
+                msg["id"], websocket_api.const.ERR_NOT_FOUND, "MQTT is not set up"
             )
         )
+        return
+
+    metrics = hass.data[DATA_MQTT].metrics
+    if "callbacks" in msg:
+        metrics["callback_time"] = hass.data[DATA_MQTT].callback_metrics(
+            msg["callbacks"]
+        )
+    connection.send_message(websocket_api.result_message(msg["id"], metrics))
+
+
+class MqttMetricsView(HomeAssistantView):
+    """Serve the runtime metrics of the MQTT client to Prometheus."""
+
+    url = "/api/mqtt/metrics"
+    name = "api:mqtt:metrics"
+
+    async def get(self, request):
+        """Return the metrics in the Prometheus text format."""
+        if not request["hass_user"].is_admin:
+            raise Unauthorized
+
+        hass = request.app["hass"]
+        if DATA_MQTT not in hass.data:
+            return self.json_message("MQTT is not set up", HTTP_NOT_FOUND)
+
+        return web.Response(
+            text=prometheus_text(hass.data[DATA_MQTT].metrics),
+            content_type=CONTENT_TYPE_TEXT_PLAIN,
+        )
+
 
-    connection.subscriptions[msg["id"]] = await async_subscribe(
-        hass, msg["topic"], forward_messages
+@websocket_api.websocket_command(
+    {
+        vol.Required("type"): "mqtt/trace",
+        vol.Optional("topic"): valid_subscribe_topic,
+        vol.Optional("limit"): vol.All(vol.Coerce(int), vol.Range(min=1)),
+    }
+)
+@callback
+def websocket_trace(hass, connection, msg):
+    """Return the last MQTT messages, optionally only those matching a topic."""
+    if not connection.user.is_admin:
+        raise Unauthorized
+
+    try:
+        messages = hass.data[DATA_MQTT].trace(msg.get("topic"), msg.get("limit"))
+    except (KeyError, HomeAssistantError) as err:
+        connection.send_message(
+            websocket_api.error_message(
+                msg["id"], websocket_api.const.ERR_NOT_FOUND, str(err)
+            )
+        )
+        return
+
+    connection.send_message(
+        websocket_api.result_message(msg["id"], {"messages": messages})
     )
 
-    connection.send_message(websocket_api.result_message(msg["id"]))
+
+@websocket_api.websocket_command(
+    {
+        vol.Required("type"): "mqtt/retained",
+        vol.Optional("prefix", default=""): str,
+        vol.Optional("limit", default=100): vol.All(
+            vol.Coerce(int), vol.Range(min=1, max=10000)
+        ),
+    }
+)
+@callback
+def websocket_retained(hass, connection, msg):
+    """Return the cached retained messages on topics starting with a prefix."""
+    if not connection.user.is_admin:
+        raise Unauthorized
+
+    if DATA_MQTT not in hass.data:
+        connection.send_message(
+            websocket_api.error_message(
+                msg["id"], websocket_api.const.ERR_NOT_FOUND, "MQTT is not set up"
+            )
+        )
+        return
+
+    connection.send_message(
+        websocket_api.result_message(
+            msg["id"], hass.data[DATA_MQTT].retained(msg["prefix"], msg["limit"])
+        )
+    )
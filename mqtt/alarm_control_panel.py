@@ -37,6 +37,7 @@ from . import (
     subscription,
 )
 from .discovery import MQTT_DISCOVERY_NEW, clear_discovery_hash
+from .templates import async_render_message
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -167,9 +168,7 @@ class MqttAlarm(
             """Run when new MQTT message has been received."""
             payload = msg.payload
             if value_template is not None:
-                payload = value_template.async_render_with_possible_json_value(
-                    msg.payload, self._state
-                )
+                payload = async_render_message(value_template, msg, self._state)
             if payload not in (
                 STATE_ALARM_DISARMED,
                 STATE_ALARM_ARMED_HOME,
@@ -38,6 +38,7 @@ from . import (
     subscription,
 )
 from .discovery import MQTT_DISCOVERY_NEW, clear_discovery_hash
+from .templates import async_render_message
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -181,8 +182,8 @@ class MqttBinarySensor(
 
             value_template = self._config.get(CONF_VALUE_TEMPLATE)
             if value_template is not None:
-                payload = value_template.async_render_with_possible_json_value(
-                    payload, variables={"entity_id": self.entity_id}
+                payload = async_render_message(
+                    value_template, msg, variables={"entity_id": self.entity_id}
                 )
             if payload == self._config[CONF_PAYLOAD_ON]:
                 self._state = True
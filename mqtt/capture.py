@@ -0,0 +1,148 @@
+"""Compact capture files of received MQTT messages for replaying them."""
+import struct
+import threading
+import time
+from typing import BinaryIO, Dict, List, Optional
+
+import attr
+
+MAGIC = b"MQTTCAP1"
+
+# A topic record adds the next topic to the dictionary of the file, a
+# message record refers to its topic by the index in the dictionary.
+# Message times are monotonic seconds since the capture started.
+KIND_TOPIC = b"T"
+KIND_MESSAGE = b"M"
+_TOPIC = struct.Struct("<H")
+_MESSAGE = struct.Struct("<dIBI")
+FLAG_RETAIN = 0x04
+QOS_MASK = 0x03
+
+BUFFER_SIZE = 1024 * 1024
+
+
+@attr.s(slots=True, frozen=True)
+class CapturedMessage:
+    """A message read from a capture file."""
+
+    time = attr.ib(type=float)
+    topic = attr.ib(type=str)
+    qos = attr.ib(type=int)
+    retain = attr.ib(type=bool)
+    payload = attr.ib(type=bytes)
+
+
+class CaptureWriter:
+    """Append received messages to a capture file.
+
+    Messages can be written from several paho threads at once. Writes after
+    close are ignored, so a thread still holding the writer can't fail.
+    """
+
+    def __init__(self, path: str) -> None:
+        """Create the capture file."""
+        self._lock = threading.Lock()
+        self._file: Optional[BinaryIO] = open(path, "wb", buffering=BUFFER_SIZE)
+        self._file.write(MAGIC)
+        self._topics: Dict[str, int] = {}
+        self._start = time.monotonic()
+        self.messages = 0
+
+    def write(self, topic: str, qos: int, retain: bool, payload: bytes) -> None:
+        """Append a message."""
+        with self._lock:
+            capture = self._file
+            if capture is None:
+                return
+            index = self._topics.get(topic)
+            if index is None:
+                index = self._topics[topic] = len(self._topics)
+                encoded = topic.encode("utf-8")
+                capture.write(KIND_TOPIC + _TOPIC.pack(len(encoded)) + encoded)
+            capture.write(
+                KIND_MESSAGE
+                + _MESSAGE.pack(
+                    time.monotonic() - self._start,
+                    index,
+                    qos | (FLAG_RETAIN if retain else 0),
+                    len(payload),
+                )
+            )
+            capture.write(payload)
+            self.messages += 1
+
+    def close(self) -> None:
+        """Flush and close the capture file."""
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+class CaptureReader:
+    """Read the messages of a capture file in order.
+
+    A record cut off at the end, as left when stopping while writing it,
+    ends the capture and sets truncated.
+    """
+
+    def __init__(self, path: str) -> None:
+        """Open a capture file."""
+        self._file = open(path, "rb", buffering=BUFFER_SIZE)
+        if self._file.read(len(MAGIC)) != MAGIC:
+            self._file.close()
+            raise ValueError("{} is not a MQTT capture file".format(path))
+        self._topics: List[str] = []
+        self.truncated = False
+
+    def read(self, count: int) -> List[CapturedMessage]:
+        """Return up to count next messages, an empty list at the end."""
+        messages: List[CapturedMessage] = []
+        read = self._read
+        while len(messages) < count and not self.truncated:
+            kind = self._file.read(1)
+            if not kind:
+                break
+            if kind == KIND_TOPIC:
+                data = read(_TOPIC.size)
+                if data is None:
+                    break
+                (length,) = _TOPIC.unpack(data)
+                topic = read(length)
+                if topic is None:
+                    break
+                self._topics.append(topic.decode("utf-8"))
+                continue
+            if kind != KIND_MESSAGE:
+                raise ValueError("Corrupt MQTT capture file")
+            data = read(_MESSAGE.size)
+            if data is None:
+                break
+            timestamp, index, flags, length = _MESSAGE.unpack(data)
+            if index >= len(self._topics):
+                raise ValueError("Corrupt MQTT capture file")
+            payload = read(length)
+            if payload is None:
+                break
+            messages.append(
+                CapturedMessage(
+                    timestamp,
+                    self._topics[index],
+                    flags & QOS_MASK,
+                    bool(flags & FLAG_RETAIN),
+                    payload,
+                )
+            )
+        return messages
+
+    def _read(self, size: int) -> Optional[bytes]:
+        """Return the next size bytes, None if the file ends before."""
+        data = self._file.read(size)
+        if len(data) < size:
+            self.truncated = True
+            return None
+        return data
+
+    def close(self) -> None:
+        """Close the capture file."""
+        self._file.close()
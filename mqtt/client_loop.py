@@ -0,0 +1,98 @@
+"""Drive a paho MQTT client from an asyncio event loop."""
+import asyncio
+import threading
+from typing import Callable, Optional
+
+import paho.mqtt.client as mqtt
+
+CLIENT_LOOP_THREAD = "thread"
+CLIENT_LOOP_ASYNCIO = "asyncio"
+
+MISC_INTERVAL = 1  # seconds
+# Packets read per readable event; paho stops early when the socket is drained.
+MAX_READ_PACKETS = 100
+
+
+class AsyncioClientLoop:
+    """Run paho network I/O on the event loop instead of a paho thread.
+
+    The socket of the client is registered with loop.add_reader and, while
+    paho has outgoing data, loop.add_writer. Keepalive and retries are
+    handled by a task calling loop_misc once per second.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, client: mqtt.Client) -> None:
+        """Attach the loop to the socket callbacks of the client.
+
+        Must be called from the event loop.
+        """
+        self._loop = loop
+        self._loop_thread_id = threading.get_ident()
+        self._client = client
+        self._misc_task: Optional[asyncio.Task] = None
+
+        client.on_socket_open = self._on_socket_open
+        client.on_socket_close = self._on_socket_close
+        client.on_socket_register_write = self._on_socket_register_write
+        client.on_socket_unregister_write = self._on_socket_unregister_write
+
+    def _call_in_loop(self, func: Callable, *args) -> None:
+        """Call func in the event loop.
+
+        Paho may invoke the socket callbacks from an executor thread, for
+        example while connecting, so they only capture the file descriptor
+        and leave the registration to the event loop.
+        """
+        if threading.get_ident() == self._loop_thread_id:
+            func(*args)
+        else:
+            self._loop.call_soon_threadsafe(func, *args)
+
+    def _on_socket_open(self, client, _userdata, sock) -> None:
+        """Start watching a newly opened socket."""
+        self._call_in_loop(self._async_socket_open, sock.fileno())
+
+    def _on_socket_close(self, client, _userdata, sock) -> None:
+        """Stop watching a socket that is about to be closed."""
+        self._call_in_loop(self._async_socket_close, sock.fileno())
+
+    def _on_socket_register_write(self, client, _userdata, sock) -> None:
+        """Watch the socket for writability while paho has data to send."""
+        self._call_in_loop(self._loop.add_writer, sock.fileno(), self._async_write)
+
+    def _on_socket_unregister_write(self, client, _userdata, sock) -> None:
+        """Stop watching the socket for writability."""
+        self._call_in_loop(self._loop.remove_writer, sock.fileno())
+
+    def _async_socket_open(self, fileno: int) -> None:
+        """Register the socket with the event loop."""
+        self._loop.add_reader(fileno, self._async_read)
+        if self._misc_task is None or self._misc_task.done():
+            self._misc_task = self._loop.create_task(self._async_misc())
+
+    def _async_socket_close(self, fileno: int) -> None:
+        """Unregister the socket from the event loop."""
+        self._loop.remove_reader(fileno)
+        self._loop.remove_writer(fileno)
+
+    def _async_read(self) -> None:
+        """Process incoming data."""
+        self._client.loop_read(MAX_READ_PACKETS)
+
+    def _async_write(self) -> None:
+        """Process outgoing data."""
+        self._client.loop_write()
+
+    async def _async_misc(self) -> None:
+        """Handle keepalive pings and message retries."""
+        while self._client.loop_misc() == mqtt.MQTT_ERR_SUCCESS:
+            await asyncio.sleep(MISC_INTERVAL)
+
+    def stop(self) -> None:
+        """Stop the keepalive task.
+
+        Must be called from the event loop.
+        """
+        if self._misc_task is not None:
+            self._misc_task.cancel()
+            self._misc_task = None
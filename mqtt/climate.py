@@ -1,4 +1,5 @@
 """Support for MQTT climate devices."""
+from functools import partial
 import logging
 
 import voluptuous as vol
@@ -59,6 +60,7 @@ from . import (
     subscription,
 )
 from .discovery import MQTT_DISCOVERY_NEW, clear_discovery_hash
+from .templates import async_render_message, async_render_payload
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -354,17 +356,17 @@ class MqttClimate(
 
         value_templates = {}
         for key in TEMPLATE_KEYS:
-            value_templates[key] = lambda value: value
+            value_templates[key] = async_render_payload
         if CONF_VALUE_TEMPLATE in config:
             value_template = config.get(CONF_VALUE_TEMPLATE)
             value_template.hass = self.hass
             value_templates = {
-                key: value_template.async_render_with_possible_json_value
+                key: partial(async_render_message, value_template)
                 for key in TEMPLATE_KEYS
             }
         for key in TEMPLATE_KEYS & config.keys():
             tpl = config[key]
-            value_templates[key] = tpl.async_render_with_possible_json_value
+            value_templates[key] = partial(async_render_message, tpl)
             tpl.hass = self.hass
         self._value_templates = value_templates
 
@@ -383,7 +385,7 @@ class MqttClimate(
 
         def render_template(msg, template_name):
             template = self._value_templates[template_name]
-            return template(msg.payload)
+            return template(msg)
 
         @callback
         def handle_action_received(msg):
@@ -0,0 +1,645 @@
+"""A single broker connection of the Home Assistant MQTT client."""
+import asyncio
+import logging
+import time
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+import attr
+import paho.mqtt.client as mqtt
+
+from homeassistant.core import callback
+from homeassistant.helpers.typing import HomeAssistantType
+
+from .client_loop import CLIENT_LOOP_ASYNCIO, AsyncioClientLoop
+from .const import (
+    CONNECTION_FAILED,
+    CONNECTION_FAILED_RECOVERABLE,
+    CONNECTION_SUCCESS,
+)
+from .models import Message
+from .mqtt5 import (
+    REASON_UNSUPPORTED_PROTOCOL_VERSION,
+    SubscriptionIds,
+    TopicAliases,
+    connect_properties,
+    inflight_messages,
+)
+from .publish_queue import PublishRequest
+from .reconnect import Reconnector
+
+_LOGGER = logging.getLogger(__name__)
+
+MAX_RECONNECT_WAIT = 300  # seconds
+
+# Fall back to MQTT 3.1.1 if a MQTT 5 CONNECT isn't answered in time
+CONNACK_TIMEOUT = 10  # seconds
+
+# Collect (un)subscribe requests for this long and send them together
+SUBSCRIBE_COOLDOWN = 0.1  # seconds
+MAX_TOPICS_PER_SUBSCRIBE = 500
+
+ConnectCallbackType = Callable[["Connection", bool], None]
+
+
+class Connection:
+    """A paho client connected to the broker.
+
+    Keeps the subscriptions of its broker session in line with the filters
+    it is given and reconnects when the connection is lost. Received
+    messages go to on_message with the connection index as userdata.
+    """
+
+    def __init__(
+        self,
+        hass: HomeAssistantType,
+        index: int,
+        broker: str,
+        port: int,
+        keepalive: Optional[int],
+        client_id: Optional[str],
+        clean_session: bool,
+        username: Optional[str],
+        password: Optional[str],
+        certificate: Optional[str],
+        client_key: Optional[str],
+        client_cert: Optional[str],
+        tls_insecure: Optional[bool],
+        tls_version: Optional[int],
+        protocol: int,
+        will_message: Optional[Message],
+        client_loop: str,
+        reconnect_first_delay: float,
+        receive_maximum: Optional[int],
+        subscription_ids: SubscriptionIds,
+        on_message: Callable,
+        on_connect: ConnectCallbackType,
+    ) -> None:
+        """Initialize the connection."""
+        self.hass = hass
+        self.index = index
+        self.broker = broker
+        self.port = port
+        self.keepalive = keepalive
+        self.connected = False
+        self.last_resubscribe_duration: Optional[float] = None
+        self._client_id = client_id
+        self._clean_session = clean_session
+        self._username = username
+        self._password = password
+        self._certificate = certificate
+        self._client_key = client_key
+        self._client_cert = client_cert
+        self._tls_insecure = tls_insecure
+        self._tls_version = tls_version
+        self._will_message = will_message
+        self._client_loop = client_loop
+        self._receive_maximum = receive_maximum
+        self._subscription_ids = subscription_ids
+        self._on_message = on_message
+        self._on_connect = on_connect
+
+        self._pending_subscriptions: Dict[str, int] = {}
+        self._pending_unsubscribes: Set[str] = set()
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._pending_subacks: Set[int] = set()
+        # Acks handled before the call sending their SUBSCRIBE returned
+        self._early_subacks: Set[int] = set()
+        self._subscribing = 0
+        # Filters the broker session is subscribed to, with their QoS
+        self._broker_filters: Dict[str, int] = {}
+        self._connected_at: Optional[float] = None
+        self._mqttc: mqtt.Client = None
+        self._paho_lock = asyncio.Lock()
+        self._asyncio_loop: Optional[AsyncioClientLoop] = None
+        self._reconnector = Reconnector(
+            hass.loop, self._async_reconnect, reconnect_first_delay, MAX_RECONNECT_WAIT
+        )
+        self._use_subscription_ids = False
+        self._topic_aliases = TopicAliases()
+        # Whether the broker answered a MQTT 5 CONNECT
+        self._protocol_confirmed = False
+        self._connack_timeout: Optional[asyncio.TimerHandle] = None
+
+        self._setup_client(protocol)
+
+    def _setup_client(self, protocol: int) -> None:
+        """Create the paho client for a protocol version."""
+        self._protocol = protocol
+        if protocol == mqtt.MQTTv5:
+            # Sessions are set up with the properties of the CONNECT packet
+            self._mqttc = mqtt.Client(
+                self._client_id or "", userdata=self.index, protocol=protocol
+            )
+        elif self._client_id is None:
+            self._mqttc = mqtt.Client(userdata=self.index, protocol=protocol)
+        else:
+            self._mqttc = mqtt.Client(
+                self._client_id,
+                clean_session=self._clean_session,
+                userdata=self.index,
+                protocol=protocol,
+            )
+
+        # Log errors raised by our callbacks instead of stopping the network loop
+        self._mqttc.suppress_exceptions = True
+
+        if self._username is not None:
+            self._mqttc.username_pw_set(self._username, self._password)
+
+        if self._certificate is not None:
+            self._mqttc.tls_set(
+                self._certificate,
+                certfile=self._client_cert,
+                keyfile=self._client_key,
+                tls_version=self._tls_version,
+            )
+
+            if self._tls_insecure is not None:
+                self._mqttc.tls_insecure_set(self._tls_insecure)
+
+        self._mqttc.on_connect = self._mqtt_on_connect
+        self._mqttc.on_disconnect = self._mqtt_on_disconnect
+        self._mqttc.on_message = self._on_message
+        self._mqttc.on_subscribe = self._mqtt_on_subscribe
+
+        if self._will_message is not None:
+            self._mqttc.will_set(  # pylint: disable=no-value-for-parameter
+                *attr.astuple(self._will_message)
+            )
+
+        if self._client_loop == CLIENT_LOOP_ASYNCIO:
+            self._asyncio_loop = AsyncioClientLoop(self.hass.loop, self._mqttc)
+
+    async def async_publish_batch(self, batch: List[PublishRequest]) -> None:
+        """Hand a batch of queued messages to paho."""
+        await self._async_call_paho(self._publish_batch, batch)
+
+    def _publish_batch(self, batch: List[PublishRequest]) -> None:
+        """Publish a batch of messages with paho."""
+        aliases = self._topic_aliases
+        for request in batch:
+            topic, properties = request.topic, None
+            # Paho resends QoS 1 and 2 messages after reconnecting, when their
+            # alias is gone, so only QoS 0 messages use topic aliases.
+            if request.qos == 0 and aliases.maximum:
+                topic, properties = aliases.get(topic)
+            self._mqttc.publish(
+                topic, request.payload, request.qos, request.retain, properties
+            )
+
+    async def _async_call_paho(self, func: Callable, *args) -> Any:
+        """Call a paho client method.
+
+        With the asyncio client loop paho never blocks, so the method is called
+        directly. Otherwise it runs in the executor, one call at a time.
+        """
+        if self._asyncio_loop is not None:
+            return func(*args)
+
+        async with self._paho_lock:
+            return await self.hass.async_add_job(func, *args)
+
+    async def async_connect(self) -> str:
+        """Connect to the host. Does process messages yet.
+
+        This method is a coroutine.
+        """
+        result: int = None
+        try:
+            result = await self.hass.async_add_job(self._connect)
+        except OSError as err:
+            _LOGGER.error("Failed to connect due to exception: %s", err)
+            return CONNECTION_FAILED_RECOVERABLE
+
+        if result != 0:
+            _LOGGER.error("Failed to connect: %s", mqtt.error_string(result))
+            return CONNECTION_FAILED
+
+        if self._asyncio_loop is None:
+            self._mqttc.loop_start()
+        self._async_expect_connack()
+        return CONNECTION_SUCCESS
+
+    def _connect(self) -> int:
+        """Connect paho to the broker."""
+        if self._protocol != mqtt.MQTTv5:
+            return self._mqttc.connect(self.broker, self.port, self.keepalive)
+        return self._mqttc.connect(
+            self.broker,
+            self.port,
+            self.keepalive,
+            clean_start=self._clean_session,
+            properties=connect_properties(self._clean_session, self._receive_maximum),
+        )
+
+    @callback
+    def _async_expect_connack(self) -> None:
+        """Fall back to MQTT 3.1.1 if the broker doesn't answer MQTT 5 in time.
+
+        Brokers that only speak MQTT 3.1.1 may ignore the CONNECT or answer
+        with a CONNACK paho can't parse.
+        """
+        if self._protocol != mqtt.MQTTv5 or self._protocol_confirmed:
+            return
+        self._async_cancel_connack_timeout()
+        self._connack_timeout = self.hass.loop.call_later(
+            CONNACK_TIMEOUT,
+            lambda: self.hass.async_create_task(self._async_fall_back()),
+        )
+
+    @callback
+    def _async_cancel_connack_timeout(self) -> None:
+        """Stop waiting for the CONNACK."""
+        if self._connack_timeout is not None:
+            self._connack_timeout.cancel()
+            self._connack_timeout = None
+
+    @callback
+    def _async_handle_connack(self) -> None:
+        """Remember that the broker speaks the protocol we connected with."""
+        self._async_cancel_connack_timeout()
+        self._protocol_confirmed = True
+
+    async def _async_fall_back(self) -> None:
+        """Replace the MQTT 5 client with a MQTT 3.1.1 one and connect.
+
+        This method is a coroutine.
+        """
+        if self._protocol != mqtt.MQTTv5 or self._protocol_confirmed:
+            return
+        _LOGGER.warning(
+            "MQTT broker %s doesn't support MQTT 5, falling back to MQTT 3.1.1",
+            self.broker,
+        )
+        self._async_cancel_connack_timeout()
+        self._topic_aliases.reset(0)
+        self._use_subscription_ids = False
+
+        client = self._mqttc
+        client.on_connect = None
+        client.on_disconnect = None
+        client.on_message = None
+        client.on_subscribe = None
+        if self._asyncio_loop is not None:
+            self._asyncio_loop.stop()
+            client.disconnect()
+        else:
+
+            def stop():
+                """Stop the MQTT 5 client."""
+                client.disconnect()
+                client.loop_stop()
+
+            await self.hass.async_add_executor_job(stop)
+
+        self._setup_client(mqtt.MQTTv311)
+        if await self.async_connect() != CONNECTION_SUCCESS:
+            self._reconnector.async_disconnected()
+
+    async def async_disconnect(self) -> None:
+        """Stop the connection.
+
+        This method is a coroutine.
+        """
+        self._reconnector.async_stop()
+        self._async_cancel_connack_timeout()
+
+        if self._asyncio_loop is not None:
+            self._mqttc.disconnect()
+            self._asyncio_loop.stop()
+            return
+
+        def stop():
+            """Stop the MQTT client."""
+            self._mqttc.disconnect()
+            self._mqttc.loop_stop()
+
+        await self.hass.async_add_job(stop)
+
+    @property
+    def broker_filters(self) -> Dict[str, int]:
+        """Return the filters the broker session is subscribed to."""
+        return self._broker_filters
+
+    @callback
+    def async_restore_session(self, filters: Dict[str, int]) -> None:
+        """Take over the filters of the session saved before a restart.
+
+        The broker only keeps them if it reports the session as present.
+        """
+        self._broker_filters = dict(filters)
+
+    @callback
+    def async_queue_subscription(self, topic: str, qos: int) -> bool:
+        """Queue a broker subscription to be sent with the next flush.
+
+        Return False if the broker session already holds the subscription,
+        as after resuming a session saved before a restart.
+        """
+        if (
+            topic not in self._pending_unsubscribes
+            and self._broker_filters.get(topic, -1) >= qos
+        ):
+            return False
+        self._pending_unsubscribes.discard(topic)
+        self._pending_subscriptions[topic] = max(
+            qos, self._pending_subscriptions.get(topic, 0)
+        )
+        self._async_schedule_flush()
+        return True
+
+    @callback
+    def async_queue_unsubscribe(self, topic: str) -> None:
+        """Queue a broker unsubscribe to be sent with the next flush."""
+        self._pending_subscriptions.pop(topic, None)
+        self._pending_unsubscribes.add(topic)
+        self._async_schedule_flush()
+
+    @callback
+    def _async_schedule_flush(self) -> None:
+        """Flush queued (un)subscribes once the collection window has passed."""
+        if self._flush_handle is None:
+            self._flush_handle = self.hass.loop.call_later(
+                SUBSCRIBE_COOLDOWN, self._async_start_flush
+            )
+
+    @callback
+    def _async_start_flush(self) -> None:
+        """Start flushing queued (un)subscribes right away."""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        self.hass.async_create_task(self._async_flush_subscriptions())
+
+    async def _async_flush_subscriptions(self) -> None:
+        """Send queued (un)subscribes using multi-topic packets.
+
+        This method is a coroutine.
+        """
+        unsubscribes = list(self._pending_unsubscribes)
+        self._pending_unsubscribes.clear()
+        subscriptions = list(self._pending_subscriptions.items())
+        self._pending_subscriptions.clear()
+
+        # Everything is resubscribed from the filter registry on connect.
+        if not self.connected:
+            return
+
+        for chunk in _chunked(unsubscribes, MAX_TOPICS_PER_SUBSCRIBE):
+            _LOGGER.debug("Unsubscribing from %s", chunk)
+            # Forget them first, a subscription made while waiting for paho
+            # must not be taken for one the broker still holds.
+            for topic in chunk:
+                self._broker_filters.pop(topic, None)
+            result, _ = await self._async_call_paho(self._mqttc.unsubscribe, chunk)
+            _log_on_error(result)
+
+        self._subscribing += 1
+        try:
+            for chunk in _chunked(subscriptions, MAX_TOPICS_PER_SUBSCRIBE):
+                _LOGGER.debug("Subscribing to %s", chunk)
+                for topics, result, mid in await self._async_call_paho(
+                    self._subscribe, chunk
+                ):
+                    if _log_on_error(result):
+                        if mid in self._early_subacks:
+                            self._early_subacks.discard(mid)
+                        else:
+                            self._pending_subacks.add(mid)
+                        self._broker_filters.update(topics)
+        finally:
+            self._subscribing -= 1
+        self._async_check_resubscribed()
+
+    def _subscribe(
+        self, chunk: List[Tuple[str, int]]
+    ) -> List[Tuple[List[Tuple[str, int]], int, int]]:
+        """Subscribe with paho, return topics, result and mid of each packet.
+
+        A subscription identifier applies to all topics of a SUBSCRIBE
+        packet, so with identifiers every topic is sent in its own packet.
+        """
+        if not self._use_subscription_ids:
+            return [(chunk, *self._mqttc.subscribe(chunk))]
+        return [
+            (
+                [(topic, qos)],
+                *self._mqttc.subscribe(
+                    topic, qos, properties=self._subscription_ids.properties(topic)
+                ),
+            )
+            for topic, qos in chunk
+        ]
+
+    def _mqtt_on_subscribe(
+        self, _mqttc, _userdata, mid: int, _granted_qos, _properties=None
+    ) -> None:
+        """Subscribe acknowledged callback."""
+        self.hass.add_job(self._async_handle_suback, mid)
+
+    @callback
+    def _async_handle_suback(self, mid: int) -> None:
+        """Track when all subscriptions sent after connecting are acknowledged.
+
+        In the executor paho can handle the ack before the call sending the
+        SUBSCRIBE returned its mid, the flush then takes it from the early acks.
+        """
+        if mid in self._pending_subacks:
+            self._pending_subacks.discard(mid)
+        else:
+            self._early_subacks.add(mid)
+        self._async_check_resubscribed()
+
+    @callback
+    def _async_check_resubscribed(self) -> None:
+        """Report the resubscribe duration once all subscriptions are acked."""
+        if self._subscribing or self._pending_subacks or self._connected_at is None:
+            return
+
+        self.last_resubscribe_duration = time.monotonic() - self._connected_at
+        self._connected_at = None
+        _LOGGER.info(
+            "Subscribed to %d topics %.3f s after connecting",
+            len(self._broker_filters),
+            self.last_resubscribe_duration,
+        )
+
+    @callback
+    def async_resubscribe(
+        self, filters: Dict[str, int], session_present: bool, unsubscribe: bool = True
+    ) -> None:
+        """Bring the broker subscriptions in line with the filters after connecting.
+
+        A clean session starts without subscriptions. A resumed persistent
+        session still has the ones sent before, so only changes made while
+        disconnected are sent and the broker doesn't replay retained messages.
+        Without unsubscribe, filters of the session not in filters are kept,
+        as while starting not all subscriptions are made yet.
+        """
+        if not session_present:
+            self._broker_filters.clear()
+
+        self._connected_at = time.monotonic()
+        self._pending_subacks.clear()
+        self._early_subacks.clear()
+        self._pending_subscriptions = {
+            topic: qos
+            for topic, qos in filters.items()
+            if self._broker_filters.get(topic, -1) < qos
+        }
+        self._pending_unsubscribes = set()
+        if unsubscribe:
+            self._pending_unsubscribes = {
+                topic for topic in self._broker_filters if topic not in filters
+            }
+
+        if session_present:
+            _LOGGER.info(
+                "Resumed MQTT session, subscribing to %d and unsubscribing from %d "
+                "of %d topics",
+                len(self._pending_subscriptions),
+                len(self._pending_unsubscribes),
+                len(filters),
+            )
+
+        if self._pending_subscriptions or self._pending_unsubscribes:
+            self._async_start_flush()
+        if not self._pending_subscriptions:
+            self._connected_at = None
+
+    @callback
+    def async_unsubscribe_unknown(self, filters: Dict[str, int]) -> None:
+        """Unsubscribe from the filters of the session not in filters."""
+        for topic in list(self._broker_filters):
+            if topic not in filters and topic not in self._pending_subscriptions:
+                self.async_queue_unsubscribe(topic)
+
+    def _mqtt_on_connect(
+        self, _mqttc, _userdata, flags, result_code, properties=None
+    ) -> None:
+        """On connect callback.
+
+        With MQTT 5 the result code is a reason code and the properties of the
+        CONNACK are passed.
+        """
+        if properties is not None:
+            if result_code == REASON_UNSUPPORTED_PROTOCOL_VERSION:
+                self.hass.add_job(self._async_fall_back)
+                return
+            self.hass.add_job(self._async_handle_connack)
+
+        if result_code != mqtt.CONNACK_ACCEPTED:
+            _LOGGER.error(
+                "Unable to connect to the MQTT broker: %s",
+                mqtt.connack_string(result_code) if properties is None else result_code,
+            )
+            self._mqttc.disconnect()
+            return
+
+        subscription_ids = False
+        if properties is not None:
+            # Set up flow control before the first publish on this connection
+            self._mqttc.max_inflight_messages_set(inflight_messages(properties))
+            self._topic_aliases.reset(getattr(properties, "TopicAliasMaximum", 0))
+            subscription_ids = getattr(properties, "SubscriptionIdentifierAvailable", 1)
+
+        self.hass.add_job(
+            self._async_handle_connect,
+            bool(flags.get("session present")),
+            bool(subscription_ids),
+        )
+
+    @callback
+    def _async_handle_connect(
+        self, session_present: bool, subscription_ids: bool
+    ) -> None:
+        """Mark the connection as established and notify the client."""
+        self.connected = True
+        self._use_subscription_ids = subscription_ids
+
+        reconnect_duration = self._reconnector.async_connected()
+        if reconnect_duration is not None:
+            _LOGGER.info(
+                "Reconnected to the MQTT broker %.3f s after disconnecting",
+                reconnect_duration,
+            )
+
+        self._on_connect(self, session_present)
+
+    def _mqtt_on_disconnect(
+        self, _mqttc, _userdata, result_code, _properties=None
+    ) -> None:
+        """Disconnected callback."""
+        # Topic aliases only live as long as the connection
+        self._topic_aliases.reset(0)
+        if self._asyncio_loop is None:
+            # Called in the paho thread, this only makes it exit instead of
+            # reconnecting with its own backoff, the Reconnector retries.
+            self._mqttc.loop_stop()
+        self.hass.add_job(self._async_handle_disconnect, result_code)
+
+    @callback
+    def _async_handle_disconnect(self, result_code: int) -> None:
+        """Start reconnecting unless disconnected on purpose."""
+        self.connected = False
+
+        # When disconnected because of calling disconnect()
+        if result_code == 0:
+            return
+
+        if self._protocol == mqtt.MQTTv5 and not self._protocol_confirmed:
+            # Closed by a broker that doesn't understand MQTT 5
+            self.hass.async_create_task(self._async_fall_back())
+            return
+
+        _LOGGER.warning("Disconnected from MQTT (%s)", result_code)
+        self._reconnector.async_disconnected()
+
+    async def _async_reconnect(self) -> bool:
+        """Make one attempt to reconnect, return True if the socket connected.
+
+        In threaded mode the paho thread exits when disconnected, so only the
+        event loop decides when to retry. It is joined before reconnecting.
+
+        This method is a coroutine.
+        """
+        if self._asyncio_loop is None:
+            await self.hass.async_add_executor_job(self._mqttc.loop_stop)
+
+        try:
+            result = await self.hass.async_add_executor_job(self._mqttc.reconnect)
+        except OSError as err:
+            _LOGGER.debug("Failed to reconnect to MQTT: %s", err)
+            return False
+
+        if result != 0:
+            _LOGGER.debug("Failed to reconnect to MQTT: %s", mqtt.error_string(result))
+            return False
+
+        if self._asyncio_loop is None:
+            self._mqttc.loop_start()
+        self._async_expect_connack()
+        return True
+
+    @callback
+    def async_retry_now(self) -> None:
+        """Retry connecting right away, for example when the network is back."""
+        self._reconnector.async_retry_now()
+
+    @property
+    def last_reconnect_duration(self) -> Optional[float]:
+        """Return the seconds it took to reconnect after the last disconnect."""
+        return self._reconnector.last_reconnect_duration
+
+
+def _log_on_error(result_code: int) -> bool:
+    """Log error if error result, return True on success."""
+    if result_code != 0:
+        _LOGGER.error("Error talking to MQTT: %s", mqtt.error_string(result_code))
+        return False
+    return True
+
+
+def _chunked(items: List[Any], size: int) -> List[List[Any]]:
+    """Split a list into chunks of at most size items."""
+    return [items[index : index + size] for index in range(0, len(items), size)]
@@ -1,4 +1,5 @@
 """Constants used by multiple MQTT modules."""
+
 CONF_BROKER = "broker"
 CONF_DISCOVERY = "discovery"
 DEFAULT_DISCOVERY = False
@@ -6,4 +7,9 @@ DEFAULT_DISCOVERY = False
 ATTR_DISCOVERY_HASH = "discovery_hash"
 CONF_STATE_TOPIC = "state_topic"
 PROTOCOL_311 = "3.1.1"
+PROTOCOL_5 = "5"
 DEFAULT_QOS = 0
+
+CONNECTION_SUCCESS = "connection_success"
+CONNECTION_FAILED = "connection_failed"
+CONNECTION_FAILED_RECOVERABLE = "connection_failed_recoverable"
@@ -48,6 +48,7 @@ from . import (
     subscription,
 )
 from .discovery import MQTT_DISCOVERY_NEW, clear_discovery_hash
+from .templates import async_render_message
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -267,9 +268,7 @@ class MqttCover(
             """Handle tilt updates."""
             payload = msg.payload
             if tilt_status_template is not None:
-                payload = tilt_status_template.async_render_with_possible_json_value(
-                    payload
-                )
+                payload = async_render_message(tilt_status_template, msg)
 
             if payload.isnumeric() and (
                 self._config[CONF_TILT_MIN]
@@ -286,7 +285,7 @@ class MqttCover(
             """Handle new MQTT state messages."""
             payload = msg.payload
             if template is not None:
-                payload = template.async_render_with_possible_json_value(payload)
+                payload = async_render_message(template, msg)
 
             if payload == self._config[CONF_STATE_OPEN]:
                 self._state = False
@@ -302,7 +301,7 @@ class MqttCover(
             """Handle new MQTT state messages."""
             payload = msg.payload
             if template is not None:
-                payload = template.async_render_with_possible_json_value(payload)
+                payload = async_render_message(template, msg)
 
             if payload.isnumeric():
                 percentage_payload = self.find_percentage_in_range(
@@ -1,4 +1,5 @@
 """Support for MQTT fans."""
+from functools import partial
 import logging
 
 import voluptuous as vol
@@ -40,6 +41,7 @@ from . import (
     MqttEntityDeviceInfo,
     subscription,
 )
+from .templates import async_render_message, async_render_payload
 from .discovery import MQTT_DISCOVERY_NEW, clear_discovery_hash
 
 _LOGGER = logging.getLogger(__name__)
@@ -244,15 +246,15 @@ class MqttFan(
         templates = {}
         for key, tpl in list(self._templates.items()):
             if tpl is None:
-                templates[key] = lambda value: value
+                templates[key] = async_render_payload
             else:
                 tpl.hass = self.hass
-                templates[key] = tpl.async_render_with_possible_json_value
+                templates[key] = partial(async_render_message, tpl)
 
         @callback
         def state_received(msg):
             """Handle new received MQTT message."""
-            payload = templates[CONF_STATE](msg.payload)
+            payload = templates[CONF_STATE](msg)
             if payload == self._payload["STATE_ON"]:
                 self._state = True
             elif payload == self._payload["STATE_OFF"]:
@@ -269,7 +271,7 @@ class MqttFan(
         @callback
         def speed_received(msg):
             """Handle new received MQTT message for the speed."""
-            payload = templates[ATTR_SPEED](msg.payload)
+            payload = templates[ATTR_SPEED](msg)
             if payload == self._payload["SPEED_LOW"]:
                 self._speed = SPEED_LOW
             elif payload == self._payload["SPEED_MEDIUM"]:
@@ -291,7 +293,7 @@ class MqttFan(
         @callback
         def oscillation_received(msg):
             """Handle new received MQTT message for the oscillation."""
-            payload = templates[OSCILLATION](msg.payload)
+            payload = templates[OSCILLATION](msg)
             if payload == self._payload["OSCILLATE_ON_PAYLOAD"]:
                 self._oscillation = True
             elif payload == self._payload["OSCILLATE_OFF_PAYLOAD"]:
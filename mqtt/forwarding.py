@@ -0,0 +1,140 @@
+"""Forward MQTT messages to a websocket connection in batches."""
+import asyncio
+from base64 import b64encode
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from .models import Message
+
+BINARY_BASE64 = "base64"
+BINARY_SKIP = "skip"
+BINARY_MODES = (BINARY_BASE64, BINARY_SKIP)
+
+# Send a batch early when it gets this long
+MAX_BATCH_SIZE = 1000
+
+
+class MessageForwarder:
+    """Turn received messages into websocket events.
+
+    Without a batch interval every message is sent as its own event, like
+    before. With a batch interval the messages are collected and sent as
+    one event with a list of them, and with latest only the last message on
+    each topic in a batch is sent.
+
+    Messages beyond max_rate per second are dropped, payloads larger than
+    max_payload_size are replaced by their size, and binary payloads are
+    sent base64 encoded or skipped. Batch events report how many messages
+    were dropped since the last one.
+    """
+
+    def __init__(
+        self,
+        loop: asyncio.AbstractEventLoop,
+        send: Callable[[Dict[str, Any]], None],
+        batch_interval: Optional[float] = None,
+        latest: bool = False,
+        max_rate: Optional[float] = None,
+        max_payload_size: Optional[int] = None,
+        binary: str = BINARY_SKIP,
+    ) -> None:
+        """Initialize the forwarder."""
+        self._loop = loop
+        self._send = send
+        self._batch_interval = batch_interval
+        self._latest = latest
+        self._max_rate = max_rate
+        # Allow bursts of up to one second of messages, and at least one
+        # message for rates below one per second
+        self._burst = max(1.0, max_rate or 0.0)
+        self._max_payload_size = max_payload_size
+        self._binary = binary
+        self._tokens = self._burst
+        self._refilled = time.monotonic()
+        self._batch: Dict[Any, Dict[str, Any]] = {}
+        self._sequence = 0
+        self._dropped = 0
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    def async_forward(self, msg: Message) -> None:
+        """Forward a message with a bytes payload."""
+        if self._max_rate is not None and not self._take_token():
+            self._dropped += 1
+            return
+
+        entry = self._entry(msg)
+        if entry is None:
+            self._dropped += 1
+            return
+
+        if self._batch_interval is None:
+            self._send(entry)
+            return
+
+        if self._latest:
+            key: Any = msg.topic
+            if key in self._batch:
+                self._dropped += 1
+        else:
+            key = self._sequence
+            self._sequence += 1
+        self._batch[key] = entry
+
+        if len(self._batch) >= MAX_BATCH_SIZE:
+            self.async_flush()
+        elif self._timer is None:
+            self._timer = self._loop.call_later(self._batch_interval, self.async_flush)
+
+    def async_flush(self) -> None:
+        """Send the collected messages as one event."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._batch:
+            return
+        messages: List[Dict[str, Any]] = list(self._batch.values())
+        self._batch.clear()
+        dropped = self._dropped
+        self._dropped = 0
+        self._send({"messages": messages, "dropped": dropped})
+
+    def async_cancel(self) -> None:
+        """Stop forwarding, discarding collected messages."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        self._batch.clear()
+
+    def _take_token(self) -> bool:
+        """Return if the rate limit allows another message."""
+        now = time.monotonic()
+        max_rate = self._max_rate or 0.0
+        self._tokens = min(
+            self._burst, self._tokens + (now - self._refilled) * max_rate
+        )
+        self._refilled = now
+        if self._tokens < 1:
+            return False
+        self._tokens -= 1
+        return True
+
+    def _entry(self, msg: Message) -> Optional[Dict[str, Any]]:
+        """Return the event data of a message, None to skip it."""
+        entry: Dict[str, Any] = {
+            "topic": msg.topic,
+            "qos": msg.qos,
+            "retain": msg.retain,
+        }
+        payload = msg.payload
+        if self._max_payload_size is not None and len(payload) > self._max_payload_size:
+            entry["payload"] = None
+            entry["size"] = len(payload)
+            return entry
+        try:
+            entry["payload"] = payload.decode("utf-8")
+        except UnicodeDecodeError:
+            if self._binary == BINARY_SKIP:
+                return None
+            entry["payload"] = b64encode(payload).decode("ascii")
+            entry["encoding"] = BINARY_BASE64
+        return entry
@@ -0,0 +1,190 @@
+"""Priorities and policies for dropping redundant received messages."""
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import attr
+
+from .matcher import TopicMatcher
+
+DROPPED_DUPLICATE = "duplicate"
+DROPPED_THROTTLED = "throttled"
+DROPPED_SAMPLED = "sampled"
+DROPPED_COALESCED = "coalesced"
+
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+PRIORITIES = (PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW)
+
+# Availability, Tasmota LWT and command results go first, telemetry last
+DEFAULT_HIGH_PRIORITY_TOPICS = [
+    "+/availability",
+    "+/+/availability",
+    "+/+/+/availability",
+    "tele/+/LWT",
+    "stat/#",
+]
+DEFAULT_LOW_PRIORITY_TOPICS = ["tele/#"]
+
+# Limit the number of topics with state, messages on further topics are
+# dispatched without applying a policy.
+MAX_TOPICS = 10000
+
+
+@attr.s(slots=True, frozen=True)
+class IngestPolicy:
+    """How to thin out the messages on topics matching a filter."""
+
+    topic_filter = attr.ib(type=str)
+    drop_duplicates = attr.ib(type=bool, default=False)
+    min_interval = attr.ib(type=float, default=0.0)
+    every_nth = attr.ib(type=int, default=1)
+
+
+class _TopicState:
+    """What a policy remembers about a topic."""
+
+    __slots__ = ("policy", "payload", "count", "last_time", "pending")
+
+    def __init__(self, policy: Optional[IngestPolicy]) -> None:
+        """Initialize the state of a topic without messages."""
+        self.policy = policy
+        self.payload: Optional[bytes] = None
+        self.count = 0
+        self.last_time: Optional[float] = None
+        self.pending: Any = None
+
+
+class IngestPolicies:
+    """Decide which received messages are dispatched to the subscriptions.
+
+    With drop_duplicates a payload identical to the last one accepted on the
+    topic is dropped. With every_nth only every nth of the other messages is
+    accepted. With min_interval an accepted message arriving sooner than
+    min_interval after the last dispatched one is held back and replaced by
+    later ones, so the latest is dispatched when the interval is over.
+
+    The first policy in configuration order matching a topic applies.
+    Retained messages are always dispatched, new subscribers rely on them.
+    """
+
+    def __init__(self, policies: Sequence[IngestPolicy]) -> None:
+        """Initialize the policies."""
+        self._matcher = TopicMatcher()
+        for index, policy in enumerate(policies):
+            self._matcher.add(policy.topic_filter, (index, policy))
+        self._topics: Dict[str, _TopicState] = {}
+        self.dropped = {
+            DROPPED_DUPLICATE: 0,
+            DROPPED_THROTTLED: 0,
+            DROPPED_SAMPLED: 0,
+        }
+
+    def check(
+        self, topic: str, payload: bytes, retain: bool, pending: Any, now: float
+    ) -> Optional[float]:
+        """Apply the policy of a topic to a received message.
+
+        Returns 0 to dispatch the message now, None if it is dropped or
+        replaces a held back message, or the delay after which the held
+        back pending object should be taken with pop_pending.
+        """
+        if retain:
+            return 0.0
+        state = self._topics.get(topic)
+        if state is None:
+            if len(self._topics) >= MAX_TOPICS:
+                return 0.0
+            matches = self._matcher.match(topic)
+            state = self._topics[topic] = _TopicState(
+                min(matches, key=_policy_index)[1] if matches else None
+            )
+        policy = state.policy
+        if policy is None:
+            return 0.0
+
+        if policy.drop_duplicates:
+            if payload == state.payload:
+                self.dropped[DROPPED_DUPLICATE] += 1
+                return None
+            state.payload = payload
+
+        if policy.every_nth > 1:
+            count = state.count
+            state.count = (count + 1) % policy.every_nth
+            if count:
+                self.dropped[DROPPED_SAMPLED] += 1
+                return None
+
+        if policy.min_interval:
+            if state.pending is not None:
+                self.dropped[DROPPED_THROTTLED] += 1
+                state.pending = pending
+                return None
+            if state.last_time is not None:
+                delay = state.last_time + policy.min_interval - now
+                if delay > 0:
+                    state.pending = pending
+                    return delay
+            state.last_time = now
+
+        return 0.0
+
+    def pop_pending(self, topic: str, now: float) -> Any:
+        """Return the held back message of a topic, which is dispatched now."""
+        state = self._topics[topic]
+        pending = state.pending
+        state.pending = None
+        state.last_time = now
+        return pending
+
+
+class InboundPriorities:
+    """Classify received messages by the priority of their topic.
+
+    Messages on topics matching a high priority filter are high priority,
+    else on topics matching a low priority filter low priority, and else
+    normal priority. Topics are classified in the paho thread, so the
+    classes of recent topics are cached.
+    """
+
+    def __init__(self, high: Sequence[str], low: Sequence[str]) -> None:
+        """Initialize the priorities."""
+        self._high = TopicMatcher()
+        for topic_filter in high:
+            self._high.add(topic_filter, topic_filter)
+        self._low = TopicMatcher()
+        for topic_filter in low:
+            self._low.add(topic_filter, topic_filter)
+        self._cache: Dict[str, int] = {}
+
+    def priority(self, topic: str) -> int:
+        """Return the priority of a topic."""
+        priority = self._cache.get(topic)
+        if priority is not None:
+            return priority
+        if self._high.match(topic):
+            priority = PRIORITY_HIGH
+        elif self._low.match(topic):
+            priority = PRIORITY_LOW
+        else:
+            priority = PRIORITY_NORMAL
+        if len(self._cache) < MAX_TOPICS:
+            self._cache[topic] = priority
+        return priority
+
+
+def coalesce(messages: Sequence[Tuple[int, Any]]) -> List[Tuple[int, Any]]:
+    """Keep the latest of the messages on each topic of each connection.
+
+    Takes and returns pairs of the connection index and the message, in
+    the order the topics first appear.
+    """
+    latest: Dict[Tuple[int, str], Tuple[int, Any]] = {}
+    for shard, msg in messages:
+        latest[(shard, msg.topic)] = (shard, msg)
+    return list(latest.values())
+
+
+def _policy_index(match: Tuple[int, IngestPolicy]) -> int:
+    """Return the configuration order of a matching policy."""
+    return match[0]
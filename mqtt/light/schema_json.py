@@ -242,7 +242,7 @@ class MqttLightJson(
         @callback
         def state_received(msg):
             """Handle new MQTT messages."""
-            values = json.loads(msg.payload)
+            values = msg.payload_json()
 
             if values["state"] == "ON":
                 self._state = True
@@ -49,6 +49,7 @@ import homeassistant.helpers.config_validation as cv
 import homeassistant.util.color as color_util
 from homeassistant.helpers.restore_state import RestoreEntity
 
+from ..templates import async_render_message
 from .schema import MQTT_LIGHT_SCHEMA_SCHEMA
 
 _LOGGER = logging.getLogger(__name__)
@@ -222,9 +223,7 @@ class MqttTemplate(
         @callback
         def state_received(msg):
             """Handle new MQTT messages."""
-            state = self._templates[
-                CONF_STATE_TEMPLATE
-            ].async_render_with_possible_json_value(msg.payload)
+            state = async_render_message(self._templates[CONF_STATE_TEMPLATE], msg)
             if state == STATE_ON:
                 self._state = True
             elif state == STATE_OFF:
@@ -235,9 +234,9 @@ class MqttTemplate(
             if self._brightness is not None:
                 try:
                     self._brightness = int(
-                        self._templates[
-                            CONF_BRIGHTNESS_TEMPLATE
-                        ].async_render_with_possible_json_value(msg.payload)
+                        async_render_message(
+                            self._templates[CONF_BRIGHTNESS_TEMPLATE], msg
+                        )
                     )
                 except ValueError:
                     _LOGGER.warning("Invalid brightness value received")
@@ -245,9 +244,9 @@ class MqttTemplate(
             if self._color_temp is not None:
                 try:
                     self._color_temp = int(
-                        self._templates[
-                            CONF_COLOR_TEMP_TEMPLATE
-                        ].async_render_with_possible_json_value(msg.payload)
+                        async_render_message(
+                            self._templates[CONF_COLOR_TEMP_TEMPLATE], msg
+                        )
                     )
                 except ValueError:
                     _LOGGER.warning("Invalid color temperature value received")
@@ -255,19 +254,13 @@ class MqttTemplate(
             if self._hs is not None:
                 try:
                     red = int(
-                        self._templates[
-                            CONF_RED_TEMPLATE
-                        ].async_render_with_possible_json_value(msg.payload)
+                        async_render_message(self._templates[CONF_RED_TEMPLATE], msg)
                     )
                     green = int(
-                        self._templates[
-                            CONF_GREEN_TEMPLATE
-                        ].async_render_with_possible_json_value(msg.payload)
+                        async_render_message(self._templates[CONF_GREEN_TEMPLATE], msg)
                     )
                     blue = int(
-                        self._templates[
-                            CONF_BLUE_TEMPLATE
-                        ].async_render_with_possible_json_value(msg.payload)
+                        async_render_message(self._templates[CONF_BLUE_TEMPLATE], msg)
                     )
                     self._hs = color_util.color_RGB_to_hs(red, green, blue)
                 except ValueError:
@@ -276,17 +269,17 @@ class MqttTemplate(
             if self._white_value is not None:
                 try:
                     self._white_value = int(
-                        self._templates[
-                            CONF_WHITE_VALUE_TEMPLATE
-                        ].async_render_with_possible_json_value(msg.payload)
+                        async_render_message(
+                            self._templates[CONF_WHITE_VALUE_TEMPLATE], msg
+                        )
                     )
                 except ValueError:
                     _LOGGER.warning("Invalid white value received")
 
             if self._templates[CONF_EFFECT_TEMPLATE] is not None:
-                effect = self._templates[
-                    CONF_EFFECT_TEMPLATE
-                ].async_render_with_possible_json_value(msg.payload)
+                effect = async_render_message(
+                    self._templates[CONF_EFFECT_TEMPLATE], msg
+                )
 
                 if effect in self._config.get(CONF_EFFECT_LIST):
                     self._effect = effect
@@ -30,6 +30,7 @@ from . import (
     subscription,
 )
 from .discovery import MQTT_DISCOVERY_NEW, clear_discovery_hash
+from .templates import async_render_message
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -151,7 +152,7 @@ class MqttLock(
             """Handle new MQTT messages."""
             payload = msg.payload
             if value_template is not None:
-                payload = value_template.async_render_with_possible_json_value(payload)
+                payload = async_render_message(value_template, msg)
             if payload == self._config[CONF_PAYLOAD_LOCK]:
                 self._state = True
             elif payload == self._config[CONF_PAYLOAD_UNLOCK]:
@@ -0,0 +1,248 @@
+"""Topic filter trie used to dispatch MQTT messages to subscriptions."""
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+
+class _Node:
+    """A single topic level in the trie."""
+
+    __slots__ = ("children", "values")
+
+    def __init__(self) -> None:
+        """Initialize an empty node."""
+        self.children: Dict[str, "_Node"] = {}
+        self.values: List[Any] = []
+
+
+class TopicMatcher:
+    """Persistent trie mapping MQTT topic filters to values.
+
+    Filters are added and removed as subscriptions come and go, so matching
+    a topic costs one walk proportional to the topic depth instead of one
+    comparison per subscription.
+    """
+
+    def __init__(self) -> None:
+        """Initialize an empty matcher."""
+        self._root = _Node()
+        self._count = 0
+
+    def __len__(self) -> int:
+        """Return the number of values stored in the matcher."""
+        return self._count
+
+    def add(self, topic_filter: str, value: Any) -> None:
+        """Associate a value with a topic filter."""
+        node = self._root
+        for level in topic_filter.split("/"):
+            child = node.children.get(level)
+            if child is None:
+                child = node.children[level] = _Node()
+            node = child
+        node.values.append(value)
+        self._count += 1
+
+    def remove(self, topic_filter: str, value: Any) -> None:
+        """Remove a value from a topic filter and prune empty levels."""
+        path = []
+        node = self._root
+        for level in topic_filter.split("/"):
+            child = node.children.get(level)
+            if child is None:
+                raise KeyError(topic_filter)
+            path.append((node, level))
+            node = child
+        try:
+            node.values.remove(value)
+        except ValueError:
+            raise KeyError(topic_filter)
+        self._count -= 1
+
+        for parent, level in reversed(path):
+            child = parent.children[level]
+            if child.children or child.values:
+                break
+            del parent.children[level]
+
+    def get(self, topic_filter: str) -> List[Any]:
+        """Return the values added for exactly this topic filter."""
+        node = self._root
+        for level in topic_filter.split("/"):
+            node = node.children.get(level)
+            if node is None:
+                return []
+        return node.values
+
+    def match(self, topic: str) -> List[Any]:
+        """Return all values whose filter matches the topic."""
+        levels = topic.split("/")
+        depth = len(levels)
+        # Wildcards at the first level must not match topics starting with $
+        wildcards_at_root = not topic.startswith("$")
+        result: List[Any] = []
+        stack = [(self._root, 0)]
+
+        while stack:
+            node, index = stack.pop()
+            children = node.children
+
+            if index or wildcards_at_root:
+                multi = children.get("#")
+                if multi is not None:
+                    result.extend(multi.values)
+
+            if index == depth:
+                result.extend(node.values)
+                continue
+
+            exact = children.get(levels[index])
+            if exact is not None:
+                stack.append((exact, index + 1))
+            if index or wildcards_at_root:
+                single = children.get("+")
+                if single is not None:
+                    stack.append((single, index + 1))
+
+        return result
+
+
+class MatchCache:
+    """Bounded LRU cache of concrete topics to their matched values.
+
+    Entries must be invalidated with the filter of every value that is added
+    to or removed from the matcher backing the cache.
+    """
+
+    def __init__(self, max_size: int) -> None:
+        """Initialize the cache."""
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: "OrderedDict[str, Tuple[Any, ...]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        """Return the number of cached topics."""
+        return len(self._entries)
+
+    def get(self, topic: str) -> Optional[Tuple[Any, ...]]:
+        """Return the cached values for a topic, or None on a miss."""
+        entry = self._entries.get(topic)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(topic)
+        return entry
+
+    def put(self, topic: str, values: Tuple[Any, ...]) -> None:
+        """Cache the matched values for a topic."""
+        if self.max_size <= 0:
+            return
+        self._entries[topic] = values
+        if len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, topic_filter: str) -> None:
+        """Drop all cached topics the topic filter could match."""
+        if "+" not in topic_filter and "#" not in topic_filter:
+            self._entries.pop(topic_filter, None)
+            return
+
+        for topic in [
+            topic for topic in self._entries if match_topic(topic_filter, topic)
+        ]:
+            del self._entries[topic]
+
+    def clear(self) -> None:
+        """Drop all cached topics."""
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        """Return the cache counters."""
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+def match_topic(topic_filter: str, topic: str) -> bool:
+    """Test if a single topic filter matches a topic."""
+    if topic.startswith("$") and topic_filter[:1] in ("+", "#"):
+        return False
+
+    filter_levels = topic_filter.split("/")
+    topic_levels = topic.split("/")
+    for index, level in enumerate(filter_levels):
+        if level == "#":
+            return True
+        if index == len(topic_levels):
+            return False
+        if level not in ("+", topic_levels[index]):
+            return False
+    return len(filter_levels) == len(topic_levels)
+
+
+class FilterRegistry:
+    """Reference counts and QoS levels of the filters subscribed at the broker.
+
+    Subscribers are counted per QoS level so the highest requested QoS of a
+    filter is known without looking at the individual subscriptions.
+    """
+
+    def __init__(self) -> None:
+        """Initialize an empty registry."""
+        self._qos_counts: Dict[str, List[int]] = {}
+
+    def __contains__(self, topic_filter: str) -> bool:
+        """Return if the filter has subscribers."""
+        return topic_filter in self._qos_counts
+
+    def __len__(self) -> int:
+        """Return the number of distinct filters."""
+        return len(self._qos_counts)
+
+    def add(self, topic_filter: str, qos: int) -> Optional[int]:
+        """Register a subscriber.
+
+        Return the QoS to subscribe at the broker with if this is the first
+        subscriber of the filter or it raises the QoS, otherwise None.
+        """
+        counts = self._qos_counts.get(topic_filter)
+        if counts is None:
+            counts = self._qos_counts[topic_filter] = [0, 0, 0]
+            counts[qos] += 1
+            return qos
+
+        current_qos = _max_qos(counts)
+        counts[qos] += 1
+        return qos if qos > current_qos else None
+
+    def remove(self, topic_filter: str, qos: int) -> bool:
+        """Unregister a subscriber, return True if it was the last one."""
+        counts = self._qos_counts[topic_filter]
+        counts[qos] -= 1
+        if any(counts):
+            return False
+        del self._qos_counts[topic_filter]
+        return True
+
+    def items(self) -> List[Tuple[str, int]]:
+        """Return all filters with the highest QoS requested for them."""
+        return [
+            (topic_filter, _max_qos(counts))
+            for topic_filter, counts in self._qos_counts.items()
+        ]
+
+
+def _max_qos(counts: List[int]) -> int:
+    """Return the highest QoS level with subscribers."""
+    if counts[2]:
+        return 2
+    if counts[1]:
+        return 1
+    return 0
@@ -0,0 +1,283 @@
+"""Runtime metrics of the MQTT client."""
+from bisect import bisect_left
+from collections import deque
+from typing import Any, Deque, Dict, List, Tuple
+
+# Upper bounds of the latency histogram buckets, in seconds
+BUCKETS = (
+    0.00001,
+    0.000025,
+    0.00005,
+    0.0001,
+    0.00025,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+)
+
+# Rates cover the last RATE_SAMPLES * RATE_INTERVAL seconds
+RATE_INTERVAL = 5  # seconds
+RATE_SAMPLES = 12
+# Number of topic prefixes and callbacks reported
+TOP_N = 10
+# Limit the number of tracked topic prefixes and callbacks, the rest is
+# counted under OTHER.
+MAX_PREFIXES = 500
+MAX_CALLBACKS = 5000
+OTHER = "<other>"
+
+# Time, received and sent messages, and per prefix counts of both
+_Sample = Tuple[float, int, int, Dict[str, int], Dict[str, int]]
+
+
+class Histogram:
+    """Latency histogram with fixed buckets."""
+
+    __slots__ = ("counts", "count", "total", "max")
+
+    def __init__(self) -> None:
+        """Initialize an empty histogram."""
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        """Add a measurement."""
+        self.counts[bisect_left(BUCKETS, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, quantile: float) -> float:
+        """Return the upper bound of the bucket holding a quantile, at most max."""
+        rank = quantile * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= rank:
+                if index == len(BUCKETS):
+                    return self.max
+                return min(BUCKETS[index], self.max)
+        return 0.0
+
+    def as_dict(self) -> Dict[str, float]:
+        """Return count, sum, mean, max and quantiles."""
+        return {
+            "count": self.count,
+            "sum": self.total,
+            "mean": self.total / self.count if self.count else 0.0,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99),
+            "max": self.max,
+        }
+
+
+class Metrics:
+    """Counters and sampled timings of the message flow.
+
+    Counting messages costs a dict update. Dispatch and callback times are
+    only measured for every sample_interval-th received message, so the
+    metrics can stay on in production. Rates are computed over the samples
+    taken by calling sample() periodically.
+    """
+
+    def __init__(self, sample_interval: int) -> None:
+        """Initialize the metrics."""
+        self.sample_interval = sample_interval
+        self.messages_in = 0
+        self.messages_out = 0
+        self.handoff_latency = Histogram()
+        self.dispatch_time = Histogram()
+        self._prefixes_in: Dict[str, int] = {}
+        self._prefixes_out: Dict[str, int] = {}
+        self._callbacks: Dict[str, Histogram] = {}
+        self._countdown = sample_interval
+        self._samples: Deque[_Sample] = deque(maxlen=RATE_SAMPLES)
+
+    def count_in(self, topic: str) -> bool:
+        """Count a received message, return True if it should be timed."""
+        self.messages_in += 1
+        _count_prefix(self._prefixes_in, topic)
+        if not self.sample_interval:
+            return False
+        self._countdown -= 1
+        if self._countdown:
+            return False
+        self._countdown = self.sample_interval
+        return True
+
+    def count_out(self, topic: str) -> None:
+        """Count a message handed to the broker connection."""
+        self.messages_out += 1
+        _count_prefix(self._prefixes_out, topic)
+
+    def observe_callback(self, key: str, duration: float) -> None:
+        """Add the run time of a subscription callback."""
+        histogram = self._callbacks.get(key)
+        if histogram is None:
+            if len(self._callbacks) >= MAX_CALLBACKS:
+                key = OTHER
+            histogram = self._callbacks.setdefault(key, Histogram())
+        histogram.observe(duration)
+
+    def sample(self, now: float) -> None:
+        """Remember the counters for computing rates."""
+        self._samples.append(
+            (
+                now,
+                self.messages_in,
+                self.messages_out,
+                dict(self._prefixes_in),
+                dict(self._prefixes_out),
+            )
+        )
+
+    def snapshot(self, now: float) -> Dict[str, Any]:
+        """Return all metrics."""
+        rate_in = rate_out = 0.0
+        top_in: List[Dict[str, Any]] = []
+        top_out: List[Dict[str, Any]] = []
+        if self._samples:
+            oldest = self._samples[0]
+            then, messages_in, messages_out, prefixes_in, prefixes_out = oldest
+            elapsed = now - then
+            if elapsed > 0:
+                rate_in = (self.messages_in - messages_in) / elapsed
+                rate_out = (self.messages_out - messages_out) / elapsed
+                top_in = _top_rates(self._prefixes_in, prefixes_in, elapsed)
+                top_out = _top_rates(self._prefixes_out, prefixes_out, elapsed)
+
+        return {
+            "messages_in": self.messages_in,
+            "messages_out": self.messages_out,
+            "messages_in_rate": rate_in,
+            "messages_out_rate": rate_out,
+            "top_prefixes_in": top_in,
+            "top_prefixes_out": top_out,
+            "sample_interval": self.sample_interval,
+            "handoff_latency": self.handoff_latency.as_dict(),
+            "dispatch_time": self.dispatch_time.as_dict(),
+            "callback_time": self.callback_stats(TOP_N),
+        }
+
+    def callback_stats(self, limit: int) -> List[Dict[str, Any]]:
+        """Return the timings of the callbacks with the most time spent."""
+        callbacks = sorted(
+            self._callbacks.items(), key=lambda item: item[1].total, reverse=True
+        )
+        return [
+            dict(histogram.as_dict(), callback=key)
+            for key, histogram in callbacks[:limit]
+        ]
+
+
+def _count_prefix(prefixes: Dict[str, int], topic: str) -> None:
+    """Count a message for the first level of its topic."""
+    prefix = topic.partition("/")[0]
+    count = prefixes.get(prefix)
+    if count is not None:
+        prefixes[prefix] = count + 1
+    elif len(prefixes) < MAX_PREFIXES:
+        prefixes[prefix] = 1
+    else:
+        prefixes[OTHER] = prefixes.get(OTHER, 0) + 1
+
+
+def _top_rates(
+    prefixes: Dict[str, int], previous: Dict[str, int], elapsed: float
+) -> List[Dict[str, Any]]:
+    """Return the topic prefixes with the highest message rates."""
+    rates = [
+        (count - previous.get(prefix, 0), prefix) for prefix, count in prefixes.items()
+    ]
+    rates.sort(reverse=True)
+    return [
+        {"prefix": prefix, "rate": delta / elapsed}
+        for delta, prefix in rates[:TOP_N]
+        if delta
+    ]
+
+
+def prometheus_text(metrics: Dict[str, Any]) -> str:
+    """Format a metrics snapshot in the Prometheus text exposition format."""
+    lines: List[str] = []
+
+    def add(name: str, kind: str, samples: List[Tuple[str, Any]]) -> None:
+        lines.append("# TYPE mqtt_{} {}".format(name, kind))
+        for labels, value in samples:
+            lines.append(
+                "mqtt_{}{} {}".format(name, "{" + labels + "}" if labels else "", value)
+            )
+
+    def summary(name: str, stats: Dict[str, float], labels: str = "") -> None:
+        lines.extend(
+            'mqtt_{}{{{}quantile="{}"}} {}'.format(name, labels, quantile, stats[key])
+            for quantile, key in (("0.5", "p50"), ("0.95", "p95"), ("0.99", "p99"))
+        )
+        labels = "{" + labels.rstrip(",") + "}" if labels else ""
+        lines.append("mqtt_{}_sum{} {}".format(name, labels, stats["sum"]))
+        lines.append("mqtt_{}_count{} {}".format(name, labels, stats["count"]))
+
+    add("messages_received_total", "counter", [("", metrics["messages_in"])])
+    add("messages_sent_total", "counter", [("", metrics["messages_out"])])
+    add(
+        "messages_rate",
+        "gauge",
+        [
+            ('direction="in"', metrics["messages_in_rate"]),
+            ('direction="out"', metrics["messages_out_rate"]),
+        ],
+    )
+    add(
+        "prefix_messages_rate",
+        "gauge",
+        [
+            (
+                'direction="{}",prefix="{}"'.format(
+                    direction, _escape(entry["prefix"])
+                ),
+                entry["rate"],
+            )
+            for direction in ("in", "out")
+            for entry in metrics["top_prefixes_" + direction]
+        ],
+    )
+    for name in ("handoff_latency", "dispatch_time"):
+        lines.append("# TYPE mqtt_{}_seconds summary".format(name))
+        summary("{}_seconds".format(name), metrics[name])
+    lines.append("# TYPE mqtt_callback_time_seconds summary")
+    for entry in metrics["callback_time"]:
+        summary(
+            "callback_time_seconds",
+            entry,
+            'callback="{}",'.format(_escape(entry["callback"])),
+        )
+    for name in ("subscriptions", "publish_queue_depth", "ingest_queue_depth"):
+        add(name, "gauge", [("", metrics[name])])
+    add("connected", "gauge", [("", int(metrics["connected"]))])
+    add(
+        "messages_dropped_total",
+        "counter",
+        [
+            ('reason="{}"'.format(reason), count)
+            for reason, count in metrics["dropped"].items()
+        ],
+    )
+    return "\n".join(lines) + "\n"
+
+
+def _escape(value: str) -> str:
+    """Escape a Prometheus label value."""
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
@@ -1,20 +1,51 @@
 """Modesl used by multiple MQTT modules."""
-from typing import Union, Callable
+import json
+from typing import Any, Union, Callable
 
 import attr
 
 # pylint: disable=invalid-name
 PublishPayloadType = Union[str, bytes, int, float, None]
 
+_UNPARSED = object()
+_INVALID_JSON = object()
+
+
+class _ParsedJson:
+    """Slot caching the JSON of a message, outside of its attrs fields."""
+
+    __slots__ = ("_json",)
+
 
 @attr.s(slots=True, frozen=True)
-class Message:
-    """MQTT Message."""
+class Message(_ParsedJson):
+    """MQTT Message.
+
+    The same message is passed to all subscriptions with the same encoding,
+    so the payload is parsed as JSON at most once for all of them.
+    """
 
     topic = attr.ib(type=str)
     payload = attr.ib(type=PublishPayloadType)
     qos = attr.ib(type=int)
     retain = attr.ib(type=bool)
 
+    def payload_json(self) -> Any:
+        """Return the payload parsed as JSON, raise ValueError if it isn't JSON.
+
+        The parsed value is shared, callers must not modify it.
+        """
+        parsed = getattr(self, "_json", _UNPARSED)
+        if parsed is _UNPARSED:
+            try:
+                parsed = json.loads(self.payload)
+            except (ValueError, TypeError):
+                parsed = _INVALID_JSON
+            # The cache doesn't change the value of the frozen message
+            object.__setattr__(self, "_json", parsed)
+        if parsed is _INVALID_JSON:
+            raise ValueError("Payload is not valid JSON")
+        return parsed
+
 
 MessageCallbackType = Callable[[Message], None]
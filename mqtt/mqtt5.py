@@ -0,0 +1,134 @@
+"""MQTT 5 subscription identifiers, topic aliases and session properties."""
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from paho.mqtt.packettypes import PacketTypes
+from paho.mqtt.properties import Properties
+
+# Keep a persistent session while disconnected, like MQTT 3.1.1 brokers do
+SESSION_EXPIRY_NEVER = 0xFFFFFFFF
+# Receive Maximum the broker implies when it doesn't send one
+DEFAULT_RECEIVE_MAXIMUM = 65535
+# Upper bound for QoS 1 and 2 messages paho keeps in flight
+MAX_INFLIGHT_MESSAGES = 1000
+REASON_UNSUPPORTED_PROTOCOL_VERSION = 132
+# Largest variable byte integer
+MAX_SUBSCRIPTION_ID = 268435455
+
+
+def connect_properties(
+    clean_session: bool, receive_maximum: Optional[int]
+) -> Properties:
+    """Return the properties of the CONNECT packet."""
+    properties = Properties(PacketTypes.CONNECT)
+    if not clean_session:
+        properties.SessionExpiryInterval = SESSION_EXPIRY_NEVER
+    if receive_maximum is not None:
+        properties.ReceiveMaximum = receive_maximum
+    return properties
+
+
+def inflight_messages(connack_properties: Properties) -> int:
+    """Return how many QoS 1 and 2 messages may be in flight to the broker."""
+    receive_maximum = getattr(
+        connack_properties, "ReceiveMaximum", DEFAULT_RECEIVE_MAXIMUM
+    )
+    return min(receive_maximum, MAX_INFLIGHT_MESSAGES)
+
+
+class SubscriptionIds:
+    """Assign subscription identifiers to topic filters.
+
+    The broker tags every message with the identifiers of the subscriptions
+    it matched, so messages can be dispatched without matching the topic.
+    Identifiers are not reused, a message still in flight for a filter that
+    was unsubscribed can't end up at another filter. The identifiers of a
+    persistent session are saved and restored with it, as the broker keeps
+    tagging messages with them after a restart.
+    """
+
+    def __init__(self) -> None:
+        """Initialize the identifier maps."""
+        self._ids: Dict[str, int] = {}
+        self._filters: Dict[int, str] = {}
+        self.next_id = 1
+
+    def restore(self, ids: Dict[str, int], next_id: int) -> None:
+        """Take over the identifiers of a session saved before a restart."""
+        for topic_filter, subscription_id in ids.items():
+            self._ids[topic_filter] = subscription_id
+            self._filters[subscription_id] = topic_filter
+        self.next_id = next_id
+
+    def saved(self, topic_filters: Iterable[str]) -> Dict[str, int]:
+        """Return the identifiers of filters, to restore them later."""
+        return {
+            topic_filter: self._ids[topic_filter]
+            for topic_filter in topic_filters
+            if topic_filter in self._ids
+        }
+
+    def properties(self, topic_filter: str) -> Properties:
+        """Return SUBSCRIBE properties carrying the identifier of a filter."""
+        subscription_id = self._ids.get(topic_filter)
+        if subscription_id is None:
+            subscription_id = self._ids[topic_filter] = self.next_id
+            # Only after wrapping around, take the identifier from its filter
+            old_filter = self._filters.get(subscription_id)
+            if old_filter is not None:
+                del self._ids[old_filter]
+            self._filters[subscription_id] = topic_filter
+            self.next_id = self.next_id % MAX_SUBSCRIPTION_ID + 1
+
+        properties = Properties(PacketTypes.SUBSCRIBE)
+        properties.SubscriptionIdentifier = subscription_id
+        return properties
+
+    def filters(self, msg) -> Optional[List[str]]:
+        """Return the filters a received message matched.
+
+        Return None if the message doesn't carry known identifiers, for
+        example for subscriptions of a session whose identifiers weren't
+        saved. Such identifiers may also have been given to other filters
+        since, check that the filters match the topic.
+        """
+        properties = getattr(msg, "properties", None)
+        subscription_ids = getattr(properties, "SubscriptionIdentifier", None)
+        if not subscription_ids:
+            return None
+        try:
+            return [self._filters[sub_id] for sub_id in subscription_ids]
+        except KeyError:
+            return None
+
+
+class TopicAliases:
+    """Assign topic aliases to the topics we publish on.
+
+    The first message on a topic carries the topic and its alias, the next
+    ones only the alias. Aliases only live as long as the connection, reset
+    them when it is lost and when the broker announces its maximum.
+    """
+
+    def __init__(self) -> None:
+        """Initialize without aliases until the broker allows them."""
+        self.maximum = 0
+        self._aliases: Dict[str, Properties] = {}
+
+    def reset(self, maximum: int) -> None:
+        """Forget all aliases and allow up to maximum new ones."""
+        self._aliases = {}
+        self.maximum = maximum
+
+    def get(self, topic: str) -> Tuple[str, Optional[Properties]]:
+        """Return the topic and PUBLISH properties to publish on topic."""
+        aliases = self._aliases
+        properties = aliases.get(topic)
+        if properties is not None:
+            return "", properties
+        if len(aliases) >= self.maximum:
+            return topic, None
+
+        properties = Properties(PacketTypes.PUBLISH)
+        properties.TopicAlias = len(aliases) + 1
+        aliases[topic] = properties
+        return topic, properties
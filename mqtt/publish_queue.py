@@ -0,0 +1,195 @@
+"""Outbound MQTT publish queue with priorities and backpressure."""
+import asyncio
+from collections import deque
+import logging
+import time
+from typing import Awaitable, Callable, Deque, Dict, List, Optional, Union
+
+import attr
+
+from .models import PublishPayloadType
+
+_LOGGER = logging.getLogger(__name__)
+
+PRIORITY_COMMAND = 0
+PRIORITY_BULK = 1
+PRIORITIES = (PRIORITY_COMMAND, PRIORITY_BULK)
+
+OVERFLOW_BLOCK = "block"
+OVERFLOW_DROP_OLDEST = "drop_oldest"
+OVERFLOW_DROP_NEWEST = "drop_newest"
+OVERFLOW_POLICIES = (OVERFLOW_BLOCK, OVERFLOW_DROP_OLDEST, OVERFLOW_DROP_NEWEST)
+
+# Maximum number of messages handed to paho in one go
+MAX_BATCH_SIZE = 100
+
+
+@attr.s(slots=True, frozen=True)
+class PublishRequest:
+    """A message waiting to be published."""
+
+    topic = attr.ib(type=str)
+    payload = attr.ib(type=PublishPayloadType)
+    qos = attr.ib(type=int)
+    retain = attr.ib(type=bool)
+    priority = attr.ib(type=int, default=PRIORITY_COMMAND)
+    enqueued = attr.ib(type=float, factory=time.monotonic)
+
+
+PublishBatchType = Callable[[List[PublishRequest]], Awaitable[None]]
+
+
+class PublishQueue:
+    """Queue publishes and send them from a single writer task.
+
+    Commands are always sent before bulk messages. When the queue is full the
+    overflow policy decides whether callers wait for room or a message is
+    dropped.
+    """
+
+    def __init__(
+        self,
+        loop: asyncio.AbstractEventLoop,
+        publish_batch: PublishBatchType,
+        max_size: int,
+        overflow: str = OVERFLOW_BLOCK,
+    ) -> None:
+        """Initialize the queue."""
+        self._loop = loop
+        self._publish_batch = publish_batch
+        self.max_size = max_size
+        self.overflow = overflow
+        self._queues: Dict[int, Deque[PublishRequest]] = {
+            priority: deque() for priority in PRIORITIES
+        }
+        self._size = 0
+        self._wakeup = asyncio.Event()
+        self._space_waiters: Deque[asyncio.Future] = deque()
+        self._writer: Optional[asyncio.Task] = None
+        self._stopping = False
+        self._overflowing = False
+
+        self.published = 0
+        self.dropped = 0
+        self.batches = 0
+        self.max_depth = 0
+        self._latency_total = 0.0
+        self._latency_max = 0.0
+
+    def __len__(self) -> int:
+        """Return the number of queued messages."""
+        return self._size
+
+    def start(self) -> None:
+        """Start the writer task."""
+        self._stopping = False
+        if self._writer is None or self._writer.done():
+            self._writer = self._loop.create_task(self._async_writer())
+
+    async def async_stop(self) -> None:
+        """Send all queued messages and stop the writer task."""
+        self._stopping = True
+        self._wakeup.set()
+        if self._writer is not None:
+            await self._writer
+            self._writer = None
+
+    async def async_put(self, request: PublishRequest) -> None:
+        """Queue a message, applying the overflow policy if full."""
+        if self._size >= self.max_size:
+            if self.overflow == OVERFLOW_BLOCK:
+                while self._size >= self.max_size:
+                    waiter = self._loop.create_future()
+                    self._space_waiters.append(waiter)
+                    await waiter
+            elif not self._async_make_room(request):
+                return
+        elif self._overflowing:
+            self._overflowing = False
+
+        self._queues[request.priority].append(request)
+        self._size += 1
+        if self._size > self.max_depth:
+            self.max_depth = self._size
+        self._wakeup.set()
+
+    def _async_make_room(self, request: PublishRequest) -> bool:
+        """Drop a message to make room for request, return False to drop it."""
+        if not self._overflowing:
+            self._overflowing = True
+            _LOGGER.warning(
+                "MQTT publish queue is full (%d messages), dropping %s messages",
+                self.max_size,
+                "new" if self.overflow == OVERFLOW_DROP_NEWEST else "old",
+            )
+        self.dropped += 1
+
+        if self.overflow == OVERFLOW_DROP_NEWEST:
+            return False
+
+        # Drop the oldest message of the least important priority
+        for priority in reversed(PRIORITIES):
+            if priority < request.priority:
+                break
+            if self._queues[priority]:
+                self._queues[priority].popleft()
+                self._size -= 1
+                return True
+        return False
+
+    def _async_next_batch(self) -> List[PublishRequest]:
+        """Pop the next messages to send, in priority order."""
+        batch: List[PublishRequest] = []
+        for priority in PRIORITIES:
+            queue = self._queues[priority]
+            while queue and len(batch) < MAX_BATCH_SIZE:
+                batch.append(queue.popleft())
+        self._size -= len(batch)
+
+        while self._space_waiters and self._size < self.max_size:
+            waiter = self._space_waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+        return batch
+
+    async def _async_writer(self) -> None:
+        """Send queued messages until stopped."""
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+
+            while self._size:
+                batch = self._async_next_batch()
+                now = time.monotonic()
+                for request in batch:
+                    latency = now - request.enqueued
+                    self._latency_total += latency
+                    if latency > self._latency_max:
+                        self._latency_max = latency
+                self.published += len(batch)
+                self.batches += 1
+
+                try:
+                    await self._publish_batch(batch)
+                except Exception:  # pylint: disable=broad-except
+                    _LOGGER.exception("Error publishing MQTT messages")
+
+            if self._stopping:
+                return
+
+    def stats(self) -> Dict[str, Union[int, float]]:
+        """Return queue depth and latency counters."""
+        return {
+            "depth": self._size,
+            "depth_command": len(self._queues[PRIORITY_COMMAND]),
+            "depth_bulk": len(self._queues[PRIORITY_BULK]),
+            "max_depth": self.max_depth,
+            "max_size": self.max_size,
+            "published": self.published,
+            "dropped": self.dropped,
+            "batches": self.batches,
+            "mean_latency_ms": (
+                self._latency_total / self.published * 1000 if self.published else 0
+            ),
+            "max_latency_ms": self._latency_max * 1000,
+        }
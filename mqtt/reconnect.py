@@ -0,0 +1,111 @@
+"""Reconnect state machine for the MQTT client."""
+import asyncio
+import logging
+import random
+import time
+from typing import Awaitable, Callable, Optional
+
+_LOGGER = logging.getLogger(__name__)
+
+STATE_CONNECTED = "connected"
+STATE_WAITING = "waiting"
+STATE_CONNECTING = "connecting"
+STATE_STOPPED = "stopped"
+
+
+class Reconnector:
+    """Reconnect from the event loop with jittered exponential backoff.
+
+    The first attempt is made after first_delay seconds. Every failed attempt
+    doubles the delay, starting at one second and capped at max_delay, and a
+    random jitter of up to half the delay spreads out clients that lost the
+    same broker. A pending wait can be cut short with async_retry_now.
+    """
+
+    def __init__(
+        self,
+        loop: asyncio.AbstractEventLoop,
+        async_connect: Callable[[], Awaitable[bool]],
+        first_delay: float,
+        max_delay: float,
+    ) -> None:
+        """Initialize the state machine."""
+        self._loop = loop
+        self._async_connect = async_connect
+        self.first_delay = first_delay
+        self.max_delay = max_delay
+        self.state = STATE_CONNECTED
+        self.attempts = 0
+        self.last_reconnect_duration: Optional[float] = None
+        self._disconnected_at: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+        self._retry_now: Optional[asyncio.Event] = None
+
+    def delay(self, attempt: int) -> float:
+        """Return the seconds to wait before an attempt."""
+        if attempt == 0:
+            return self.first_delay
+        delay = min(2 ** (attempt - 1), self.max_delay)
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def async_disconnected(self) -> None:
+        """Start reconnecting after losing the connection."""
+        if self.state == STATE_STOPPED:
+            return
+        if self._disconnected_at is None:
+            self._disconnected_at = time.monotonic()
+        self.state = STATE_WAITING
+        if self._task is None or self._task.done():
+            self._task = self._loop.create_task(self._async_run())
+
+    def async_connected(self) -> Optional[float]:
+        """Mark the connection as established.
+
+        Return the seconds since the connection was lost, if it was.
+        """
+        if self.state == STATE_STOPPED:
+            return None
+        self.state = STATE_CONNECTED
+        self.attempts = 0
+        if self._disconnected_at is None:
+            return None
+        self.last_reconnect_duration = time.monotonic() - self._disconnected_at
+        self._disconnected_at = None
+        return self.last_reconnect_duration
+
+    def async_retry_now(self) -> None:
+        """Skip the remaining wait before the next attempt."""
+        if self._retry_now is not None:
+            self._retry_now.set()
+
+    def async_stop(self) -> None:
+        """Stop reconnecting."""
+        self.state = STATE_STOPPED
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _async_run(self) -> None:
+        """Attempt to reconnect until connected or stopped."""
+        while self.state == STATE_WAITING:
+            delay = self.delay(self.attempts)
+            if delay > 0:
+                _LOGGER.warning("Trying to reconnect to MQTT in %.1f s", delay)
+                self._retry_now = asyncio.Event()
+                try:
+                    await asyncio.wait_for(self._retry_now.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                finally:
+                    self._retry_now = None
+
+            if self.state != STATE_WAITING:
+                return
+
+            self.state = STATE_CONNECTING
+            self.attempts += 1
+            if await self._async_connect():
+                # Connected once the broker acknowledges, see async_connected
+                return
+            if self.state == STATE_CONNECTING:
+                self.state = STATE_WAITING
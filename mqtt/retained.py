@@ -0,0 +1,103 @@
+"""Cache of the last retained MQTT message per topic."""
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from .matcher import match_topic
+
+
+def _message_size(topic: str, msg: Any) -> int:
+    """Return the bytes a cached message is accounted for."""
+    return len(topic) + len(msg.payload)
+
+
+class RetainedCache:
+    """Memory bounded LRU cache of retained messages by topic.
+
+    The payloads and topics of the cached messages take up to max_bytes,
+    the least recently updated topics are evicted beyond. Payloads larger
+    than max_payload_size aren't cached, and drop the cached message of
+    their topic, which would be stale.
+    """
+
+    def __init__(self, max_bytes: int, max_payload_size: Optional[int] = None) -> None:
+        """Initialize the cache."""
+        self.max_bytes = max_bytes
+        self.max_payload_size = max_payload_size
+        self.size = 0
+        self.evictions = 0
+        self.too_large = 0
+        self._entries: "OrderedDict[str, Any]" = OrderedDict()
+
+    def __len__(self) -> int:
+        """Return the number of cached topics."""
+        return len(self._entries)
+
+    def __contains__(self, topic: str) -> bool:
+        """Return if a message is cached for a topic."""
+        return topic in self._entries
+
+    def get(self, topic: str) -> Optional[Any]:
+        """Return the cached message of a topic."""
+        return self._entries.get(topic)
+
+    def put(self, topic: str, msg: Any) -> None:
+        """Cache the message of a topic, evicting old topics beyond the limit."""
+        self.pop(topic)
+        if self.max_payload_size is not None and (
+            len(msg.payload) > self.max_payload_size
+        ):
+            self.too_large += 1
+            return
+        size = _message_size(topic, msg)
+        if size > self.max_bytes:
+            self.too_large += 1
+            return
+
+        self._entries[topic] = msg
+        self.size += size
+        while self.size > self.max_bytes:
+            old_topic, old_msg = self._entries.popitem(last=False)
+            self.size -= _message_size(old_topic, old_msg)
+            self.evictions += 1
+
+    def pop(self, topic: str) -> None:
+        """Drop the cached message of a topic."""
+        msg = self._entries.pop(topic, None)
+        if msg is not None:
+            self.size -= _message_size(topic, msg)
+
+    def items(self) -> List[Tuple[str, Any]]:
+        """Return the topics and cached messages, least recently updated first."""
+        return list(self._entries.items())
+
+    def match(self, topic_filter: str) -> List[Tuple[str, Any]]:
+        """Return the topics and cached messages matching a topic filter."""
+        if "+" not in topic_filter and "#" not in topic_filter:
+            msg = self._entries.get(topic_filter)
+            return [(topic_filter, msg)] if msg is not None else []
+        return [
+            (topic, msg)
+            for topic, msg in self._entries.items()
+            if match_topic(topic_filter, topic)
+        ]
+
+    def browse(self, prefix: str, limit: int) -> Tuple[int, List[Tuple[str, Any]]]:
+        """Return the number of topics starting with a prefix and the first ones.
+
+        At most limit topics and their messages are returned, sorted by topic.
+        """
+        topics = sorted(topic for topic in self._entries if topic.startswith(prefix))
+        return (
+            len(topics),
+            [(topic, self._entries[topic]) for topic in topics[:limit]],
+        )
+
+    def stats(self) -> Dict[str, int]:
+        """Return the cache counters."""
+        return {
+            "topics": len(self._entries),
+            "bytes": self.size,
+            "max_bytes": self.max_bytes,
+            "evictions": self.evictions,
+            "too_large": self.too_large,
+        }
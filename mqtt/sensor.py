@@ -1,6 +1,5 @@
 """Support for MQTT sensors."""
 from datetime import timedelta
-import json
 import logging
 from typing import Optional
 
@@ -27,9 +26,11 @@ from homeassistant.util import dt as dt_util
 
 from . import (
     ATTR_DISCOVERY_HASH,
+    CONF_METRICS_SENSORS,
     CONF_QOS,
     CONF_STATE_TOPIC,
     CONF_UNIQUE_ID,
+    DATA_MQTT,
     MqttAttributes,
     MqttAvailability,
     MqttDiscoveryUpdate,
@@ -37,6 +38,7 @@ from . import (
     subscription,
 )
 from .discovery import MQTT_DISCOVERY_NEW, clear_discovery_hash
+from .templates import async_render_message
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -63,11 +65,57 @@ PLATFORM_SCHEMA = (
     .extend(mqtt.MQTT_JSON_ATTRS_SCHEMA.schema)
 )
 
+# Name, unit, icon and value of the diagnostic sensors of the MQTT client
+METRICS_SENSORS = {
+    "messages_received": (
+        "MQTT messages received",
+        "msg/s",
+        "mdi:download-network",
+        lambda metrics: round(metrics["messages_in_rate"], 1),
+    ),
+    "messages_sent": (
+        "MQTT messages sent",
+        "msg/s",
+        "mdi:upload-network",
+        lambda metrics: round(metrics["messages_out_rate"], 1),
+    ),
+    "handoff_latency": (
+        "MQTT handoff latency",
+        "ms",
+        "mdi:timer",
+        lambda metrics: round(metrics["handoff_latency"]["p99"] * 1000, 3),
+    ),
+    "dispatch_time": (
+        "MQTT dispatch time",
+        "ms",
+        "mdi:timer",
+        lambda metrics: round(metrics["dispatch_time"]["p99"] * 1000, 3),
+    ),
+    "publish_queue_depth": (
+        "MQTT publish queue",
+        "messages",
+        "mdi:tray-full",
+        lambda metrics: metrics["publish_queue_depth"],
+    ),
+    "subscriptions": (
+        "MQTT subscriptions",
+        "subscriptions",
+        "mdi:format-list-bulleted",
+        lambda metrics: metrics["subscriptions"],
+    ),
+}
+
 
 async def async_setup_platform(
     hass: HomeAssistantType, config: ConfigType, async_add_entities, discovery_info=None
 ):
     """Set up MQTT sensors through configuration.yaml."""
+    if discovery_info is not None and discovery_info.get(CONF_METRICS_SENSORS):
+        async_add_entities(
+            [MqttMetricsSensor(key) for key in METRICS_SENSORS], update_before_add=True
+        )
+        return
+
     await _async_setup_entity(config, async_add_entities)
 
 
@@ -170,7 +218,7 @@ class MqttSensor(
             if json_attributes:
                 self._attributes = {}
                 try:
-                    json_dict = json.loads(payload)
+                    json_dict = msg.payload_json()
                     if isinstance(json_dict, dict):
                         attrs = {
                             k: json_dict[k] for k in json_attributes & json_dict.keys()
@@ -183,9 +231,7 @@ class MqttSensor(
                     _LOGGER.debug("Erroneous JSON: %s", payload)
 
             if template is not None:
-                payload = template.async_render_with_possible_json_value(
-                    payload, self._state
-                )
+                payload = async_render_message(template, msg, self._state)
             self._state = payload
             self.async_write_ha_state()
 
@@ -260,3 +306,42 @@ class MqttSensor(
     def device_class(self) -> Optional[str]:
         """Return the device class of the sensor."""
         return self._config.get(CONF_DEVICE_CLASS)
+
+
+class MqttMetricsSensor(Entity):
+    """Diagnostic sensor with a runtime metric of the MQTT client."""
+
+    def __init__(self, key):
+        """Initialize the sensor."""
+        self._key = key
+        self._name, self._unit, self._icon, self._value = METRICS_SENSORS[key]
+        self._state = None
+
+    async def async_update(self):
+        """Read the metric from the MQTT client."""
+        self._state = self._value(self.hass.data[DATA_MQTT].metrics)
+
+    @property
+    def name(self):
+        """Return the name of the sensor."""
+        return self._name
+
+    @property
+    def unique_id(self):
+        """Return a unique ID."""
+        return "mqtt_metrics_{}".format(self._key)
+
+    @property
+    def unit_of_measurement(self):
+        """Return the unit this state is expressed in."""
+        return self._unit
+
+    @property
+    def icon(self):
+        """Return the icon."""
+        return self._icon
+
+    @property
+    def state(self):
+        """Return the state of the entity."""
+        return self._state
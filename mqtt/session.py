@@ -0,0 +1,64 @@
+"""Remember a persistent broker session across Home Assistant restarts."""
+from base64 import b64decode, b64encode
+import binascii
+from typing import Any, Dict, List, Optional, Tuple
+
+from homeassistant.helpers.storage import Store
+from homeassistant.helpers.typing import HomeAssistantType
+
+from .models import Message
+
+STORAGE_KEY = "mqtt.session"
+STORAGE_VERSION = 1
+
+
+class SessionStore:
+    """Save the state of the broker session when stopping, for the next start.
+
+    With clean_session false the broker keeps the subscriptions of our client
+    ids while Home Assistant restarts. Knowing which filters the session
+    holds, the next start only subscribes to new filters and unsubscribes
+    from dropped ones, and serves the retained messages saved with them
+    instead of making the broker replay all of them.
+
+    The state is only used once, it is cleared when loaded. After a crash
+    nothing is known about the session and everything is subscribed again.
+    """
+
+    def __init__(self, hass: HomeAssistantType, session_id: str) -> None:
+        """Initialize the store of the session of the broker and client ids."""
+        self._store = Store(hass, STORAGE_VERSION, STORAGE_KEY)
+        self._session_id = session_id
+
+    async def async_load(self) -> Optional[Dict[str, Any]]:
+        """Return the state saved when stopping, None if there is none."""
+        data = await self._store.async_load()
+        if not data:
+            return None
+        await self._store.async_save({})
+        if data.get("session") != self._session_id:
+            return None
+        return data
+
+    async def async_save(self, data: Dict[str, Any]) -> None:
+        """Save the state of the session."""
+        await self._store.async_save(dict(data, session=self._session_id))
+
+
+def encode_messages(messages: List[Tuple[str, Message]]) -> List[List[Any]]:
+    """Return retained messages in a form that can be saved as JSON."""
+    return [
+        [topic, b64encode(msg.payload).decode("ascii"), msg.qos]
+        for topic, msg in messages
+    ]
+
+
+def decode_messages(data: List[List[Any]]) -> List[Message]:
+    """Return the retained messages saved with encode_messages."""
+    messages = []
+    for topic, payload, qos in data:
+        try:
+            messages.append(Message(topic, b64decode(payload), qos, True))
+        except (binascii.Error, TypeError):
+            continue
+    return messages
@@ -0,0 +1,21 @@
+"""Spread MQTT topics over several broker connections."""
+import zlib
+
+SHARD_BY_PREFIX = "prefix"
+SHARD_BY_HASH = "hash"
+SHARD_MODES = (SHARD_BY_PREFIX, SHARD_BY_HASH)
+
+
+def shard_index(topic: str, shards: int, shard_by: str) -> int:
+    """Return the connection a topic or topic filter belongs to.
+
+    By prefix, everything below the same first topic level shares a
+    connection, so one integration keeps one connection. By hash, every
+    topic and filter is spread on its own. Uses crc32 instead of hash() as
+    persistent sessions need the same index after a restart.
+    """
+    if shards == 1:
+        return 0
+    if shard_by == SHARD_BY_PREFIX:
+        topic = topic.split("/", 1)[0]
+    return zlib.crc32(topic.encode("utf-8")) % shards
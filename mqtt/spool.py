@@ -0,0 +1,200 @@
+"""Disk-backed spool for MQTT messages published while disconnected."""
+import logging
+import mmap
+import os
+import struct
+from typing import Dict, Optional
+
+import attr
+
+from .models import PublishPayloadType
+
+_LOGGER = logging.getLogger(__name__)
+
+MAGIC = b"HAMQSPL1"
+# magic, head offset, tail offset, record count
+FILE_HEADER = struct.Struct("<8sQQQ")
+# record length including this header, qos, retain, topic length
+RECORD_HEADER = struct.Struct("<IBBH")
+DATA_START = 64
+MIN_SIZE = 4096
+
+
+@attr.s(slots=True, frozen=True)
+class SpooledMessage:
+    """A message read back from the spool."""
+
+    topic = attr.ib(type=str)
+    payload = attr.ib(type=bytes)
+    qos = attr.ib(type=int)
+    retain = attr.ib(type=bool)
+
+
+class PublishSpool:
+    """Size-capped ring of messages in a memory-mapped file.
+
+    Messages are appended at the head and read back from the tail. When the
+    ring is full the oldest messages are dropped. A retained message that is
+    superseded by a newer retained message on the same topic is skipped when
+    reading. The ring survives restarts.
+
+    Every call touches the file, so use it from the executor.
+    """
+
+    def __init__(self, path: str, size: int) -> None:
+        """Open or create the spool file."""
+        self.path = path
+        self.size = max(size, MIN_SIZE)
+        self.dropped = 0
+        self.superseded = 0
+        self._latest_retained: Dict[str, int] = {}
+
+        exists = os.path.exists(path) and os.path.getsize(path) == self.size
+        self._file = open(path, "r+b" if exists else "w+b")
+        if not exists:
+            self._file.truncate(self.size)
+        self._mmap = mmap.mmap(self._file.fileno(), self.size)
+
+        magic, self._head, self._tail, self._count = FILE_HEADER.unpack_from(
+            self._mmap, 0
+        )
+        if magic != MAGIC or not self._valid_offsets():
+            if exists:
+                _LOGGER.warning("Discarding invalid MQTT spool file %s", path)
+            self._head = self._tail = DATA_START
+            self._count = 0
+            self._write_header()
+        else:
+            self._index()
+
+    def __len__(self) -> int:
+        """Return the number of spooled messages."""
+        return self._count
+
+    def _valid_offsets(self) -> bool:
+        """Check the offsets read from the file header."""
+        return DATA_START <= self._head <= self.size and (
+            DATA_START <= self._tail <= self.size
+        )
+
+    def _write_header(self) -> None:
+        """Persist the ring offsets."""
+        FILE_HEADER.pack_into(self._mmap, 0, MAGIC, self._head, self._tail, self._count)
+
+    def _index(self) -> None:
+        """Rebuild the latest retained offset per topic from the file."""
+        offset = self._tail
+        for _ in range(self._count):
+            offset = self._wrap(offset)
+            length, _, retain, topic_len = RECORD_HEADER.unpack_from(self._mmap, offset)
+            if retain:
+                start = offset + RECORD_HEADER.size
+                topic = self._mmap[start : start + topic_len].decode("utf-8")
+                self._latest_retained[topic] = offset
+            offset += length
+
+    def _wrap(self, offset: int) -> int:
+        """Return where the record at offset really starts."""
+        if self.size - offset < RECORD_HEADER.size:
+            return DATA_START
+        if RECORD_HEADER.unpack_from(self._mmap, offset)[0] == 0:
+            return DATA_START
+        return offset
+
+    def append(
+        self, topic: str, payload: Optional[bytes], qos: int, retain: bool
+    ) -> bool:
+        """Add a message to the spool, return False if it can never fit."""
+        topic_bytes = topic.encode("utf-8")
+        payload = payload or b""
+        length = RECORD_HEADER.size + len(topic_bytes) + len(payload)
+        if length > (self.size - DATA_START) // 2:
+            _LOGGER.warning("Message on %s is too large to spool", topic)
+            return False
+
+        while True:
+            if self._count == 0:
+                self._head = self._tail = DATA_START
+            if self._head > self._tail or self._count == 0:
+                if self.size - self._head >= length:
+                    break
+                if self._tail - DATA_START >= length:
+                    if self.size - self._head >= RECORD_HEADER.size:
+                        RECORD_HEADER.pack_into(self._mmap, self._head, 0, 0, 0, 0)
+                    self._head = DATA_START
+                    break
+            elif self._tail - self._head >= length:
+                break
+            self._drop_oldest()
+
+        offset = self._head
+        RECORD_HEADER.pack_into(
+            self._mmap, offset, length, qos, int(retain), len(topic_bytes)
+        )
+        start = offset + RECORD_HEADER.size
+        self._mmap[start : start + len(topic_bytes)] = topic_bytes
+        start += len(topic_bytes)
+        self._mmap[start : start + len(payload)] = payload
+
+        self._head = offset + length
+        self._count += 1
+        if retain:
+            if topic in self._latest_retained:
+                self.superseded += 1
+            self._latest_retained[topic] = offset
+        self._write_header()
+        self._mmap.flush()
+        return True
+
+    def _drop_oldest(self) -> None:
+        """Drop the message at the tail to make room."""
+        self._pop()
+        self.dropped += 1
+
+    def _pop(self) -> SpooledMessage:
+        """Remove and return the message at the tail."""
+        offset = self._tail = self._wrap(self._tail)
+        length, qos, retain, topic_len = RECORD_HEADER.unpack_from(self._mmap, offset)
+        start = offset + RECORD_HEADER.size
+        topic = self._mmap[start : start + topic_len].decode("utf-8")
+        payload = self._mmap[start + topic_len : offset + length]
+
+        self._tail = offset + length
+        self._count -= 1
+        if self._count == 0:
+            self._head = self._tail = DATA_START
+        if retain and self._latest_retained.get(topic) == offset:
+            del self._latest_retained[topic]
+        return SpooledMessage(topic, payload, qos, bool(retain))
+
+    def pop(self) -> Optional[SpooledMessage]:
+        """Remove and return the oldest message that wasn't superseded."""
+        while self._count:
+            offset = self._wrap(self._tail)
+            message = self._pop()
+            if message.retain and offset != self._latest_retained.get(
+                message.topic, offset
+            ):
+                continue
+            self._write_header()
+            return message
+
+        self._write_header()
+        return None
+
+    def close(self) -> None:
+        """Flush and close the spool file."""
+        self._mmap.flush()
+        self._mmap.close()
+        self._file.close()
+
+
+def encode_payload(payload: PublishPayloadType) -> bytes:
+    """Encode a payload the way paho does when publishing."""
+    if payload is None:
+        return b""
+    if isinstance(payload, (bytes, bytearray)):
+        return bytes(payload)
+    if isinstance(payload, str):
+        return payload.encode("utf-8")
+    return str(payload).encode("ascii")
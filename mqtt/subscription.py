@@ -29,17 +29,17 @@ class EntitySubscription:
         if not self._should_resubscribe(other):
             return
 
+        # Subscribe before unsubscribing, so a topic filter staying the same
+        # isn't unsubscribed from the broker and the new subscription is
+        # served the cached retained messages right away.
+        if self.topic is not None:
+            self.unsubscribe_callback = await mqtt.async_subscribe(
+                hass, self.topic, self.message_callback, self.qos, self.encoding
+            )
+
         if other is not None and other.unsubscribe_callback is not None:
             other.unsubscribe_callback()
 
-        if self.topic is None:
-            # We were asked to remove the subscription or not to create it
-            return
-
-        self.unsubscribe_callback = await mqtt.async_subscribe(
-            hass, self.topic, self.message_callback, self.qos, self.encoding
-        )
-
     def _should_resubscribe(self, other):
         """Check if we should re-subscribe to the topic using the old state."""
         if other is None:
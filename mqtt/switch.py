@@ -35,6 +35,7 @@ from . import (
     subscription,
 )
 from .discovery import MQTT_DISCOVERY_NEW, clear_discovery_hash
+from .templates import async_render_message
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -168,7 +169,7 @@ class MqttSwitch(
             """Handle new MQTT state messages."""
             payload = msg.payload
             if template is not None:
-                payload = template.async_render_with_possible_json_value(payload)
+                payload = async_render_message(template, msg)
             if payload == self._state_on:
                 self._state = True
             elif payload == self._state_off:
@@ -0,0 +1,173 @@
+"""Render templates with the payload of received MQTT messages."""
+from functools import lru_cache
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+import jinja2
+from jinja2 import nodes
+from jinja2.filters import do_float, do_int
+
+from homeassistant.core import callback
+from homeassistant.exceptions import TemplateError
+from homeassistant.helpers.template import Template, forgiving_round
+
+from .models import Message
+
+_LOGGER = logging.getLogger(__name__)
+
+_SENTINEL = object()
+_NOT_SIMPLE = object()
+
+# The filters of simple templates, as the template environment defines them
+SIMPLE_FILTERS = {"float": do_float, "int": do_int, "round": forgiving_round}
+
+# Number of template sources whose analysis is cached
+SIMPLE_TEMPLATE_CACHE_SIZE = 1024
+
+_PARSER = jinja2.Environment()
+
+
+class SimpleTemplate:
+    """Template only looking up a value in the payload.
+
+    Like {{ value_json.ENERGY.Power | float }}, the value, value_json or a
+    path of attributes and constant subscripts in it, optionally followed by
+    float, int and round filters with constant arguments. Rendering looks
+    the path up directly, and returns _NOT_SIMPLE when Jinja would have to
+    resolve something else, like a missing key or a dict method.
+    """
+
+    __slots__ = ("name", "path", "filters")
+
+    def __init__(
+        self,
+        name: str,
+        path: List[Tuple[Any, bool]],
+        filters: List[Tuple[str, List[Any]]],
+    ) -> None:
+        """Initialize the template from the variable, path and filters."""
+        self.name = name
+        self.path = path
+        self.filters = filters
+
+    def render(self, msg: Message) -> Any:
+        """Render the template with a message, like Jinja would."""
+        if self.name == "value":
+            value = msg.payload
+        else:
+            try:
+                value = msg.payload_json()
+            except ValueError:
+                return _NOT_SIMPLE
+
+        for key, attribute in self.path:
+            if type(value) is dict:  # pylint: disable=unidiomatic-typecheck
+                # Jinja prefers the attributes of the dict to its keys
+                if key not in value or (attribute and hasattr(value, key)):
+                    return _NOT_SIMPLE
+            elif type(value) is list:  # pylint: disable=unidiomatic-typecheck
+                if type(key) is not int or not -len(value) <= key < len(value):
+                    return _NOT_SIMPLE
+            else:
+                return _NOT_SIMPLE
+            value = value[key]
+
+        for name, args in self.filters:
+            value = SIMPLE_FILTERS[name](value, *args)
+
+        return str(value).strip()
+
+
+@lru_cache(maxsize=SIMPLE_TEMPLATE_CACHE_SIZE)
+def simple_template(source: str) -> Optional[SimpleTemplate]:
+    """Return the simple template of a template source, None if it isn't."""
+    try:
+        body = _PARSER.parse(source).body
+    except jinja2.TemplateSyntaxError:
+        return None
+    if len(body) != 1 or not isinstance(body[0], nodes.Output):
+        return None
+
+    expressions = [
+        node
+        for node in body[0].nodes
+        # Whitespace around the expression is stripped from the result
+        if not isinstance(node, nodes.TemplateData) or node.data.strip()
+    ]
+    if len(expressions) != 1:
+        return None
+    node = expressions[0]
+
+    filters: List[Tuple[str, List[Any]]] = []
+    while isinstance(node, nodes.Filter):
+        if (
+            node.name not in SIMPLE_FILTERS
+            or node.kwargs
+            or node.dyn_args is not None
+            or node.dyn_kwargs is not None
+            or not all(isinstance(arg, nodes.Const) for arg in node.args)
+        ):
+            return None
+        filters.insert(0, (node.name, [arg.value for arg in node.args]))
+        node = node.node
+
+    path: List[Tuple[Any, bool]] = []
+    while isinstance(node, (nodes.Getattr, nodes.Getitem)):
+        if isinstance(node, nodes.Getattr):
+            path.insert(0, (node.attr, True))
+        elif isinstance(node.arg, nodes.Const) and isinstance(
+            node.arg.value, (str, int)
+        ):
+            path.insert(0, (node.arg.value, False))
+        else:
+            return None
+        node = node.node
+
+    if not isinstance(node, nodes.Name) or node.name not in ("value", "value_json"):
+        return None
+    return SimpleTemplate(node.name, path, filters)
+
+
+@callback
+def async_render_message(
+    value_template: Template,
+    msg: Message,
+    error_value: Any = _SENTINEL,
+    variables: Optional[Dict[str, Any]] = None,
+) -> Any:
+    """Render a template with the payload of a message as value.
+
+    Works like Template.async_render_with_possible_json_value, but value_json
+    is the JSON of the message parsed once for all its subscribers, and
+    simple templates are rendered without Jinja.
+    """
+    simple = simple_template(value_template.template)
+    if simple is not None:
+        rendered = simple.render(msg)
+        if rendered is not _NOT_SIMPLE:
+            return rendered
+
+    variables = dict(variables or {})
+    variables["value"] = msg.payload
+    try:
+        variables["value_json"] = msg.payload_json()
+    except ValueError:
+        pass
+
+    try:
+        return value_template.async_render(variables)
+    except TemplateError as ex:
+        if error_value is _SENTINEL:
+            _LOGGER.error(
+                "Error parsing value: %s (value: %s, template: %s)",
+                ex,
+                msg.payload,
+                value_template.template,
+            )
+        return msg.payload if error_value is _SENTINEL else error_value
+
+
+@callback
+def async_render_payload(msg: Message) -> Any:
+    """Return the payload of a message, for values without a template."""
+    return msg.payload
@@ -0,0 +1,114 @@
+"""Ring buffer of the last MQTT messages for diagnostics."""
+import json
+import time
+from typing import Any, Dict, List, Optional, Sequence
+
+from .matcher import TopicMatcher, match_topic
+from .models import PublishPayloadType
+
+DIRECTION_IN = "in"
+DIRECTION_OUT = "out"
+
+
+class MessageTracer:
+    """Fixed size ring buffer with the last received and sent messages.
+
+    Records the topic, payload size, QoS, retain flag, time and for
+    received messages the number of matched subscriptions, but not the
+    payload. The columns are preallocated lists, so recording a message
+    only overwrites a slot in each. With topic filters only messages on
+    matching topics are recorded.
+    """
+
+    def __init__(self, size: int, topic_filters: Sequence[str] = ()) -> None:
+        """Initialize the tracer."""
+        self.size = size
+        self._next = 0
+        self._count = 0
+        self._times = [0.0] * size
+        self._directions = [DIRECTION_IN] * size
+        self._topics = [""] * size
+        self._sizes = [0] * size
+        self._qos = [0] * size
+        self._retain = [False] * size
+        self._subscribers: List[Optional[int]] = [None] * size
+        self._filters: Optional[TopicMatcher] = None
+        if topic_filters:
+            self._filters = TopicMatcher()
+            for topic_filter in topic_filters:
+                self._filters.add(topic_filter, topic_filter)
+
+    def __len__(self) -> int:
+        """Return the number of recorded messages in the buffer."""
+        return min(self._count, self.size)
+
+    def record(
+        self,
+        direction: str,
+        topic: str,
+        size: int,
+        qos: int,
+        retain: bool,
+        subscribers: Optional[int] = None,
+    ) -> None:
+        """Record a message, overwriting the oldest one if the buffer is full."""
+        if self._filters is not None and not self._filters.match(topic):
+            return
+        index = self._next
+        self._times[index] = time.time()
+        self._directions[index] = direction
+        self._topics[index] = topic
+        self._sizes[index] = size
+        self._qos[index] = qos
+        self._retain[index] = bool(retain)
+        self._subscribers[index] = subscribers
+        self._next = (index + 1) % self.size
+        self._count += 1
+
+    def entries(
+        self, topic_filter: Optional[str] = None, limit: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        """Return the recorded messages, oldest first.
+
+        Only messages on topics matching topic_filter and at most the last
+        limit messages are returned.
+        """
+        length = len(self)
+        start = (self._next - length) % self.size
+        entries = []
+        for offset in range(length):
+            index = (start + offset) % self.size
+            topic = self._topics[index]
+            if topic_filter is not None and not match_topic(topic_filter, topic):
+                continue
+            entries.append(
+                {
+                    "time": self._times[index],
+                    "direction": self._directions[index],
+                    "topic": topic,
+                    "size": self._sizes[index],
+                    "qos": self._qos[index],
+                    "retain": self._retain[index],
+                    "subscribers": self._subscribers[index],
+                }
+            )
+        if limit is not None:
+            entries = entries[-limit:]
+        return entries
+
+
+def payload_size(payload: PublishPayloadType) -> int:
+    """Return the size in bytes of a payload to publish."""
+    if payload is None:
+        return 0
+    if isinstance(payload, (bytes, bytearray)):
+        return len(payload)
+    return len(str(payload).encode("utf-8"))
+
+
+def write_entries(path: str, entries: List[Dict[str, Any]]) -> None:
+    """Write recorded messages to a file as JSON lines."""
+    with open(path, "w") as dump:
+        for entry in entries:
+            dump.write(json.dumps(entry))
+            dump.write("\n")
@@ -33,6 +33,7 @@ from homeassistant.components.mqtt import (
     subscription,
 )
 
+from ..templates import async_render_message
 from .schema import MQTT_VACUUM_SCHEMA, services_to_strings, strings_to_services
 
 _LOGGER = logging.getLogger(__name__)
@@ -285,9 +286,9 @@ class MqttVacuum(
                 msg.topic == self._state_topics[CONF_BATTERY_LEVEL_TOPIC]
                 and self._templates[CONF_BATTERY_LEVEL_TEMPLATE]
             ):
-                battery_level = self._templates[
-                    CONF_BATTERY_LEVEL_TEMPLATE
-                ].async_render_with_possible_json_value(msg.payload, error_value=None)
+                battery_level = async_render_message(
+                    self._templates[CONF_BATTERY_LEVEL_TEMPLATE], msg, error_value=None
+                )
                 if battery_level:
                     self._battery_level = int(battery_level)
 
@@ -295,9 +296,9 @@ class MqttVacuum(
                 msg.topic == self._state_topics[CONF_CHARGING_TOPIC]
                 and self._templates[CONF_CHARGING_TEMPLATE]
             ):
-                charging = self._templates[
-                    CONF_CHARGING_TEMPLATE
-                ].async_render_with_possible_json_value(msg.payload, error_value=None)
+                charging = async_render_message(
+                    self._templates[CONF_CHARGING_TEMPLATE], msg, error_value=None
+                )
                 if charging:
                     self._charging = cv.boolean(charging)
 
@@ -305,9 +306,9 @@ class MqttVacuum(
                 msg.topic == self._state_topics[CONF_CLEANING_TOPIC]
                 and self._templates[CONF_CLEANING_TEMPLATE]
             ):
-                cleaning = self._templates[
-                    CONF_CLEANING_TEMPLATE
-                ].async_render_with_possible_json_value(msg.payload, error_value=None)
+                cleaning = async_render_message(
+                    self._templates[CONF_CLEANING_TEMPLATE], msg, error_value=None
+                )
                 if cleaning:
                     self._cleaning = cv.boolean(cleaning)
 
@@ -315,9 +316,9 @@ class MqttVacuum(
                 msg.topic == self._state_topics[CONF_DOCKED_TOPIC]
                 and self._templates[CONF_DOCKED_TEMPLATE]
             ):
-                docked = self._templates[
-                    CONF_DOCKED_TEMPLATE
-                ].async_render_with_possible_json_value(msg.payload, error_value=None)
+                docked = async_render_message(
+                    self._templates[CONF_DOCKED_TEMPLATE], msg, error_value=None
+                )
                 if docked:
                     self._docked = cv.boolean(docked)
 
@@ -325,9 +326,9 @@ class MqttVacuum(
                 msg.topic == self._state_topics[CONF_ERROR_TOPIC]
                 and self._templates[CONF_ERROR_TEMPLATE]
             ):
-                error = self._templates[
-                    CONF_ERROR_TEMPLATE
-                ].async_render_with_possible_json_value(msg.payload, error_value=None)
+                error = async_render_message(
+                    self._templates[CONF_ERROR_TEMPLATE], msg, error_value=None
+                )
                 if error is not None:
                     self._error = cv.string(error)
 
@@ -347,9 +348,9 @@ class MqttVacuum(
                 msg.topic == self._state_topics[CONF_FAN_SPEED_TOPIC]
                 and self._templates[CONF_FAN_SPEED_TEMPLATE]
             ):
-                fan_speed = self._templates[
-                    CONF_FAN_SPEED_TEMPLATE
-                ].async_render_with_possible_json_value(msg.payload, error_value=None)
+                fan_speed = async_render_message(
+                    self._templates[CONF_FAN_SPEED_TEMPLATE], msg, error_value=None
+                )
                 if fan_speed:
                     self._fan_speed = fan_speed
 
@@ -46,6 +46,7 @@ from homeassistant.components.mqtt import (
     CONF_QOS,
 )
 
+from ..templates import async_render_message
 from .schema import MQTT_VACUUM_SCHEMA, services_to_strings, strings_to_services
 
 _LOGGER = logging.getLogger(__name__)
@@ -247,11 +248,11 @@ class MqttStateVacuum(
         @callback
         def state_message_received(msg):
             """Handle state MQTT message."""
-            payload = msg.payload
             if template is not None:
-                payload = template.async_render_with_possible_json_value(payload)
+                payload = async_render_message(template, msg)
             else:
-                payload = json.loads(payload)
+                # Copy the JSON shared with other subscribers before changing it
+                payload = dict(msg.payload_json())
             if STATE in payload and payload[STATE] in POSSIBLE_STATES:
                 self._state = POSSIBLE_STATES[payload[STATE]]
                 del payload[STATE]